@@ -3,31 +3,57 @@ import json
 import re
 import logging
 import hashlib
-import requests
+import hmac
+import copy
+import gc
+import threading
+import time
 import unicodedata
 from html import escape
+from urllib.parse import quote
 from datetime import datetime, timedelta
+from collections.abc import Sequence
+from contextlib import contextmanager
 from functools import wraps
+from pathlib import Path
 from logging.handlers import RotatingFileHandler
 
 import heapq
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
+from flask import (
+    Flask, Response, render_template, request, jsonify, session, redirect, url_for, flash, stream_with_context,
+    has_request_context, g,
+)
 from dotenv import load_dotenv
 
 # Cargar variables de entorno ANTES de Config para que os.getenv() las encuentre
 load_dotenv()
 
 from config import PORT
-from scripts.utils import AUDITORIA_DATA
+from scripts.utils import AUDITORIA_DATA, FUENTES_XLSX, HUELLA_FUENTES, calcular_huella_fuentes, cargar_auditoria_data
+from scripts.cache import CacheCompartido, CacheRespuestasGeneradas, SistemaCache
+from scripts.historial import HistorialChat, nuevo_id_conversacion
+from scripts.metricas import MonitorRendimiento, memoria_proceso
+from scripts.trazas import Trazador, span
+from scripts.registro_consultas import RegistroConsultas, leer_registros, minar_consultas_frecuentes
+from scripts.indice_invertido import IndiceInvertido
+from scripts.indice_incremental import (
+    MetadatosSegmentados,
+    SecuenciaConcatenada,
+    SegmentoDelta,
+    deriva_idf,
+    frecuencias_documentales,
+    registros_agregados,
+)
+from scripts.indice_persistido import Metadato, TablaMetadatos, calcular_version, cargar_indice, guardar_indice
+from scripts.vectorizador import VectorizadorConsultas, ajustar_vectorizador
 from scripts.auth import (
     authenticate,
     get_authorized_users,
     get_canonical_username,
     get_user_display_name,
+    is_admin,
     is_authenticated,
     login_required,
 )
@@ -90,16 +116,64 @@ class Config:
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
     MAX_QUESTION_LENGTH = 2000
     MIN_QUESTION_LENGTH = 3
+    BATCH_MAX_PREGUNTAS = int(os.getenv("AUDITEL_BATCH_MAX_PREGUNTAS") or 500)
     
     # Rendimiento
-    CACHE_SIZE = 100
+    CACHE_SIZE = 2000
+    CACHE_TTL = 60 * 60  # 1 hora en segundos
+    CACHE_TTL_SIN_RESULTADO = 10 * 60  # consultas sin coincidencia (caché negativa)
+    # Caché compartida entre workers (SQLite); se activa con AUDITEL_CACHE_COMPARTIDO=1
+    CACHE_COMPARTIDO = (os.getenv("AUDITEL_CACHE_COMPARTIDO") or "0").strip().lower() in ("1", "true", "si", "sí")
+    CACHE_COMPARTIDO_RUTA = os.getenv("AUDITEL_CACHE_COMPARTIDO_RUTA") or "logs/cache_compartido.sqlite3"
+    CACHE_COMPARTIDO_MAX = 20000
     SEARCH_RESULTS_LIMIT = 8
-    CHAT_HISTORY_LIMIT = 10
+    # Historial en SQLite del servidor; la cookie sólo lleva el id de la conversación
+    CHAT_HISTORY_LIMIT = int(os.getenv("AUDITEL_HISTORIAL_MAX") or 50)
+    HISTORIAL_RUTA = os.getenv("AUDITEL_HISTORIAL_RUTA") or "logs/historial_chat.sqlite3"
+    HISTORIAL_RETENCION = 30 * 24 * 60 * 60  # 30 días en segundos
+    # Registro estructurado de consultas (JSONL, rotado por logrotate) y precalentamiento de la caché al arrancar
+    REGISTRO_CONSULTAS_RUTA = os.getenv("AUDITEL_REGISTRO_CONSULTAS") or "logs/consultas.jsonl"
+    PRECALENTAR_TOP = int(os.getenv("AUDITEL_PRECALENTAR_TOP") or 100)
+    # Sólo se mina el final del registro: acota el costo de cada arranque y recarga
+    PRECALENTAR_MAX_BYTES = int(float(os.getenv("AUDITEL_PRECALENTAR_MAX_MB") or 4) * 1024 * 1024)
+    # Métricas por worker publicadas en un directorio común y sumadas en /metrics/prometheus
+    METRICAS_DIR = os.getenv("AUDITEL_METRICAS_DIR") or "logs/metricas"
+    METRICAS_TOKEN = (os.getenv("AUDITEL_METRICAS_TOKEN") or "").strip()
+    # Trazas por etapa de /ask: fracción muestreada (0 = desactivadas), archivo Chrome Trace y copia en el JSON
+    TRAZAS_MUESTREO = float(os.getenv("AUDITEL_TRAZAS_MUESTREO") or 0)
+    TRAZAS_RUTA = os.getenv("AUDITEL_TRAZAS_RUTA") or "logs/trazas.json"
+    TRAZAS_MAX_BYTES = int(float(os.getenv("AUDITEL_TRAZAS_MAX_MB") or 10) * 1024 * 1024)
+    TRAZAS_EN_RESPUESTA = (os.getenv("AUDITEL_TRAZAS_EN_RESPUESTA") or "0").strip().lower() in ("1", "true", "si", "sí")
+    # Recarga en caliente: cada worker revisa las fuentes XLSX y la marca de recarga manual (0 = no vigilar)
+    RECARGA_INTERVALO = float(os.getenv("AUDITEL_RECARGA_INTERVALO") or 30)
+    RECARGA_MARCA = os.getenv("AUDITEL_RECARGA_MARCA") or "logs/recarga.marca"
+    # Token para /api/admin/recargar sin sesión (despliegues, cron); vacío = sólo administradores con sesión
+    ADMIN_TOKEN = (os.getenv("AUDITEL_ADMIN_TOKEN") or "").strip()
     
     # Motor de búsqueda
     TFIDF_MAX_FEATURES = 5000
     SIMILARITY_THRESHOLD = 0.1
     TOP_N_RESULTS = 3
+    # "matricial" (producto disperso) o "invertido" (postings con poda max-score)
+    MOTOR_PUNTUACION = (os.getenv("AUDITEL_MOTOR_PUNTUACION") or "matricial").strip().lower()
+    # Índice incremental: registros agregados al final de las fuentes van a segmentos delta (IDF del
+    # índice base) hasta que la deriva de IDF, las filas delta, los términos nuevos o los segmentos
+    # superan su límite y se compacta (reconstrucción completa). Ver scripts/indice_incremental.py
+    INDICE_INCREMENTAL = (os.getenv("AUDITEL_INDICE_INCREMENTAL") or "1").strip().lower() in ("1", "true", "si", "sí")
+    INCREMENTAL_DERIVA_MAX = float(os.getenv("AUDITEL_INCREMENTAL_DERIVA_MAX") or 0.1)
+    INCREMENTAL_MAX_FRACCION = 0.1  # filas en deltas / filas del índice base
+    INCREMENTAL_MAX_TOKENS_NUEVOS = 0.2  # tokens de los deltas fuera del vocabulario base
+    INCREMENTAL_MAX_SEGMENTOS = 8
+
+    # Proveedor de chat (Qwen, API compatible con /chat/completions); se activa con QWEN_API_KEY
+    QWEN_BASE_URL = os.getenv("QWEN_BASE_URL") or "https://dashscope-intl.aliyuncs.com/compatible-mode/v1"
+    QWEN_MODEL_DEFAULT = "qwen-plus"
+    LLM_PLAZO = float(os.getenv("AUDITEL_LLM_PLAZO") or 25)  # muy por debajo del timeout de gunicorn (120 s)
+    LLM_MAX_CONCURRENCIA = int(os.getenv("AUDITEL_LLM_MAX_CONCURRENCIA") or 4)
+    LLM_REINTENTOS = int(os.getenv("AUDITEL_LLM_REINTENTOS") or 2)
+    # Respuestas generadas por (consulta, registros recuperados, versión) y casi-duplicados (coseno TF-IDF)
+    LLM_CACHE_SIZE = 1000
+    LLM_CACHE_UMBRAL_SIMILITUD = float(os.getenv("AUDITEL_LLM_CACHE_UMBRAL") or 0.9)
 
 
 AUTO_AUDITORIA = "auto"
@@ -131,7 +205,7 @@ def obtener_chatbot_config():
 
     if qwen_ready:
         status_copy = (
-            "La configuración base ya fue detectada. La interfaz puede conectarse al proveedor cuando se implemente el backend."
+            "Proveedor conectado. Las respuestas incluyen una explicación generada a partir de las normativas encontradas."
         )
     else:
         status_copy = (
@@ -179,93 +253,25 @@ app.config['SESSION_COOKIE_SECURE'] = True
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 
 # =============================================================================
-# SISTEMA DE CACHÉ MEJORADO
+# SISTEMA DE MONITOREO DE RENDIMIENTO
 # =============================================================================
 
-class SistemaCache:
-    def __init__(self, max_size=100):
-        self.cache = {}
-        self.max_size = max_size
-        self.access_order = []
-    
-    def _generar_clave(self, consulta, auditoria_tipo):
-        """Genera clave única para la consulta"""
-        contenido = f"{consulta}_{auditoria_tipo}".encode('utf-8')
-        return hashlib.md5(contenido).hexdigest()
-    
-    def obtener(self, consulta, auditoria_tipo):
-        clave = self._generar_clave(consulta, auditoria_tipo)
-        if clave in self.cache:
-            # Mover al final (más reciente)
-            if clave in self.access_order:
-                self.access_order.remove(clave)
-            self.access_order.append(clave)
-            return self.cache[clave]
-        return None
-    
-    def guardar(self, consulta, auditoria_tipo, resultado):
-        clave = self._generar_clave(consulta, auditoria_tipo)
-        
-        # Gestionar tamaño máximo
-        if len(self.cache) >= self.max_size and self.access_order:
-            clave_mas_antigua = self.access_order.pop(0)
-            del self.cache[clave_mas_antigua]
-        
-        self.cache[clave] = resultado
-        self.access_order.append(clave)
-        
-    def estadisticas(self):
-        return {
-            'tamaño_actual': len(self.cache),
-            'tamaño_maximo': self.max_size,
-            'claves': list(self.cache.keys())[:5]  # Primeras 5 claves como muestra
-        }
+def _endpoint_actual():
+    """Regla de la ruta en curso (p. ej. "/ask"); "interno" fuera de una solicitud (precalentamiento, CLI)."""
+    if has_request_context() and request.url_rule is not None:
+        return request.url_rule.rule
+    return "interno"
 
-# =============================================================================
-# SISTEMA DE MONITOREO DE RENDIMIENTO
-# =============================================================================
 
-class MonitorRendimiento:
-    def __init__(self):
-        self.metricas = {
-            'solicitudes_totales': 0,
-            'solicitudes_exitosas': 0,
-            'solicitudes_fallidas': 0,
-            'tiempo_respuesta_promedio': 0,
-            'cache_hits': 0,
-            'cache_misses': 0,
-            'errores_por_tipo': {}
-        }
-        self.tiempos_solicitud = []
-    
-    def registrar_solicitud(self, exitosa, tiempo_procesamiento):
-        self.metricas['solicitudes_totales'] += 1
-        if exitosa:
-            self.metricas['solicitudes_exitosas'] += 1
-        else:
-            self.metricas['solicitudes_fallidas'] += 1
-        
-        self.tiempos_solicitud.append(tiempo_procesamiento)
-        # Mantener solo últimos 100 registros
-        if len(self.tiempos_solicitud) > 100:
-            self.tiempos_solicitud.pop(0)
-        
-        if self.tiempos_solicitud:
-            self.metricas['tiempo_respuesta_promedio'] = sum(self.tiempos_solicitud) / len(self.tiempos_solicitud)
-    
-    def registrar_cache_hit(self):
-        self.metricas['cache_hits'] += 1
-    
-    def registrar_cache_miss(self):
-        self.metricas['cache_misses'] += 1
-    
-    def registrar_error(self, tipo_error):
-        if tipo_error not in self.metricas['errores_por_tipo']:
-            self.metricas['errores_por_tipo'][tipo_error] = 0
-        self.metricas['errores_por_tipo'][tipo_error] += 1
-    
-    def obtener_metricas(self):
-        return self.metricas.copy()
+@contextmanager
+def medir_etapa(etapa):
+    """Observa la duración del bloque en el histograma (endpoint, etapa) y, si la solicitud está muestreada, en su traza."""
+    inicio = time.perf_counter()
+    try:
+        with span(etapa):
+            yield
+    finally:
+        monitor_rendimiento.observar(_endpoint_actual(), etapa, time.perf_counter() - inicio)
 
 # =============================================================================
 # CONFIGURACIÓN DE AUDITORÍAS
@@ -300,20 +306,21 @@ ESTADISTICAS_DB = {}
 # CARGA OPTIMIZADA DE BASES DE DATOS
 # =============================================================================
 
-def cargar_bases_datos():
+def cargar_bases_datos(auditoria_data=None):
     """Carga todas las bases de datos de auditorías de forma optimizada"""
+    auditoria_data = AUDITORIA_DATA if auditoria_data is None else auditoria_data
     bases_cargadas = {}
     estadisticas = {}
 
     for auditoria_nombre, config in AUDITORIA_CONFIG.items():
         try:
-            datos = AUDITORIA_DATA.get(auditoria_nombre)
+            datos = auditoria_data.get(auditoria_nombre)
             if datos is None:
                 logger.error(f"❌ Archivo no encontrado: {config['archivo']}")
                 continue
 
-            # Validar estructura básica
-            if not isinstance(datos, list):
+            # Validar estructura básica (lista en memoria o vista mapeada del índice persistido)
+            if not isinstance(datos, Sequence) or isinstance(datos, str):
                 logger.error(f"❌ Estructura inválida en {config['archivo']}: se esperaba lista")
                 continue
 
@@ -340,46 +347,168 @@ def cargar_bases_datos():
 # Cargar bases de datos al inicio
 DB_AUDITORIA, ESTADISTICAS_DB = cargar_bases_datos()
 
+# =============================================================================
+# NORMALIZACIÓN DE TEXTO
+# =============================================================================
+
+def normalizar_texto_comparable(texto):
+    """Normaliza texto para comparaciones semánticas simples."""
+    if not texto:
+        return ""
+
+    texto = unicodedata.normalize("NFKD", str(texto))
+    texto = "".join(caracter for caracter in texto if not unicodedata.combining(caracter))
+    texto = texto.lower()
+    texto = re.sub(r"[^a-z0-9\s]", " ", texto)
+    texto = re.sub(r"\s+", " ", texto).strip()
+    return texto
+
+
+def extraer_tokens_relevantes(texto, auditoria_tipo=None):
+    """Extrae términos útiles y elimina palabras demasiado genéricas."""
+    texto_normalizado = normalizar_texto_comparable(texto)
+    if not texto_normalizado:
+        return []
+
+    palabras_omitidas = set(PALABRAS_GENERICAS_CONSULTA)
+    palabras_omitidas.update(PALABRAS_GENERICAS_POR_AUDITORIA.get(auditoria_tipo, set()))
+
+    tokens = []
+    for token in texto_normalizado.split():
+        if token in palabras_omitidas:
+            continue
+        if len(token) <= 2 and not token.isdigit():
+            continue
+        tokens.append(token)
+
+    return tokens
+
+
+def precalcular_textos_normalizados(item, auditoria):
+    """Textos normalizados y tokens de un registro, calculados una sola vez al construir el corpus.
+
+    Los tokens (``frozenset`` por campo) excluyen sólo las palabras genéricas
+    globales; las específicas de cada auditoría se descartan al comparar.
+    """
+    campos = {
+        'tipo_irregularidad': item.get('tipo', 'No especificado'),
+        'concepto': item.get('concepto', ''),
+        'descripcion': item.get('descripcion_irregularidad', ''),
+    }
+    normativas = {}
+    for campo_normativa in AUDITORIA_CONFIG.get(auditoria, {}).get('campos_normativas', []):
+        if item.get(campo_normativa):
+            nombre_amigable = campo_normativa.replace('_', ' ').title()
+            normativas[nombre_amigable] = normalizar_texto_comparable(item[campo_normativa])
+
+    return {
+        'textos': {campo: normalizar_texto_comparable(valor) for campo, valor in campos.items()},
+        'tokens': {campo: frozenset(extraer_tokens_relevantes(valor)) for campo, valor in campos.items()},
+        'normativas': normativas,
+    }
+
+
 # =============================================================================
 # MOTOR DE BÚSQUEDA SEMÁNTICA MEJORADO
 # =============================================================================
 
 class MotorBusquedaNormativasMejorado:
-    def __init__(self):
-        self.vectorizer = TfidfVectorizer(
-            stop_words=['el', 'la', 'de', 'en', 'y', 'o', 'un', 'una', 'es', 'son'],
-            min_df=1,
-            max_df=0.9,
-            max_features=Config.TFIDF_MAX_FEATURES
-        )
+    MOTORES_PUNTUACION = ("matricial", "invertido")
+
+    PARAMETROS_VECTORIZADOR = {
+        'stop_words': ['el', 'la', 'de', 'en', 'y', 'o', 'un', 'una', 'es', 'son'],
+        'min_df': 1,
+        'max_df': 0.9,
+        'max_features': Config.TFIDF_MAX_FEATURES,
+    }
+
+    # Incrementar si cambia normalizar_texto_comparable/extraer_tokens_relevantes (textos precalculados)
+    VERSION_NORMALIZACION = 1
+
+    def __init__(self, motor_puntuacion=None, datos=None, huella=None):
+        # Cada motor conserva sus propios registros: una recarga construye otro motor completo
+        self.datos = DB_AUDITORIA if datos is None else datos
+        self.huella = HUELLA_FUENTES if huella is None else huella
+        # VectorizadorConsultas (sin scikit-learn) una vez ajustado o cargado el índice
+        self.vectorizer = None
+        self.version_indice = calcular_version(self.huella, self._parametros_indice())
+        # Índice base (ajuste TF-IDF completo) y segmentos delta agregados después (ver con_registros_agregados)
+        self.version_base = self.version_indice
+        self.segmentos = []
+        self.indice_desde_disco = False
         self.matriz_tfidf_unificada = None
+        self.postings_por_termino = None
         self.metadatos_unificados = []
+        self.indices_por_auditoria = {}
+        self.indice_invertido = None
+        self._mascaras_auditoria = {}
+        self.motor_puntuacion = motor_puntuacion or Config.MOTOR_PUNTUACION
+        if self.motor_puntuacion not in self.MOTORES_PUNTUACION:
+            logger.warning(f"⚠️ Motor de puntuación desconocido '{self.motor_puntuacion}', se usa 'matricial'")
+            self.motor_puntuacion = "matricial"
         self._inicializado = False
         
         self._preparar_datos_unificados()
 
+    def _parametros_indice(self):
+        return {
+            **self.PARAMETROS_VECTORIZADOR,
+            'normalizacion': self.VERSION_NORMALIZACION,
+            'palabras_genericas': sorted(PALABRAS_GENERICAS_CONSULTA),
+        }
+
     def _preparar_datos_unificados(self):
         """Prepara todos los datos en un solo corpus para mejor consistencia"""
-        todos_documentos = []
-        self.metadatos_unificados = []
-        
-        for auditoria, datos in DB_AUDITORIA.items():
-            for idx, item in enumerate(datos):
-                texto_documento = self._crear_documento_texto(item)
-                todos_documentos.append(texto_documento)
-                self.metadatos_unificados.append({
-                    'indice': len(todos_documentos) - 1,
-                    'auditoria': auditoria,
-                    'item': item,
-                    'tipo': item.get('tipo', ''),
-                    'descripcion': item.get('descripcion_irregularidad', '')
-                })
+        # Tabla compacta (arreglos) en vez de un dict por fila; los ítems se leen bajo demanda
+        self.metadatos_unificados = TablaMetadatos(self.datos)
+
+        # Filas de cada auditoría (ordenadas) para filtrar candidatos sin recorrer el corpus
+        self.indices_por_auditoria = {
+            auditoria: np.flatnonzero(self.metadatos_unificados.codigos == codigo)
+            for codigo, auditoria in enumerate(self.metadatos_unificados.auditorias)
+        }
+        conteos = {auditoria: len(filas) for auditoria, filas in self.indices_por_auditoria.items()}
         
-        if todos_documentos:
+        if len(self.metadatos_unificados):
             try:
-                self.matriz_tfidf_unificada = self.vectorizer.fit_transform(todos_documentos)
+                if not self._cargar_indice_persistido(conteos):
+                    todos_documentos = [
+                        self._crear_documento_texto(item)
+                        for datos in self.datos.values()
+                        for item in datos
+                    ]
+                    self.vectorizer, self.matriz_tfidf_unificada = ajustar_vectorizador(
+                        todos_documentos, self.PARAMETROS_VECTORIZADOR,
+                    )
+                    # Listas de postings (término -> documentos) para puntuar sólo lo que toca la consulta
+                    self.postings_por_termino = self.matriz_tfidf_unificada.T.tocsr()
+                    # Textos normalizados y tokens por fila para que el re-ranking no renormalice
+                    self.metadatos_unificados.normalizados = [
+                        precalcular_textos_normalizados(item, auditoria)
+                        for auditoria, datos in self.datos.items()
+                        for item in datos
+                    ]
+                    guardar_indice(
+                        self.version_indice,
+                        self.huella,
+                        self._parametros_indice(),
+                        self.vectorizer.vocabulary_,
+                        self.vectorizer.idf_,
+                        self.matriz_tfidf_unificada,
+                        self.postings_por_termino,
+                        self.metadatos_unificados.normalizados,
+                        conteos,
+                        self.vectorizer.stop_words_,
+                    )
+                if self.motor_puntuacion == "invertido":
+                    self.indice_invertido = IndiceInvertido(self.postings_por_termino)
+                    self._mascaras_auditoria = {}
+                    for auditoria, filas in self.indices_por_auditoria.items():
+                        mascara = np.zeros(len(self.metadatos_unificados), dtype=bool)
+                        mascara[filas] = True
+                        self._mascaras_auditoria[auditoria] = mascara
                 self._inicializado = True
-                logger.info(f"✅ Motor unificado preparado: {len(todos_documentos)} documentos totales")
+                logger.info(f"✅ Motor unificado preparado: {len(self.metadatos_unificados)} documentos totales")
             except Exception as e:
                 logger.error(f"❌ Error preparando motor unificado: {e}")
                 self._inicializado = False
@@ -387,6 +516,29 @@ class MotorBusquedaNormativasMejorado:
             logger.warning("⚠️ No hay documentos para preparar el motor de búsqueda")
             self._inicializado = False
 
+    def _cargar_indice_persistido(self, conteos):
+        """Mapea vocabulario, IDF, matriz y postings desde disco si coinciden con el corpus actual."""
+        datos = cargar_indice(self.version_indice)
+        if datos is None:
+            return False
+
+        if (
+            datos['metadatos'].get('conteos_por_auditoria') != conteos or
+            datos['matriz'].shape[0] != len(self.metadatos_unificados)
+        ):
+            logger.warning(f"⚠️ Índice persistido {self.version_indice} no coincide con el corpus, se reconstruye")
+            return False
+
+        self.vectorizer = VectorizadorConsultas(
+            datos['vocabulario'], datos['idf'], self.PARAMETROS_VECTORIZADOR['stop_words'], datos['terminos_podados'],
+        )
+        self.matriz_tfidf_unificada = datos['matriz']
+        self.postings_por_termino = datos['postings']
+        self.metadatos_unificados.normalizados = datos['normalizados']
+        self.indice_desde_disco = True
+        logger.info(f"⚡ Índice {self.version_indice} cargado desde disco")
+        return True
+
     def _crear_documento_texto(self, item):
         """Crea un documento de texto para búsqueda desde un ítem"""
         campos = [
@@ -408,6 +560,76 @@ class MotorBusquedaNormativasMejorado:
         """Verifica si el motor está correctamente inicializado"""
         return self._inicializado and self.matriz_tfidf_unificada is not None
 
+    def _puntuar_documentos(self, consulta_tfidf):
+        """Devuelve (filas, similitudes) de los documentos que comparten términos con la consulta.
+
+        Las filas TF-IDF ya están normalizadas (L2), así que el producto punto
+        equivale a la similitud coseno y sólo recorre los postings de la consulta.
+        """
+        puntajes = (consulta_tfidf @ self.postings_por_termino).tocsr()
+        return puntajes.indices.astype(np.int64, copy=False), puntajes.data
+
+    def _filtrar_candidatos(self, filas, similitudes, auditoria_tipo):
+        """Aplica umbral de similitud y filtro por auditoría con máscaras vectorizadas."""
+        mascara = similitudes > Config.SIMILARITY_THRESHOLD
+
+        if not es_busqueda_unificada(auditoria_tipo):
+            filas_auditoria = self.indices_por_auditoria.get(auditoria_tipo)
+            if filas_auditoria is None or not len(filas_auditoria):
+                return filas[:0], similitudes[:0]
+            posiciones = np.searchsorted(filas_auditoria, filas)
+            posiciones = np.minimum(posiciones, len(filas_auditoria) - 1)
+            mascara &= filas_auditoria[posiciones] == filas
+
+        return filas[mascara], similitudes[mascara]
+
+    def _mascara_auditoria(self, auditoria_tipo):
+        """Máscara booleana de filas permitidas (None si la búsqueda es unificada)."""
+        if es_busqueda_unificada(auditoria_tipo):
+            return None
+        mascara = self._mascaras_auditoria.get(auditoria_tipo)
+        if mascara is None:
+            # El índice invertido sólo cubre las filas del índice base
+            mascara = np.zeros(self.postings_por_termino.shape[1], dtype=bool)
+        return mascara
+
+    def _puntuar_segmentos(self, consultas_tfidf):
+        """Puntajes (consultas × filas locales) de cada segmento delta."""
+        return [(segmento, (consultas_tfidf @ segmento.postings).tocsr()) for segmento in self.segmentos]
+
+    def _agregar_candidatos_delta(self, puntajes_segmentos, posicion, filas, similitudes, auditoria_tipo):
+        """Suma a los candidatos del índice base los de los segmentos delta para la consulta ``posicion``."""
+        codigo = None
+        if not es_busqueda_unificada(auditoria_tipo):
+            if auditoria_tipo not in self.metadatos_unificados.auditorias:
+                return filas, similitudes
+            codigo = self.metadatos_unificados.auditorias.index(auditoria_tipo)
+
+        partes_filas, partes_similitudes = [filas], [similitudes]
+        for segmento, puntajes in puntajes_segmentos:
+            inicio, fin = puntajes.indptr[posicion], puntajes.indptr[posicion + 1]
+            filas_delta, similitudes_delta = segmento.candidatos(
+                puntajes.indices[inicio:fin], puntajes.data[inicio:fin], Config.SIMILARITY_THRESHOLD, codigo,
+            )
+            partes_filas.append(filas_delta)
+            partes_similitudes.append(similitudes_delta)
+        return np.concatenate(partes_filas), np.concatenate(partes_similitudes)
+
+    @staticmethod
+    def _seleccionar_top(filas, similitudes, top_n):
+        """Ordena los mejores top_n por similitud descendente (empates por fila)."""
+        if top_n <= 0 or not len(filas):
+            return filas[:0], similitudes[:0]
+
+        if len(filas) > top_n:
+            # argpartition ubica el corte; se conservan los empates para desempatar igual que sort()
+            corte = similitudes[np.argpartition(-similitudes, top_n - 1)[top_n - 1]]
+            seleccion = similitudes >= corte
+            filas, similitudes = filas[seleccion], similitudes[seleccion]
+
+        orden = np.lexsort((filas, -similitudes))[:top_n]
+        return filas[orden], similitudes[orden]
+
     def buscar_semanticamente(self, consulta, auditoria_tipo, top_n=5):
         """Busca normativas usando similitud semántica en el corpus unificado"""
         if not self.esta_inicializado():
@@ -416,52 +638,238 @@ class MotorBusquedaNormativasMejorado:
 
         try:
             # Transformar consulta
-            consulta_tfidf = self.vectorizer.transform([consulta])
-            
-            # Calcular similitudes con todo el corpus
-            similitudes = cosine_similarity(consulta_tfidf, self.matriz_tfidf_unificada).flatten()
-
-            # Filtrar por auditoría y obtener top N resultados
-            indices_relevantes = []
-            busqueda_unificada = es_busqueda_unificada(auditoria_tipo)
-            for idx, similitud in enumerate(similitudes):
-                if (
-                    similitud > Config.SIMILARITY_THRESHOLD and
-                    (
-                        busqueda_unificada or
-                        self.metadatos_unificados[idx]['auditoria'] == auditoria_tipo
+            with medir_etapa("vectorizar"):
+                consulta_tfidf = self.vectorizer.transform([consulta])
+
+            # Puntuar sólo documentos con términos en común, filtrar y tomar top N
+            with medir_etapa("puntuar"):
+                if self.indice_invertido is not None:
+                    filas, similitudes = self.indice_invertido.buscar(
+                        consulta_tfidf,
+                        top_n,
+                        umbral=Config.SIMILARITY_THRESHOLD,
+                        filas_permitidas=self._mascara_auditoria(auditoria_tipo),
                     )
-                ):
-                    indices_relevantes.append((idx, similitud))
+                else:
+                    filas, similitudes = self._puntuar_documentos(consulta_tfidf)
+                    filas, similitudes = self._filtrar_candidatos(filas, similitudes, auditoria_tipo)
+                if self.segmentos:
+                    filas, similitudes = self._agregar_candidatos_delta(
+                        self._puntuar_segmentos(consulta_tfidf), 0, filas, similitudes, auditoria_tipo,
+                    )
+                filas, similitudes = self._seleccionar_top(filas, similitudes, top_n)
+            return self._construir_resultados(filas, similitudes)
 
-            # Ordenar por similitud y tomar top N
-            indices_relevantes.sort(key=lambda x: x[1], reverse=True)
-            indices_top = indices_relevantes[:top_n]
+        except Exception as e:
+            logger.error(f"❌ Error en búsqueda semántica: {e}")
+            return []
 
-            resultados = []
-            for idx, similitud in indices_top:
-                metadato = self.metadatos_unificados[idx]
-                resultados.append({
-                    'item': metadato['item'],
-                    'similitud': float(similitud),
-                    'indice': idx,
-                    'auditoria': metadato['auditoria']
-                })
+    def vectorizar_consulta(self, consulta):
+        """Vector TF-IDF (normalizado L2) de la consulta como (términos ordenados, pesos)."""
+        vector = self.vectorizer.transform([consulta]).tocsr().sorted_indices()
+        return vector.indices, vector.data
 
-            return resultados
+    def buscar_semanticamente_lote(self, consultas, auditoria_tipo, top_n=5):
+        """Busca varias consultas con un solo producto disperso matriz-matriz.
 
-        except Exception as e:
-            logger.error(f"❌ Error en búsqueda semántica: {e}")
+        Cada fila del producto se acumula igual que en buscar_semanticamente,
+        así que los resultados por consulta son idénticos a buscarlas una a una.
+        """
+        if not self.esta_inicializado():
+            logger.warning("⚠️ Motor de búsqueda no inicializado")
+            return [[] for _ in consultas]
+        if not consultas:
             return []
 
+        try:
+            with medir_etapa("vectorizar"):
+                consultas_tfidf = self.vectorizer.transform(list(consultas))
+
+            with medir_etapa("puntuar"):
+                puntajes = (consultas_tfidf @ self.postings_por_termino).tocsr()
+                puntajes_segmentos = self._puntuar_segmentos(consultas_tfidf)
+                seleccion = []
+                for posicion in range(len(consultas)):
+                    inicio, fin = puntajes.indptr[posicion], puntajes.indptr[posicion + 1]
+                    filas = puntajes.indices[inicio:fin].astype(np.int64, copy=False)
+                    filas, similitudes = self._filtrar_candidatos(filas, puntajes.data[inicio:fin], auditoria_tipo)
+                    if puntajes_segmentos:
+                        filas, similitudes = self._agregar_candidatos_delta(
+                            puntajes_segmentos, posicion, filas, similitudes, auditoria_tipo,
+                        )
+                    seleccion.append(self._seleccionar_top(filas, similitudes, top_n))
+            return [self._construir_resultados(filas, similitudes) for filas, similitudes in seleccion]
+
+        except Exception as e:
+            logger.error(f"❌ Error en búsqueda semántica por lote: {e}")
+            return [[] for _ in consultas]
+
+    def con_registros_agregados(self, nuevos, datos=None, huella=None):
+        """Motor nuevo con ``nuevos`` ({auditoría: [registros]}) en un segmento delta.
+
+        Los registros se vectorizan con el vocabulario e IDF de este motor, así
+        que el costo es proporcional a los agregados. Este motor no cambia (las
+        solicitudes en curso lo siguen usando); el nuevo comparte con él la
+        matriz, los postings y el vectorizador. Devuelve None si hay que
+        compactar (ver scripts/indice_incremental.py): quien llama reconstruye.
+        """
+        if not self.esta_inicializado() or not nuevos:
+            return None
+        base = self.metadatos_unificados.base if self.segmentos else self.metadatos_unificados
+        if any(auditoria not in base.auditorias for auditoria in nuevos):
+            return None
+
+        agregados = [(auditoria, item) for auditoria, registros in nuevos.items() for item in registros]
+        documentos = [self._crear_documento_texto(item) for _, item in agregados]
+
+        # Sólo cuentan como nuevos los términos que el ajuste base no vio: los que podó por
+        # max_df/min_df/max_features ya existían y reajustar los volvería a podar
+        vocabulario = self.vectorizer.vocabulary_
+        podados = self.vectorizer.stop_words_
+        analizador = self.vectorizer.build_analyzer()
+        tokens = tokens_nuevos = 0
+        for documento in documentos:
+            for token in analizador(documento):
+                tokens += 1
+                tokens_nuevos += token not in vocabulario and token not in podados
+
+        inicio = len(self.metadatos_unificados)
+        metadatos = [
+            Metadato(inicio + posicion, auditoria, item, precalcular_textos_normalizados(item, auditoria))
+            for posicion, (auditoria, item) in enumerate(agregados)
+        ]
+        segmento = SegmentoDelta(
+            inicio,
+            self.vectorizer.transform(documentos),
+            np.array([base.auditorias.index(auditoria) for auditoria, _ in agregados], dtype=np.uint8),
+            metadatos,
+            documentos,
+            tokens,
+            tokens_nuevos,
+        )
+        segmentos = [*self.segmentos, segmento]
+
+        estado = self._estado_incremental(base, segmentos)
+        motivo = None
+        if len(segmentos) > Config.INCREMENTAL_MAX_SEGMENTOS:
+            motivo = "segmentos"
+        elif estado['filas_delta'] > Config.INCREMENTAL_MAX_FRACCION * len(base):
+            motivo = "filas_delta"
+        elif estado['deriva_idf'] > Config.INCREMENTAL_DERIVA_MAX:
+            motivo = "deriva_idf"
+        elif estado['tokens_nuevos'] > Config.INCREMENTAL_MAX_TOKENS_NUEVOS * max(estado['tokens'], 1):
+            motivo = "vocabulario"
+        if motivo is not None:
+            logger.info(f"🧱 Compactación necesaria ({motivo}): {estado}")
+            return None
+
+        nuevo = copy.copy(self)
+        nuevo.segmentos = segmentos
+        nuevo.metadatos_unificados = MetadatosSegmentados(base, segmentos)
+        nuevo.datos = datos if datos is not None else {
+            auditoria: SecuenciaConcatenada(registros, nuevos[auditoria]) if auditoria in nuevos else registros
+            for auditoria, registros in self.datos.items()
+        }
+        nuevo.huella = self.huella if huella is None else huella
+        nuevo.version_indice = calcular_version(
+            self.version_base, {'segmentos': [segmento.huella for segmento in segmentos]},
+        )
+        logger.info(
+            f"➕ Segmento delta con {len(segmento)} registros ({len(segmentos)} segmentos, "
+            f"deriva IDF {estado['deriva_idf']:.4f}): índice {nuevo.version_indice}"
+        )
+        return nuevo
+
+    def _estado_incremental(self, base, segmentos):
+        return {
+            'segmentos': len(segmentos),
+            'filas_delta': sum(len(segmento) for segmento in segmentos),
+            'deriva_idf': deriva_idf(
+                self.vectorizer.idf_, len(base), frecuencias_documentales(self.postings_por_termino), segmentos,
+            ),
+            'tokens': sum(segmento.tokens for segmento in segmentos),
+            'tokens_nuevos': sum(segmento.tokens_nuevos for segmento in segmentos),
+        }
+
+    def _construir_resultados(self, filas, similitudes):
+        resultados = []
+        for idx, similitud in zip(filas.tolist(), similitudes.tolist()):
+            metadato = self.metadatos_unificados[idx]
+            resultados.append({
+                'item': metadato['item'],
+                'similitud': float(similitud),
+                'indice': idx,
+                'auditoria': metadato['auditoria'],
+                'normalizado': metadato['normalizado'],
+            })
+        return resultados
+
 # =============================================================================
 # INICIALIZACIÓN DE COMPONENTES GLOBALES
 # =============================================================================
 
 # Inicializar componentes
 motor_busqueda = MotorBusquedaNormativasMejorado()
-cache_busqueda = SistemaCache(max_size=Config.CACHE_SIZE)
-monitor_rendimiento = MonitorRendimiento()
+cache_busqueda = SistemaCache(max_size=Config.CACHE_SIZE, ttl=Config.CACHE_TTL)
+# Análisis + HTML final por consulta normalizada (incluye resultados sin coincidencia)
+cache_respuestas = SistemaCache(max_size=Config.CACHE_SIZE, ttl=Config.CACHE_TTL)
+cache_compartido = (
+    CacheCompartido(
+        Config.CACHE_COMPARTIDO_RUTA,
+        ttl=Config.CACHE_TTL,
+        max_entradas=Config.CACHE_COMPARTIDO_MAX,
+    )
+    if Config.CACHE_COMPARTIDO
+    else None
+)
+cache_llm = CacheRespuestasGeneradas(
+    max_size=Config.LLM_CACHE_SIZE,
+    ttl=Config.CACHE_TTL,
+    umbral_similitud=Config.LLM_CACHE_UMBRAL_SIMILITUD,
+)
+historial_chat = HistorialChat(
+    Config.HISTORIAL_RUTA,
+    max_mensajes=Config.CHAT_HISTORY_LIMIT,
+    retencion=Config.HISTORIAL_RETENCION,
+)
+registro_consultas = RegistroConsultas(Config.REGISTRO_CONSULTAS_RUTA)
+monitor_rendimiento = MonitorRendimiento(Config.METRICAS_DIR)
+trazador = Trazador(Config.TRAZAS_MUESTREO, Config.TRAZAS_RUTA, max_bytes=Config.TRAZAS_MAX_BYTES)
+
+
+def motor_actual():
+    """Motor de la solicitud en curso.
+
+    Cada solicitud fija el motor vigente al empezar (``g.motor``); si una
+    recarga publica otro mientras tanto, la solicitud termina con el que
+    empezó y nunca mezcla versiones. Fuera de una solicitud se usa el vigente.
+    """
+    if has_request_context():
+        motor = g.get("motor")
+        if motor is not None:
+            return motor
+    return motor_busqueda
+
+
+def crear_cliente_llm():
+    """Cliente del proveedor de chat, o None si no hay API key configurada."""
+    if not CHATBOT_CONFIG["qwen_ready"]:
+        return None
+
+    # Import diferido: httpx sólo se necesita con el proveedor activo
+    from scripts.cliente_llm import ClienteLLM
+
+    return ClienteLLM(
+        Config.QWEN_BASE_URL,
+        os.getenv("QWEN_API_KEY", "").strip(),
+        CHATBOT_CONFIG["qwen_model"] or Config.QWEN_MODEL_DEFAULT,
+        plazo=Config.LLM_PLAZO,
+        max_concurrencia=Config.LLM_MAX_CONCURRENCIA,
+        reintentos=Config.LLM_REINTENTOS,
+    )
+
+
+cliente_llm = crear_cliente_llm()
 
 # =============================================================================
 # FUNCIONES AUXILIARES MEJORADAS
@@ -561,8 +969,12 @@ def requiere_auditoria(f):
 # =============================================================================
 
 def get_chat_history():
-    """Obtiene el historial de chat con validación"""
-    historial = session.get("chat_history", [])
+    """Obtiene el historial de chat con validación (se lee del almacén del servidor)"""
+    conversacion = obtener_id_conversacion()
+    if conversacion is None:
+        return []
+
+    historial = historial_chat.obtener(conversacion, session.get("usuario", ""))
     # Validar que cada mensaje tenga la estructura correcta
     historial_valido = []
     for msg in historial:
@@ -573,22 +985,38 @@ def get_chat_history():
             historial_valido.append(msg)
     return historial_valido
 
-def set_chat_history(history, max_mensajes=Config.CHAT_HISTORY_LIMIT):
-    """Guarda el historial de chat con mejor gestión de memoria"""
-    if len(history) > max_mensajes:
-        # Mantener los primeros 2 mensajes (configuración) y los últimos N
-        if len(history) > 2:
-            history = history[:2] + history[-(max_mensajes-2):]
-        else:
-            history = history[-max_mensajes:]
-    
-    # Limpiar datos grandes si existen
-    for msg in history:
-        if 'answer' in msg and len(msg['answer']) > 10000:
-            msg['answer'] = msg['answer'][:10000] + "... [truncado]"
-    
-    session["chat_history"] = history
-    session.modified = True
+
+def obtener_id_conversacion(crear=False):
+    """Id de la conversación guardado en la cookie; con ``crear`` se asigna uno nuevo si falta.
+
+    Las sesiones anteriores guardaban el historial completo en la cookie: se
+    migra al almacén y se elimina de la cookie.
+    """
+    conversacion = session.get("historial_id")
+    historial_en_cookie = session.pop("chat_history", None)
+
+    if conversacion is None and (crear or historial_en_cookie):
+        conversacion = nuevo_id_conversacion()
+        session["historial_id"] = conversacion
+
+    if historial_en_cookie:
+        for msg in historial_en_cookie:
+            historial_chat.agregar(conversacion, session.get("usuario", ""), msg)
+
+    return conversacion
+
+
+def registrar_en_historial(question, answer, auditoria_label, ente_tipo, analisis, conversacion=None):
+    """Agrega la consulta y su respuesta al historial de la conversación."""
+    conversacion = conversacion or obtener_id_conversacion(crear=True)
+    historial_chat.agregar(conversacion, session.get("usuario", ""), {
+        "question": question,
+        "answer": answer,
+        "auditoria": auditoria_label,
+        "ente": ente_tipo,
+        "timestamp": datetime.now().isoformat(),
+        "normativas_encontradas": len(analisis['normativas']) if analisis['encontrado'] else 0
+    })
 
 
 def _safe_next_url(raw_url):
@@ -604,9 +1032,10 @@ def _safe_next_url(raw_url):
 
 def buscar_semanticamente_con_cache(consulta, auditoria_tipo, top_n=5):
     """Búsqueda semántica con cache para mejor rendimiento"""
-    
+    motor = motor_actual()
+
     # Verificar cache primero
-    resultado_cache = cache_busqueda.obtener(consulta, auditoria_tipo)
+    resultado_cache = cache_busqueda.obtener(consulta, auditoria_tipo, motor.version_indice)
     if resultado_cache:
         logger.info(f"✅ Cache hit para consulta: {consulta[:50]}...")
         monitor_rendimiento.registrar_cache_hit()
@@ -614,14 +1043,44 @@ def buscar_semanticamente_con_cache(consulta, auditoria_tipo, top_n=5):
     
     # Búsqueda normal
     monitor_rendimiento.registrar_cache_miss()
-    resultados = motor_busqueda.buscar_semanticamente(consulta, auditoria_tipo, top_n)
+    resultados = motor.buscar_semanticamente(consulta, auditoria_tipo, top_n)
     
     # Guardar en cache solo si hay resultados relevantes
-    if resultados and any(r['similitud'] > 0.2 for r in resultados):
-        cache_busqueda.guardar(consulta, auditoria_tipo, resultados)
+    _guardar_busqueda_en_cache(consulta, auditoria_tipo, resultados, motor.version_indice)
     
     return resultados
 
+
+def buscar_semanticamente_lote_con_cache(consultas, auditoria_tipo, top_n=5):
+    """Versión por lote: las consultas sin cache se resuelven en un solo producto matricial."""
+    motor = motor_actual()
+    resultados = {}
+    pendientes = []
+    for consulta in dict.fromkeys(consultas):
+        resultado_cache = cache_busqueda.obtener(consulta, auditoria_tipo, motor.version_indice)
+        if resultado_cache:
+            monitor_rendimiento.registrar_cache_hit()
+            resultados[consulta] = resultado_cache
+        else:
+            monitor_rendimiento.registrar_cache_miss()
+            pendientes.append(consulta)
+
+    if pendientes:
+        logger.info(f"🔎 Búsqueda por lote: {len(pendientes)} consultas sin cache")
+        for consulta, resultado in zip(
+            pendientes,
+            motor.buscar_semanticamente_lote(pendientes, auditoria_tipo, top_n),
+        ):
+            _guardar_busqueda_en_cache(consulta, auditoria_tipo, resultado, motor.version_indice)
+            resultados[consulta] = resultado
+
+    return [resultados[consulta] for consulta in consultas]
+
+
+def _guardar_busqueda_en_cache(consulta, auditoria_tipo, resultados, version):
+    if resultados and any(r['similitud'] > 0.2 for r in resultados):
+        cache_busqueda.guardar(consulta, auditoria_tipo, resultados, version=version)
+
 def analizar_patrones_consulta(pregunta):
     """Analiza patrones en la consulta para mejorar resultados"""
     pregunta_normalizada = normalizar_texto_comparable(pregunta)
@@ -652,42 +1111,10 @@ def analizar_patrones_consulta(pregunta):
     return {k: v for k, v in patrones.items() if v}
 
 
-def normalizar_texto_comparable(texto):
-    """Normaliza texto para comparaciones semánticas simples."""
-    if not texto:
-        return ""
-
-    texto = unicodedata.normalize("NFKD", str(texto))
-    texto = "".join(caracter for caracter in texto if not unicodedata.combining(caracter))
-    texto = texto.lower()
-    texto = re.sub(r"[^a-z0-9\s]", " ", texto)
-    texto = re.sub(r"\s+", " ", texto).strip()
-    return texto
-
-
-def extraer_tokens_relevantes(texto, auditoria_tipo=None):
-    """Extrae términos útiles y elimina palabras demasiado genéricas."""
-    texto_normalizado = normalizar_texto_comparable(texto)
-    if not texto_normalizado:
-        return []
-
-    palabras_omitidas = set(PALABRAS_GENERICAS_CONSULTA)
-    palabras_omitidas.update(PALABRAS_GENERICAS_POR_AUDITORIA.get(auditoria_tipo, set()))
-
-    tokens = []
-    for token in texto_normalizado.split():
-        if token in palabras_omitidas:
-            continue
-        if len(token) <= 2 and not token.isdigit():
-            continue
-        tokens.append(token)
-
-    return tokens
-
-
 def preparar_consulta_busqueda(pregunta, auditoria_tipo):
     """Reduce ruido de la consulta antes de la búsqueda semántica."""
-    return " ".join(extraer_tokens_relevantes(pregunta, auditoria_tipo)).strip()
+    with medir_etapa("normalizar"):
+        return " ".join(extraer_tokens_relevantes(pregunta, auditoria_tipo)).strip()
 
 
 def limpiar_consulta_concepto(pregunta):
@@ -723,11 +1150,46 @@ def limpiar_consulta_concepto(pregunta):
     return consulta
 
 
+def _texto_normalizado(normativa, campo):
+    """Texto normalizado de un campo, tomado del precálculo del corpus cuando existe."""
+    precalculado = normativa.get('_normalizado')
+    if precalculado is not None:
+        return precalculado['textos'][campo]
+    return normalizar_texto_comparable(normativa.get(campo, ''))
+
+
+def _tokens_campo(normativa, campo):
+    """Tokens relevantes (sin contexto de auditoría) de un campo de la normativa."""
+    precalculado = normativa.get('_normalizado')
+    if precalculado is not None:
+        return precalculado['tokens'][campo]
+    return extraer_tokens_relevantes(normativa.get(campo, ''))
+
+
+def _normativas_normalizadas(normativa):
+    """Textos normalizados de cada normativa aplicable, indexados por nombre."""
+    precalculado = normativa.get('_normalizado')
+    if precalculado is not None:
+        return precalculado['normativas']
+    return {
+        tipo_norma: normalizar_texto_comparable(texto_norma)
+        for tipo_norma, texto_norma in normativa.get('normativas', {}).items()
+    }
+
+
+def _sin_campos_internos(normativa):
+    return {clave: valor for clave, valor in normativa.items() if not clave.startswith('_')}
+
+
 def calcular_coincidencia_concepto(consulta, candidato):
     """Devuelve un puntaje simple de coincidencia entre consulta y concepto/tipo."""
-    consulta_norm = limpiar_consulta_concepto(consulta)
-    candidato_norm = normalizar_texto_comparable(candidato)
+    return _coincidencia_concepto_normalizada(
+        limpiar_consulta_concepto(consulta),
+        normalizar_texto_comparable(candidato),
+    )
+
 
+def _coincidencia_concepto_normalizada(consulta_norm, candidato_norm):
     if not consulta_norm or not candidato_norm:
         return 0
 
@@ -746,18 +1208,26 @@ def calcular_coincidencia_concepto(consulta, candidato):
     return 1 if cobertura >= 0.7 else 0
 
 
+def _coincidencia_concepto_normativa(consulta_norm, normativa):
+    return max(
+        _coincidencia_concepto_normalizada(consulta_norm, _texto_normalizado(normativa, 'concepto')),
+        _coincidencia_concepto_normalizada(consulta_norm, _texto_normalizado(normativa, 'tipo_irregularidad')),
+    )
+
+
 def calcular_cobertura_textual(pregunta, normativa, auditoria_tipo):
     """Mide cuántos términos relevantes de la consulta están en el resultado."""
-    tokens_consulta = set(extraer_tokens_relevantes(pregunta, auditoria_tipo))
+    return _cobertura_textual(set(extraer_tokens_relevantes(pregunta, auditoria_tipo)), normativa, auditoria_tipo)
+
+
+def _cobertura_textual(tokens_consulta, normativa, auditoria_tipo):
     if not tokens_consulta:
         return 0.0
 
-    texto_candidato = " ".join(filter(None, [
-        normativa.get('tipo_irregularidad', ''),
-        normativa.get('concepto', ''),
-        normativa.get('descripcion', ''),
-    ]))
-    tokens_candidato = set(extraer_tokens_relevantes(texto_candidato, auditoria_tipo))
+    tokens_candidato = set()
+    for campo in ('tipo_irregularidad', 'concepto', 'descripcion'):
+        tokens_candidato.update(_tokens_campo(normativa, campo))
+    tokens_candidato.difference_update(PALABRAS_GENERICAS_POR_AUDITORIA.get(auditoria_tipo, ()))
     if not tokens_candidato:
         return 0.0
 
@@ -766,25 +1236,20 @@ def calcular_cobertura_textual(pregunta, normativa, auditoria_tipo):
 
 def es_consulta_por_concepto(pregunta, normativas):
     """Detecta si la consulta apunta directamente a un concepto o tipo específico."""
+    consulta_norm = limpiar_consulta_concepto(pregunta)
     for normativa in normativas[:3]:
-        candidatos = [
-            normativa.get('concepto', ''),
-            normativa.get('tipo_irregularidad', ''),
-        ]
-        if max(calcular_coincidencia_concepto(pregunta, candidato) for candidato in candidatos) > 0:
+        if _coincidencia_concepto_normativa(consulta_norm, normativa) > 0:
             return True
     return False
 
 
 def filtrar_normativas_por_concepto(pregunta, normativas):
     """Reduce resultados a los conceptos que coinciden mejor con la consulta."""
+    consulta_norm = limpiar_consulta_concepto(pregunta)
     coincidencias = []
 
     for normativa in normativas:
-        puntaje = max(
-            calcular_coincidencia_concepto(pregunta, normativa.get('concepto', '')),
-            calcular_coincidencia_concepto(pregunta, normativa.get('tipo_irregularidad', '')),
-        )
+        puntaje = _coincidencia_concepto_normativa(consulta_norm, normativa)
         if puntaje > 0:
             coincidencias.append((puntaje, normativa))
 
@@ -821,15 +1286,33 @@ def combinar_normativas_duplicadas(actual, candidata):
     combinada = preferida.copy()
     combinada['normativas'] = preferida['normativas'].copy()
 
+    # El precálculo acompaña a los campos que se toman de la secundaria
+    precalculado = preferida.get('_normalizado')
+    if precalculado is not None:
+        precalculado = {
+            'textos': dict(precalculado['textos']),
+            'tokens': dict(precalculado['tokens']),
+            'normativas': dict(precalculado['normativas']),
+        }
+        combinada['_normalizado'] = precalculado
+
     for tipo_norma, texto_norma in secundaria.get('normativas', {}).items():
         if tipo_norma not in combinada['normativas'] and texto_norma:
             combinada['normativas'][tipo_norma] = texto_norma
-
-    if not combinada.get('descripcion') and secundaria.get('descripcion'):
-        combinada['descripcion'] = secundaria['descripcion']
-
-    if not combinada.get('concepto') and secundaria.get('concepto'):
-        combinada['concepto'] = secundaria['concepto']
+            if precalculado is not None:
+                precalculado['normativas'][tipo_norma] = _normativas_normalizadas(secundaria)[tipo_norma]
+
+    for campo in ('descripcion', 'concepto'):
+        if not combinada.get(campo) and secundaria.get(campo):
+            combinada[campo] = secundaria[campo]
+            if precalculado is not None:
+                precalculado['textos'][campo] = _texto_normalizado(secundaria, campo)
+                precalculado['tokens'][campo] = _tokens_campo(secundaria, campo)
+
+    if '_registros' in actual or '_registros' in candidata:
+        combinada['_registros'] = tuple(sorted(
+            set(actual.get('_registros', ())) | set(candidata.get('_registros', ()))
+        ))
 
     combinada['puntaje_similitud'] = max(
         actual.get('puntaje_similitud', 0),
@@ -849,11 +1332,8 @@ def deduplicar_normativas_por_texto(normativas):
     normativas_unicas = {}
 
     for normativa in normativas:
-        tipo_normalizado = normalizar_texto_comparable(normativa.get('tipo_irregularidad', ''))
-        firma_normativa = tuple(
-            (tipo_norma, normalizar_texto_comparable(texto_norma))
-            for tipo_norma, texto_norma in sorted(normativa.get('normativas', {}).items())
-        )
+        tipo_normalizado = _texto_normalizado(normativa, 'tipo_irregularidad')
+        firma_normativa = tuple(sorted(_normativas_normalizadas(normativa).items()))
         clave = tipo_normalizado or firma_normativa
 
         if clave not in normativas_unicas:
@@ -873,12 +1353,13 @@ def deduplicar_normativas_por_texto(normativas):
 
 def filtrar_normativas_por_confianza(pregunta, auditoria_tipo, normativas):
     """Descarta coincidencias débiles que solo comparten términos genéricos."""
-    if not extraer_tokens_relevantes(pregunta, auditoria_tipo):
+    tokens_consulta = set(extraer_tokens_relevantes(pregunta, auditoria_tipo))
+    if not tokens_consulta:
         return []
 
     filtradas = []
     for normativa in normativas:
-        puntaje_textual = calcular_cobertura_textual(pregunta, normativa, auditoria_tipo)
+        puntaje_textual = _cobertura_textual(tokens_consulta, normativa, auditoria_tipo)
         normativa['puntaje_textual'] = puntaje_textual
         similitud = normativa.get('puntaje_similitud', 0)
 
@@ -933,9 +1414,16 @@ def generar_sugerencias_busqueda(pregunta, auditoria_tipo, patrones):
 
     return sugerencias[:3]
 
-def extraer_normativas_relevantes(auditoria_tipo, pregunta):
-    """Extrae las normativas relevantes usando búsqueda semántica mejorada con cache"""
-    if not es_busqueda_unificada(auditoria_tipo) and auditoria_tipo not in DB_AUDITORIA:
+def _top_n_busqueda(auditoria_tipo):
+    return 12 if es_busqueda_unificada(auditoria_tipo) else 8
+
+
+def extraer_normativas_relevantes(auditoria_tipo, pregunta, resultados_semanticos=None):
+    """Extrae las normativas relevantes usando búsqueda semántica mejorada con cache
+
+    ``resultados_semanticos`` permite reutilizar una búsqueda ya hecha (p. ej. por lote).
+    """
+    if not es_busqueda_unificada(auditoria_tipo) and auditoria_tipo not in motor_actual().datos:
         return []
 
     contexto_consulta = None if es_busqueda_unificada(auditoria_tipo) else auditoria_tipo
@@ -944,11 +1432,12 @@ def extraer_normativas_relevantes(auditoria_tipo, pregunta):
         return []
 
     # Usar motor semántico con cache
-    resultados_semanticos = buscar_semanticamente_con_cache(
-        consulta_busqueda,
-        auditoria_tipo,
-        top_n=12 if es_busqueda_unificada(auditoria_tipo) else 8,
-    )
+    if resultados_semanticos is None:
+        resultados_semanticos = buscar_semanticamente_con_cache(
+            consulta_busqueda,
+            auditoria_tipo,
+            top_n=_top_n_busqueda(auditoria_tipo),
+        )
 
     normativas_encontradas = []
 
@@ -977,20 +1466,25 @@ def extraer_normativas_relevantes(auditoria_tipo, pregunta):
                 'subcategoria': irregularidad.get('subcategoria', ''),
                 'origen_fuente': irregularidad.get('origen_fuente', 'base'),
                 'auditoria': auditoria_resultado,
+                '_normalizado': resultado.get('normalizado'),
+                '_registros': (resultado['indice'],),
             })
 
-    normativas_encontradas = deduplicar_normativas_por_texto(normativas_encontradas)
-    normativas_encontradas = filtrar_normativas_por_confianza(
-        pregunta,
-        contexto_consulta,
-        normativas_encontradas,
-    )
+    with medir_etapa("post_filtro"):
+        with span("deduplicar_normativas_por_texto"):
+            normativas_encontradas = deduplicar_normativas_por_texto(normativas_encontradas)
+        with span("filtrar_normativas_por_confianza"):
+            normativas_encontradas = filtrar_normativas_por_confianza(
+                pregunta,
+                contexto_consulta,
+                normativas_encontradas,
+            )
     return normativas_encontradas[:Config.TOP_N_RESULTS]
 
 def generar_enlaces_busqueda_internet(pregunta, auditoria_tipo):
     """Genera enlaces de búsqueda en internet para normativas"""
     try:
-        consulta_codificada = requests.utils.quote(f"{pregunta} {auditoria_tipo} normativa México")
+        consulta_codificada = quote(f"{pregunta} {auditoria_tipo} normativa México")
 
         enlaces = {
             "Diario Oficial de la Federación": f"https://www.dof.gob.mx/busqueda_avanzada.php?q={consulta_codificada}",
@@ -1012,19 +1506,32 @@ def generar_enlaces_busqueda_internet(pregunta, auditoria_tipo):
         logger.error(f"Error generando enlaces de búsqueda: {e}")
         return ""
 
-def generar_analisis_normativo(pregunta, auditoria_tipo, ente_tipo=None):
+def generar_analisis_normativo(pregunta, auditoria_tipo, ente_tipo=None, resultados_semanticos=None):
     """Genera un análisis normativo completo basado en la pregunta"""
     # Analizar patrones de la consulta
     patrones = analizar_patrones_consulta(pregunta)
 
     # Extraer normativas relevantes
-    normativas = extraer_normativas_relevantes(auditoria_tipo, pregunta)
+    normativas = extraer_normativas_relevantes(auditoria_tipo, pregunta, resultados_semanticos)
     consulta_por_concepto = es_consulta_por_concepto(pregunta, normativas)
     etiqueta_auditoria = obtener_etiqueta_auditoria(auditoria_tipo)
 
     if consulta_por_concepto:
-        normativas = filtrar_normativas_por_concepto(pregunta, normativas)
-        normativas = deduplicar_normativas_por_texto(normativas)
+        with medir_etapa("post_filtro"):
+            with span("filtrar_normativas_por_concepto"):
+                normativas = filtrar_normativas_por_concepto(pregunta, normativas)
+            with span("deduplicar_normativas_por_texto"):
+                normativas = deduplicar_normativas_por_texto(normativas)
+
+    # Filas del corpus que respaldan la respuesta (clave de la caché de respuestas generadas)
+    registros_recuperados = sorted({
+        registro
+        for normativa in normativas
+        for registro in normativa.get('_registros', ())
+    })
+
+    # El precálculo de textos sólo sirve para el re-ranking; no forma parte de la respuesta
+    normativas = [_sin_campos_internos(normativa) for normativa in normativas]
 
     if not normativas:
         sugerencias = generar_sugerencias_busqueda(pregunta, auditoria_tipo, patrones)
@@ -1066,6 +1573,7 @@ def generar_analisis_normativo(pregunta, auditoria_tipo, ente_tipo=None):
         "solo_normativa": consulta_por_concepto,
         "patrones_detectados": patrones,
         "auditorias_consultadas": auditorias_consultadas,
+        "registros_recuperados": registros_recuperados,
         "estadisticas": {
             "total_encontrado": len(normativas),
             "max_similitud": max(n['puntaje_similitud'] for n in normativas) if normativas else 0,
@@ -1075,14 +1583,207 @@ def generar_analisis_normativo(pregunta, auditoria_tipo, ente_tipo=None):
 
     return analisis
 
+def clave_cache_analisis(pregunta, auditoria_tipo):
+    """Clave del análisis: consulta normalizada + auditoría + versión del índice.
+
+    Consultas que sólo difieren en palabras genéricas, acentos o puntuación
+    comparten la misma entrada.
+    """
+    contexto_consulta = None if es_busqueda_unificada(auditoria_tipo) else auditoria_tipo
+    consulta_normalizada = preparar_consulta_busqueda(pregunta, contexto_consulta)
+    contenido = json.dumps(
+        [consulta_normalizada, auditoria_tipo, motor_actual().version_indice],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+
+def obtener_respuesta_normativa(pregunta, auditoria_tipo, ente_tipo=None):
+    """Devuelve (analisis, answer_html, origen_cache) reutilizando la caché por consulta normalizada.
+
+    Se busca primero en la caché del proceso y luego en la compartida entre
+    workers; en un fallo se calcula todo el pipeline (búsqueda, filtros y
+    formato) y se guarda en ambos niveles. Los resultados "sin coincidencia"
+    también se cachean, con un TTL más corto.
+    """
+    analisis, answer, clave, origen_cache = obtener_analisis_normativo(pregunta, auditoria_tipo, ente_tipo)
+    if answer is None:
+        answer = _guardar_respuesta(clave, analisis)['answer']
+    return analisis, answer, origen_cache
+
+
+def obtener_analisis_normativo(pregunta, auditoria_tipo, ente_tipo=None):
+    """Recuperación sin formato: devuelve (analisis, answer_cacheada, clave, origen_cache).
+
+    ``answer_cacheada`` es None en un fallo de caché; quien llama decide cuándo
+    formatear y guardar (``_guardar_respuesta``), así /ask/stream puede
+    enviar el resumen en cuanto está listo el análisis.
+    """
+    clave = clave_cache_analisis(pregunta, auditoria_tipo)
+
+    respuesta, origen_cache = _obtener_respuesta_cacheada(clave)
+    if respuesta is not None:
+        logger.info(f"✅ Cache {origen_cache} hit para consulta: {pregunta[:50]}...")
+        return _analisis_para_ente(respuesta['analisis'], ente_tipo), respuesta['answer'], clave, origen_cache
+
+    return generar_analisis_normativo(pregunta, auditoria_tipo, ente_tipo), None, clave, None
+
+
+def obtener_analisis_normativos_lote(preguntas, auditoria_tipo, ente_tipo=None):
+    """Devuelve el análisis de cada pregunta resolviendo las búsquedas pendientes en un solo lote.
+
+    Usa las mismas cachés que obtener_respuesta_normativa; las preguntas que
+    comparten consulta normalizada se calculan una sola vez.
+    """
+    claves = [clave_cache_analisis(pregunta, auditoria_tipo) for pregunta in preguntas]
+    analisis_por_clave = {}
+    pendientes = {}
+
+    for pregunta, clave in zip(preguntas, claves):
+        if clave in analisis_por_clave or clave in pendientes:
+            continue
+        respuesta, _ = _obtener_respuesta_cacheada(clave)
+        if respuesta is not None:
+            analisis_por_clave[clave] = respuesta['analisis']
+        else:
+            pendientes[clave] = pregunta
+
+    if pendientes:
+        contexto_consulta = None if es_busqueda_unificada(auditoria_tipo) else auditoria_tipo
+        consultas = {
+            clave: preparar_consulta_busqueda(pregunta, contexto_consulta)
+            for clave, pregunta in pendientes.items()
+        }
+        consultas_con_texto = [consulta for consulta in consultas.values() if consulta]
+        resultados_por_consulta = dict(zip(
+            consultas_con_texto,
+            buscar_semanticamente_lote_con_cache(
+                consultas_con_texto,
+                auditoria_tipo,
+                top_n=_top_n_busqueda(auditoria_tipo),
+            ),
+        ))
+
+        for clave, pregunta in pendientes.items():
+            analisis = generar_analisis_normativo(
+                pregunta,
+                auditoria_tipo,
+                ente_tipo,
+                resultados_semanticos=resultados_por_consulta.get(consultas[clave], []),
+            )
+            _guardar_respuesta(clave, analisis)
+            analisis_por_clave[clave] = analisis
+
+    return [_analisis_para_ente(analisis_por_clave[clave], ente_tipo) for clave in claves]
+
+
+def _obtener_respuesta_cacheada(clave):
+    """Busca (respuesta, origen) en la caché del proceso y luego en la compartida."""
+    respuesta = cache_respuestas.obtener_por_clave(clave)
+    if respuesta is not None:
+        return respuesta, "memoria"
+
+    if cache_compartido is not None:
+        respuesta = cache_compartido.obtener(clave)
+        if respuesta is not None:
+            cache_respuestas.guardar_por_clave(
+                clave, respuesta, ttl=_ttl_respuesta(respuesta['analisis']), version=motor_actual().version_indice,
+            )
+            return respuesta, "compartida"
+
+    return None, None
+
+
+def _guardar_respuesta(clave, analisis, answer=None):
+    """Guarda análisis y HTML en ambas cachés; ``answer`` evita volver a formatear uno ya generado."""
+    respuesta = {
+        'analisis': analisis,
+        'answer': formatear_respuesta_normativa(analisis) if answer is None else answer,
+    }
+
+    ttl = _ttl_respuesta(analisis)
+    version = motor_actual().version_indice
+    cache_respuestas.guardar_por_clave(clave, respuesta, ttl=ttl, version=version)
+    if cache_compartido is not None:
+        cache_compartido.guardar(clave, respuesta, version, ttl=ttl)
+    return respuesta
+
+
+def _analisis_para_ente(analisis, ente_tipo):
+    if 'ente_tipo' in analisis:
+        return {**analisis, 'ente_tipo': ente_tipo}
+    return analisis
+
+
+def registrar_consulta(endpoint, pregunta, auditoria_tipo, analisis, origen_cache, latencia):
+    """Agrega la consulta al registro estructurado; un fallo del registro nunca afecta la respuesta."""
+    try:
+        contexto_consulta = None if es_busqueda_unificada(auditoria_tipo) else auditoria_tipo
+        registro_consultas.registrar(
+            endpoint,
+            pregunta,
+            preparar_consulta_busqueda(pregunta, contexto_consulta),
+            auditoria_tipo,
+            latencia,
+            analisis.get("registros_recuperados", []),
+            bool(analisis.get("encontrado")),
+            analisis.get("estadisticas", {}).get("max_similitud", 0.0),
+            origen_cache,
+            motor_actual().version_indice,
+        )
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo registrar la consulta: {e}")
+
+
+def precalentar_cache(top_n=None):
+    """Calcula por lote las consultas más frecuentes del registro para que las primeras solicitudes usen la caché."""
+    top_n = Config.PRECALENTAR_TOP if top_n is None else top_n
+    if top_n <= 0 or not motor_actual().esta_inicializado():
+        return 0
+
+    try:
+        frecuentes = minar_consultas_frecuentes(
+            leer_registros(registro_consultas.archivos(), max_bytes=Config.PRECALENTAR_MAX_BYTES), top_n,
+        )
+        por_auditoria = {}
+        for consulta in frecuentes:
+            auditoria_tipo = validar_auditoria_tipo(consulta["auditoria"])
+            if auditoria_tipo:
+                por_auditoria.setdefault(auditoria_tipo, []).append(consulta["pregunta"])
+
+        for auditoria_tipo, preguntas in por_auditoria.items():
+            obtener_analisis_normativos_lote(preguntas, auditoria_tipo)
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo precalentar la caché: {e}")
+        return 0
+
+    total = sum(len(preguntas) for preguntas in por_auditoria.values())
+    if total:
+        logger.info(f"🔥 Caché precalentada con {total} consultas frecuentes")
+    return total
+
+
+def _ttl_respuesta(analisis):
+    return Config.CACHE_TTL if analisis.get('encontrado') else Config.CACHE_TTL_SIN_RESULTADO
+
 def formatear_respuesta_normativa(analisis):
     """Formatea la respuesta normativa con una salida compacta y clara."""
+    with medir_etapa("formatear"):
+        return "\n".join(generar_fragmentos_respuesta(analisis))
+
+
+def generar_fragmentos_respuesta(analisis):
+    """Genera la respuesta HTML por partes: resumen, cada normativa y cierre.
+
+    Unidas con saltos de línea forman formatear_respuesta_normativa; por
+    separado permiten enviar la respuesta en streaming (/ask/stream).
+    """
     if not analisis["encontrado"]:
         sugerencias_html = "".join(
             f"<li>{escape(sugerencia)}</li>"
             for sugerencia in analisis["sugerencias"]
         )
-        return f"""
+        yield f"""
 <div class="analysis-response">
   <div class="analysis-summary">
     <p class="analysis-kicker">Sin coincidencia precisa</p>
@@ -1094,6 +1795,7 @@ def formatear_respuesta_normativa(analisis):
   </div>
 </div>
 """.strip()
+        return
 
     if analisis.get("solo_normativa"):
         encabezado = "Normativa aplicable"
@@ -1102,23 +1804,22 @@ def formatear_respuesta_normativa(analisis):
         encabezado = "Resultado"
         subtitulo = analisis["resumen"]
 
-    bloques = [
+    yield "\n".join([
         '<div class="analysis-response">',
         '  <div class="analysis-summary">',
         f'    <p class="analysis-kicker">{escape(encabezado)}</p>',
         f'    <p>{escape(subtitulo)}</p>',
         '  </div>',
-    ]
+    ])
 
     for i, normativa in enumerate(analisis["normativas"], 1):
-        bloques.append(formatear_normativa_individual(
+        yield formatear_normativa_individual(
             normativa,
             i,
             solo_normativa=analisis.get("solo_normativa", False),
-        ))
+        )
 
-    bloques.append('</div>')
-    return "\n".join(bloques)
+    yield '</div>'
 
 
 def formatear_texto_html(texto):
@@ -1186,6 +1887,88 @@ def formatear_normativa_individual(normativa, numero, solo_normativa=False):
   </section>
 """.strip()
 
+# =============================================================================
+# RESPUESTA GENERATIVA (PROVEEDOR DE CHAT)
+# =============================================================================
+
+INSTRUCCIONES_LLM = (
+    "Eres un asistente de auditoría gubernamental del Estado de Tlaxcala. "
+    "Responde en español y sólo con base en las normativas del contexto, citándolas por su número [n]. "
+    "Si el contexto no alcanza para responder, dilo explícitamente."
+)
+
+
+def construir_mensajes_llm(pregunta, analisis):
+    """Mensajes para el proveedor: instrucciones y las normativas recuperadas como contexto."""
+    bloques = []
+    for numero, normativa in enumerate(analisis["normativas"], 1):
+        lineas = [f"[{numero}] {normativa['tipo_irregularidad']} ({normativa.get('auditoria', '')})"]
+        if normativa.get("concepto"):
+            lineas.append(f"Concepto: {normativa['concepto']}")
+        if normativa.get("descripcion"):
+            lineas.append(f"Descripción: {normativa['descripcion']}")
+        lineas.extend(
+            f"{tipo_norma}: {texto_norma}"
+            for tipo_norma, texto_norma in normativa["normativas"].items()
+            if texto_norma
+        )
+        bloques.append("\n".join(lineas))
+
+    return [
+        {"role": "system", "content": INSTRUCCIONES_LLM},
+        {"role": "user", "content": "Contexto normativo:\n\n" + "\n\n".join(bloques) + f"\n\nConsulta: {pregunta}"},
+    ]
+
+
+def generar_respuesta_llm(pregunta, analisis, auditoria_tipo):
+    """HTML con la respuesta del proveedor de chat, o "" si no está activo o no respondió a tiempo.
+
+    Antes de llamar al proveedor se busca en cache_llm una respuesta generada
+    con los mismos registros recuperados, para la misma consulta normalizada o
+    una casi idéntica. La llamada corre en el bucle asyncio en segundo plano
+    del cliente; este hilo espera como máximo Config.LLM_PLAZO segundos.
+    """
+    if cliente_llm is None or not analisis.get("encontrado"):
+        return ""
+
+    contexto_consulta = None if es_busqueda_unificada(auditoria_tipo) else auditoria_tipo
+    consulta = preparar_consulta_busqueda(pregunta, contexto_consulta)
+    registros = analisis.get("registros_recuperados")
+    motor = motor_actual()
+    vector = motor.vectorizar_consulta(consulta) if consulta else None
+    version = motor.version_indice
+
+    if registros:
+        texto, tipo = cache_llm.obtener(consulta, registros, version, vector)
+        if texto is not None:
+            logger.info(f"✅ Respuesta generativa desde caché ({tipo}): {pregunta[:50]}...")
+            return formatear_respuesta_llm(texto)
+
+    try:
+        texto = cliente_llm.completar(construir_mensajes_llm(pregunta, analisis))
+    except Exception as e:
+        logger.warning(f"⚠️ Respuesta generativa no disponible: {e!r}")
+        monitor_rendimiento.registrar_error("llm_no_disponible")
+        return ""
+
+    if registros:
+        cache_llm.guardar(consulta, registros, version, texto, vector)
+    return formatear_respuesta_llm(texto)
+
+
+def formatear_respuesta_llm(texto):
+    return f"""
+<div class="analysis-response analysis-generated">
+  <section class="analysis-result">
+    <div class="analysis-result-head">
+      <h4>Respuesta del asistente</h4>
+      <span class="analysis-badge medium">{escape(CHATBOT_CONFIG["provider_label"])}</span>
+    </div>
+    <p class="analysis-description">{formatear_texto_html(texto)}</p>
+  </section>
+</div>
+""".strip()
+
 # =============================================================================
 # FILTROS JINJA2 PERSONALIZADOS
 # =============================================================================
@@ -1222,6 +2005,180 @@ def sum_attribute(sequence, attribute):
 app.jinja_env.filters['datetimeformat'] = datetimeformat
 app.jinja_env.filters['sum_attribute'] = sum_attribute
 
+# =============================================================================
+# RECARGA EN CALIENTE DE FUENTES
+# =============================================================================
+
+_lock_recarga = threading.Lock()
+_vigilante = {"pid": None}
+_lock_solicitud = threading.Lock()
+_recarga_manual = {"hilo": None}
+ultima_recarga = {}
+
+
+def invalidar_caches_version(version):
+    """Descarta de todas las cachés sólo las entradas calculadas con ``version``."""
+    invalidadas = (
+        cache_busqueda.invalidar_version(version)
+        + cache_respuestas.invalidar_version(version)
+        + cache_llm.invalidar_version(version)
+    )
+    if cache_compartido is not None:
+        invalidadas += cache_compartido.invalidar_version(version)
+    return invalidadas
+
+
+def recargar_fuentes(forzar=False):
+    """Construye un motor con las fuentes actuales y lo publica de forma atómica.
+
+    El motor nuevo se construye completo (registros, TF-IDF, postings) antes de
+    reemplazar la referencia global, así que ninguna solicitud ve un índice a
+    medio construir; las que ya estaban en curso terminan con el anterior
+    (ver motor_actual). Si las fuentes sólo agregaron registros al final
+    (se detecta con las huellas por registro de la carga anterior), el motor
+    nuevo es el anterior más un segmento delta (costo proporcional a lo
+    agregado) mientras no haga falta compactar; leer las fuentes sigue
+    costando O(corpus). Sólo se invalidan las entradas
+    de caché de la versión anterior y después se precalientan las consultas
+    frecuentes.
+    """
+    global motor_busqueda, DB_AUDITORIA, ESTADISTICAS_DB
+
+    with _lock_recarga:
+        anterior = motor_busqueda
+        huella = calcular_huella_fuentes()
+        if huella == anterior.huella and not forzar:
+            return {"estado": "sin_cambios", "version": anterior.version_indice}
+
+        inicio = time.perf_counter()
+        datos, estadisticas = cargar_bases_datos(cargar_auditoria_data(huella))
+        nuevo = None
+        if Config.INDICE_INCREMENTAL and not forzar:
+            agregados = registros_agregados(anterior.datos, datos)
+            if agregados:
+                nuevo = anterior.con_registros_agregados(agregados, datos=datos, huella=huella)
+        modo = "incremental" if nuevo is not None else "completo"
+        if nuevo is None:
+            nuevo = MotorBusquedaNormativasMejorado(datos=datos, huella=huella)
+        if not datos or not nuevo.esta_inicializado():
+            logger.error("❌ Recarga descartada: el motor nuevo no se pudo inicializar; se conserva el anterior")
+            monitor_rendimiento.registrar_error("recarga_fallida")
+            return {"estado": "error", "version": anterior.version_indice}
+
+        DB_AUDITORIA, ESTADISTICAS_DB = datos, estadisticas
+        motor_busqueda = nuevo
+
+        invalidadas = 0
+        if nuevo.version_indice != anterior.version_indice:
+            invalidadas = invalidar_caches_version(anterior.version_indice)
+        precalentadas = precalentar_cache()
+
+        resultado = {
+            "estado": "recargado",
+            "modo": modo,
+            "segmentos_delta": len(nuevo.segmentos),
+            "version_anterior": anterior.version_indice,
+            "version": nuevo.version_indice,
+            "registros": len(nuevo.metadatos_unificados),
+            "entradas_invalidadas": invalidadas,
+            "precalentadas": precalentadas,
+            "segundos": round(time.perf_counter() - inicio, 3),
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+        }
+        ultima_recarga.clear()
+        ultima_recarga.update(resultado)
+        logger.info(
+            f"🔄 Fuentes recargadas ({modo}): {anterior.version_indice} → {nuevo.version_indice} "
+            f"({resultado['registros']} registros, {invalidadas} entradas de caché invalidadas)"
+        )
+        return resultado
+
+
+def _firma_fuentes():
+    """(ruta, mtime, tamaño) de cada fuente XLSX y de la marca de recarga manual."""
+    firma = []
+    for ruta in (*FUENTES_XLSX, Path(Config.RECARGA_MARCA)):
+        try:
+            estado = ruta.stat()
+            firma.append((str(ruta), estado.st_mtime_ns, estado.st_size))
+        except OSError:
+            firma.append((str(ruta), None, None))
+    return tuple(firma)
+
+
+def _leer_marca_recarga():
+    """Contenido de la marca de recarga manual ({} si no existe o es del formato anterior)."""
+    try:
+        marca = json.loads(Path(Config.RECARGA_MARCA).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return marca if isinstance(marca, dict) else {}
+
+
+def _vigilar_fuentes(firma):
+    while True:
+        time.sleep(Config.RECARGA_INTERVALO)
+        actual = _firma_fuentes()
+        if actual == firma:
+            continue
+        # Si lo que cambió es la marca, se respeta el "forzar" de la solicitud manual
+        forzar = actual[-1] != firma[-1] and bool(_leer_marca_recarga().get("forzar"))
+        firma = actual
+        try:
+            recargar_fuentes(forzar=forzar)
+        except Exception as e:
+            logger.error(f"❌ Error recargando fuentes: {e}", exc_info=True)
+
+
+def iniciar_vigilante_fuentes():
+    """Inicia (una vez por proceso, también tras un fork) el hilo que vigila las fuentes."""
+    if Config.RECARGA_INTERVALO <= 0 or _vigilante["pid"] == os.getpid():
+        return
+    with _lock_recarga:
+        if _vigilante["pid"] == os.getpid():
+            return
+        _vigilante["pid"] = os.getpid()
+        threading.Thread(
+            target=_vigilar_fuentes,
+            args=(_firma_fuentes(),),
+            name="auditel-recarga",
+            daemon=True,
+        ).start()
+
+
+def solicitar_recarga(forzar=False):
+    """Toca la marca de recarga (la ven los vigilantes de todos los workers) y recarga este worker en segundo plano.
+
+    Si este worker ya está recargando, la solicitud se agrupa con la que está
+    en curso y devuelve False sin tocar la marca ni lanzar otro hilo.
+    """
+    with _lock_solicitud:
+        hilo = _recarga_manual["hilo"]
+        if (hilo is not None and hilo.is_alive()) or _lock_recarga.locked():
+            return False
+        marca = Path(Config.RECARGA_MARCA)
+        marca.parent.mkdir(parents=True, exist_ok=True)
+        marca.write_text(
+            json.dumps({"solicitada": datetime.now().isoformat(), "forzar": forzar}),
+            encoding="utf-8",
+        )
+        hilo = threading.Thread(
+            target=recargar_fuentes,
+            kwargs={"forzar": forzar},
+            name="auditel-recarga-manual",
+            daemon=True,
+        )
+        _recarga_manual["hilo"] = hilo
+        hilo.start()
+        return True
+
+
+@app.before_request
+def fijar_motor_de_la_solicitud():
+    iniciar_vigilante_fuentes()
+    g.motor = motor_busqueda
+
+
 # =============================================================================
 # RUTAS PRINCIPALES MEJORADAS
 # =============================================================================
@@ -1302,6 +2259,7 @@ def index():
 def ask():
     """Endpoint principal para análisis normativo mejorado"""
     start_time = datetime.now()
+    traza, token_traza = trazador.iniciar("/ask")
 
     try:
         # Validar y sanitizar entradas mejorado
@@ -1322,31 +2280,25 @@ def ask():
         logger.info(f"📨 Consulta normativa - Auditoría: {auditoria_label}, Ente: {ente_tipo}, Longitud: {len(question)}")
 
         # GENERAR ANÁLISIS NORMATIVO MEJORADO
-        analisis = generar_analisis_normativo(question, auditoria_tipo, ente_tipo)
-        answer = formatear_respuesta_normativa(analisis)
+        analisis, answer, origen_cache = obtener_respuesta_normativa(question, auditoria_tipo, ente_tipo)
+        with span("generar_respuesta_llm"):
+            respuesta_llm = generar_respuesta_llm(question, analisis, auditoria_tipo)
+        if respuesta_llm:
+            answer = f"{answer}\n{respuesta_llm}"
 
         # Guardar en historial mejorado
-        chat_history = get_chat_history()
-        nuevo_chat = {
-            "question": question,
-            "answer": answer,
-            "auditoria": auditoria_label,
-            "ente": ente_tipo,
-            "timestamp": datetime.now().isoformat(),
-            "normativas_encontradas": len(analisis['normativas']) if analisis['encontrado'] else 0
-        }
-
-        chat_history.append(nuevo_chat)
-        set_chat_history(chat_history)
+        with span("registrar_en_historial"):
+            registrar_en_historial(question, answer, auditoria_label, ente_tipo, analisis)
 
         # Log de resultados
         tiempo_procesamiento = (datetime.now() - start_time).total_seconds()
         logger.info(f"✅ Análisis completado en {tiempo_procesamiento:.2f}s - Normativas: {len(analisis['normativas']) if analisis['encontrado'] else 0}")
 
         # Registrar métricas de éxito
-        monitor_rendimiento.registrar_solicitud(True, tiempo_procesamiento)
+        monitor_rendimiento.registrar_solicitud(True, tiempo_procesamiento, _endpoint_actual())
+        registrar_consulta("/ask", question, auditoria_tipo, analisis, origen_cache, tiempo_procesamiento)
 
-        return jsonify({
+        respuesta = {
             "success": True,
             "answer": answer,
             "auditoria_label": auditoria_label,
@@ -1354,7 +2306,11 @@ def ask():
             "normativas_encontradas": len(analisis['normativas']) if analisis['encontrado'] else 0,
             "tiempo_procesamiento": f"{tiempo_procesamiento:.2f}s",
             "estadisticas": analisis.get("estadisticas", {})
-        })
+        }
+        if traza is not None and Config.TRAZAS_EN_RESPUESTA:
+            traza.cerrar()
+            respuesta["traza"] = traza.a_dict()
+        return jsonify(respuesta)
 
     except json.JSONDecodeError as e:
         logger.error(f"❌ Error JSON en /ask: {e}")
@@ -1365,7 +2321,7 @@ def ask():
             "message": "Error en el formato de datos. Verifica la entrada."
         }), 400
         
-    except requests.RequestException as e:
+    except ConnectionError as e:
         logger.error(f"❌ Error de conexión en /ask: {e}")
         monitor_rendimiento.registrar_error("request_exception")
         monitor_rendimiento.registrar_solicitud(False, 0)
@@ -1392,13 +2348,213 @@ def ask():
             "message": "Error interno del servidor. Por favor, intenta nuevamente."
         }), 500
 
+    finally:
+        trazador.finalizar(traza, token_traza)
+
+@app.route("/ask/stream", methods=["POST"])
+@login_required
+@requiere_configuracion
+@requiere_auditoria
+def ask_stream():
+    """Variante de /ask que envía la respuesta por Server-Sent Events.
+
+    En cuanto termina la búsqueda se envía el resumen junto con el primer
+    resultado (evento ``inicio``); después cada normativa restante
+    (``fragmento``) y al final el cierre con el tiempo total (``fin``). Cada
+    normativa se formatea una sola vez, al enviarla; en un fallo de caché la
+    respuesta se guarda ya unida, después de enviar el último fragmento.
+    """
+    start_time = datetime.now()
+
+    validacion = validar_y_sanitizar_entrada(request.form)
+    if not validacion["valido"]:
+        monitor_rendimiento.registrar_error("validacion_entrada")
+        return jsonify({
+            "success": False,
+            "message": "Errores de validación: " + "; ".join(validacion["errores"])
+        }), 400
+
+    question = validacion["pregunta"]
+    auditoria_tipo = validacion["auditoria"]
+    ente_tipo = validacion["ente"]
+    auditoria_label = obtener_etiqueta_auditoria(auditoria_tipo)
+
+    try:
+        logger.info(f"📨 Consulta normativa (streaming) - Auditoría: {auditoria_label}, Ente: {ente_tipo}, Longitud: {len(question)}")
+        analisis, answer_cacheada, clave, origen_cache = obtener_analisis_normativo(question, auditoria_tipo, ente_tipo)
+
+        # La cookie viaja en los encabezados: el id de la conversación se asigna antes de emitir el cuerpo
+        conversacion = obtener_id_conversacion(crear=True)
+    except Exception as e:
+        logger.error(f"❌ Error inesperado en /ask/stream: {e}", exc_info=True)
+        monitor_rendimiento.registrar_error("exception_generica")
+        monitor_rendimiento.registrar_solicitud(False, 0)
+        return jsonify({
+            "success": False,
+            "message": "Error interno del servidor. Por favor, intenta nuevamente."
+        }), 500
+
+    def eventos():
+        try:
+            fragmentos = generar_fragmentos_respuesta(analisis)
+            inicio = [next(fragmentos)]
+            if analisis['encontrado']:
+                inicio.append(next(fragmentos, ""))
+            enviado = ["\n".join(filter(None, inicio))]
+
+            yield _evento_sse("inicio", {
+                "html": enviado[0],
+                "auditoria_label": auditoria_label,
+                "auditorias_consultadas": analisis.get("auditorias_consultadas", []),
+                "normativas_encontradas": len(analisis['normativas']) if analisis['encontrado'] else 0,
+                "estadisticas": analisis.get("estadisticas", {}),
+            })
+
+            for fragmento in fragmentos:
+                enviado.append("\n" + fragmento)
+                yield _evento_sse("fragmento", {"html": enviado[-1]})
+
+            # Mismo HTML que formatear_respuesta_normativa, armado con lo que ya se envió
+            if answer_cacheada is None:
+                _guardar_respuesta(clave, analisis, answer="".join(enviado))
+
+            # La generación (si hay proveedor) llega después de las normativas ya mostradas
+            respuesta_llm = generar_respuesta_llm(question, analisis, auditoria_tipo)
+            if respuesta_llm:
+                enviado.append("\n" + respuesta_llm)
+                yield _evento_sse("fragmento", {"html": enviado[-1]})
+
+            # El historial vive en el servidor: se guarda la respuesta completa ya enviada
+            registrar_en_historial(
+                question, "".join(enviado), auditoria_label, ente_tipo, analisis, conversacion=conversacion,
+            )
+
+            tiempo_procesamiento = (datetime.now() - start_time).total_seconds()
+            monitor_rendimiento.registrar_solicitud(True, tiempo_procesamiento, _endpoint_actual())
+            registrar_consulta("/ask/stream", question, auditoria_tipo, analisis, origen_cache, tiempo_procesamiento)
+            yield _evento_sse("fin", {"tiempo_procesamiento": f"{tiempo_procesamiento:.2f}s"})
+
+        except Exception as e:
+            logger.error(f"❌ Error durante el streaming de /ask/stream: {e}", exc_info=True)
+            monitor_rendimiento.registrar_error("exception_generica")
+            monitor_rendimiento.registrar_solicitud(False, 0)
+            yield _evento_sse("error", {"message": "Error interno del servidor. Por favor, intenta nuevamente."})
+
+    return Response(
+        stream_with_context(eventos()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Evita que nginx acumule la respuesta antes de enviarla
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+def _evento_sse(evento, datos):
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+@app.route("/api/ask/batch", methods=["POST"])
+@login_required
+@requiere_configuracion
+def ask_batch():
+    """Análisis normativo de una lista de preguntas en una sola solicitud.
+
+    Acepta un arreglo JSON de preguntas o un objeto
+    ``{"preguntas": [...], "auditoria": ..., "ente": ...}``. No modifica el
+    historial de chat de la sesión.
+    """
+    start_time = datetime.now()
+
+    datos = request.get_json(silent=True)
+    if isinstance(datos, list):
+        datos = {"preguntas": datos}
+    if not isinstance(datos, dict) or not isinstance(datos.get("preguntas"), list):
+        monitor_rendimiento.registrar_error("validacion_entrada")
+        return jsonify({
+            "success": False,
+            "message": "Se esperaba un arreglo JSON de preguntas."
+        }), 400
+
+    preguntas = datos["preguntas"]
+    if len(preguntas) > Config.BATCH_MAX_PREGUNTAS:
+        monitor_rendimiento.registrar_error("validacion_entrada")
+        return jsonify({
+            "success": False,
+            "message": f"Demasiadas preguntas en el lote (máximo {Config.BATCH_MAX_PREGUNTAS})."
+        }), 400
+
+    auditoria = datos.get("auditoria")
+    ente = datos.get("ente")
+    auditoria_tipo = validar_auditoria_tipo(auditoria) if auditoria is None or isinstance(auditoria, str) else None
+    if not auditoria_tipo or not isinstance(ente, (str, type(None))):
+        monitor_rendimiento.registrar_error("validacion_entrada")
+        return jsonify({"success": False, "message": "Tipo de auditoría o ente inválido."}), 400
+
+    try:
+        validaciones = [
+            validar_y_sanitizar_entrada({
+                "question": pregunta if isinstance(pregunta, str) else "",
+                "auditoria": auditoria_tipo,
+                "ente": ente or "",
+            })
+            for pregunta in preguntas
+        ]
+        validas = [validacion for validacion in validaciones if validacion["valido"]]
+        ente_tipo = validas[0]["ente"] if validas else "No especificado"
+
+        logger.info(
+            f"📨 Consulta normativa por lote - Auditoría: {obtener_etiqueta_auditoria(auditoria_tipo)}, "
+            f"Preguntas: {len(preguntas)}"
+        )
+        analisis_validos = iter(obtener_analisis_normativos_lote(
+            [validacion["pregunta"] for validacion in validas],
+            auditoria_tipo,
+            ente_tipo,
+        ))
+
+        resultados = []
+        for validacion in validaciones:
+            if validacion["valido"]:
+                resultados.append({
+                    "pregunta": validacion["pregunta"],
+                    "analisis": next(analisis_validos),
+                })
+            else:
+                resultados.append({
+                    "pregunta": validacion["pregunta"],
+                    "error": "; ".join(validacion["errores"]),
+                })
+
+        tiempo_procesamiento = (datetime.now() - start_time).total_seconds()
+        logger.info(f"✅ Lote completado en {tiempo_procesamiento:.2f}s - Preguntas: {len(preguntas)}")
+        monitor_rendimiento.registrar_solicitud(True, tiempo_procesamiento, _endpoint_actual())
+
+        return jsonify({
+            "success": True,
+            "auditoria_label": obtener_etiqueta_auditoria(auditoria_tipo),
+            "resultados": resultados,
+            "tiempo_procesamiento": f"{tiempo_procesamiento:.2f}s",
+        })
+
+    except Exception as e:
+        logger.error(f"❌ Error inesperado en /api/ask/batch: {e}", exc_info=True)
+        monitor_rendimiento.registrar_error("exception_generica")
+        monitor_rendimiento.registrar_solicitud(False, 0)
+        return jsonify({
+            "success": False,
+            "message": "Error interno del servidor. Por favor, intenta nuevamente."
+        }), 500
+
 @app.route("/clear", methods=["POST"])
 @login_required
 def clear():
     """Limpiar la sesión y comenzar de nuevo"""
     try:
+        conversacion = session.pop("historial_id", None)
         session.pop("chat_history", None)
-        session.modified = True
+        if conversacion:
+            historial_chat.limpiar(conversacion, session.get("usuario", ""))
         flash("🔄 Nueva sesión iniciada.", "success")
         logger.info("✅ Sesión limpiada correctamente")
     except Exception as e:
@@ -1407,18 +2563,65 @@ def clear():
 
     return redirect(url_for("index"))
 
+@app.route("/api/admin/recargar", methods=["POST"])
+def recargar():
+    """Recarga las fuentes normativas sin reiniciar: este worker de inmediato, el resto con su vigilante.
+
+    Requiere sesión de administrador o el token AUDITEL_ADMIN_TOKEN en
+    ``Authorization: Bearer <token>``. ``forzar=1`` reconstruye el índice
+    aunque la huella de las fuentes no haya cambiado.
+    """
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+    token_valido = bool(Config.ADMIN_TOKEN) and hmac.compare_digest(token, Config.ADMIN_TOKEN)
+    if not (token_valido or is_admin()):
+        if is_authenticated():
+            return jsonify({"success": False, "message": "Se requiere un usuario administrador"}), 403
+        return jsonify({"success": False, "message": "No autorizado"}), 401
+
+    datos = request.get_json(silent=True) or {}
+    forzar = str(datos.get("forzar", request.values.get("forzar", ""))).strip().lower() in ("1", "true", "si", "sí")
+    iniciada = solicitar_recarga(forzar=forzar)
+    return jsonify({
+        "success": True,
+        "estado": "en_curso",
+        "agrupada": not iniciada,
+        "forzar": forzar,
+        "version_actual": motor_busqueda.version_indice,
+    }), 202
+
 @app.route("/api/health", methods=["GET"])
 @app.route("/health", methods=["GET"])
 def health_check():
-    """Endpoint de salud mejorado para monitoreo"""
+    """Salud pública y barata (sin sesión): estado y versión del índice.
+
+    No lee /proc ni consulta las cachés; el diagnóstico completo está en
+    /api/health/detalle (con sesión).
+    """
+    return jsonify({
+        "status": "healthy" if DB_AUDITORIA else "degraded",
+        "version_indice": motor_actual().version_indice,
+    })
+
+@app.route("/api/health/detalle", methods=["GET"])
+@login_required
+def health_detalle():
+    """Diagnóstico del worker: bases, motor, cachés, cortocircuito, rendimiento y memoria."""
+    motor = motor_actual()
     status = {
         "status": "healthy" if DB_AUDITORIA else "degraded",
         "databases_loaded": len(DB_AUDITORIA),
         "total_records": sum(len(db) for db in DB_AUDITORIA.values()),
         "auditorias_activas": list(DB_AUDITORIA.keys()),
-        "motor_busqueda_activo": motor_busqueda.esta_inicializado(),
+        "motor_busqueda_activo": motor.esta_inicializado(),
+        "version_indice": motor.version_indice,
+        "ultima_recarga": ultima_recarga or None,
         "cache_estadisticas": cache_busqueda.estadisticas(),
+        "cache_respuestas_estadisticas": cache_respuestas.estadisticas(),
+        "cache_compartido_estadisticas": cache_compartido.estadisticas() if cache_compartido else None,
+        "llm_cortocircuito": cliente_llm.cortocircuito.estado if cliente_llm else None,
+        "cache_llm_estadisticas": cache_llm.estadisticas(),
         "metricas_rendimiento": monitor_rendimiento.obtener_metricas(),
+        "memoria_worker": memoria_proceso(),
         "timestamp": datetime.now().isoformat(),
         "version": "2.1.0"
     }
@@ -1460,11 +2663,25 @@ def get_metrics():
         "estadisticas_sistema": {
             "auditorias_cargadas": len(DB_AUDITORIA),
             "total_registros": sum(len(db) for db in DB_AUDITORIA.values()),
-            "tamaño_cache": len(cache_busqueda.cache),
+            "tamaño_cache": len(cache_busqueda),
             "motor_documentos_indexados": documentos_indexados
         }
     })
 
+@app.route("/metrics/prometheus", methods=["GET"])
+def get_metrics_prometheus():
+    """Métricas de todos los workers en formato de texto de Prometheus.
+
+    Requiere sesión iniciada o el token AUDITEL_METRICAS_TOKEN en
+    ``Authorization: Bearer <token>`` (para el scraper).
+    """
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+    token_valido = bool(Config.METRICAS_TOKEN) and hmac.compare_digest(token, Config.METRICAS_TOKEN)
+    if not (token_valido or is_authenticated()):
+        return Response("no autorizado\n", status=401, mimetype="text/plain")
+
+    return Response(monitor_rendimiento.prometheus(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
 # =============================================================================
 # MANEJO DE ERRORES GLOBAL MEJORADO
 # =============================================================================
@@ -1494,6 +2711,40 @@ def too_large(error):
 # INICIALIZACIÓN MEJORADA
 # =============================================================================
 
+# Cada worker arranca con las consultas más frecuentes ya en caché; con
+# preload_app esto corre una sola vez en el master y los workers lo heredan
+precalentar_cache()
+
+
+def preparar_para_fork():
+    """Deja el estado del master listo para compartirse con los workers (gunicorn --preload).
+
+    Registros e índice quedan como arreglos mapeados desde disco: los workers
+    los leen sin escribir en sus páginas (un dict o tupla por fila se copiaría
+    al tocar su refcount). ``gc.freeze()`` pasa los objetos del master a la
+    generación permanente para que el GC de los workers no los recorra ni
+    modifique sus cabeceras. Ver deploy/gunicorn.conf.py.
+    """
+    global motor_busqueda
+
+    # Índice recién ajustado: sus textos normalizados son objetos por fila; se relee la versión mapeada
+    if motor_busqueda.esta_inicializado() and not motor_busqueda.indice_desde_disco and not motor_busqueda.segmentos:
+        mapeado = MotorBusquedaNormativasMejorado(
+            motor_puntuacion=motor_busqueda.motor_puntuacion,
+            datos=motor_busqueda.datos,
+            huella=motor_busqueda.huella,
+        )
+        if mapeado.indice_desde_disco:
+            motor_busqueda = mapeado
+    gc.freeze()
+
+
+def tras_fork():
+    """Inicio de cada worker precargado: reactiva el GC y descarta las métricas heredadas del master."""
+    gc.enable()
+    monitor_rendimiento.reiniciar()
+
+
 if __name__ == "__main__":
     # Verificaciones de inicio mejoradas
     checks_passed = True
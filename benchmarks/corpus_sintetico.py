@@ -0,0 +1,99 @@
+"""
+Auditel — Corpus sintético para benchmarks
+==========================================
+Escala AUDITORIA_DATA a N registros conservando la proporción entre
+auditorías, los campos de cada una y la distribución de palabras del corpus
+real. Cada registro sintético parte de uno real: mezcla palabras de su
+descripción, agrega palabras del vocabulario del corpus y términos nuevos
+(para que el vocabulario crezca con el tamaño, como en datos reales) y
+renumera los artículos de sus normativas. Con la misma semilla el corpus es
+idéntico en cada ejecución.
+"""
+
+import random
+import re
+
+_PALABRA = re.compile(r"[a-záéíóúñü]{4,}", re.IGNORECASE)
+CAMPOS_TEXTO = ("tipo", "concepto", "descripcion_irregularidad", "categoria", "subcategoria")
+
+
+def _vocabulario(auditoria_data):
+    palabras = set()
+    for datos in auditoria_data.values():
+        for item in datos:
+            for campo in CAMPOS_TEXTO:
+                palabras.update(palabra.lower() for palabra in _PALABRA.findall(str(item.get(campo) or "")))
+    return sorted(palabras)
+
+
+def _renumerar_articulos(texto, aleatorio):
+    return re.sub(r"\d+", lambda _: str(aleatorio.randint(1, 300)), texto)
+
+
+def _variante(item, indice, vocabulario, aleatorio, terminos_nuevos):
+    variante = dict(item)
+    extra = aleatorio.sample(vocabulario, k=min(3, len(vocabulario)))
+    termino = f"termino{aleatorio.randrange(terminos_nuevos):06d}"
+
+    variante["tipo"] = " ".join([str(item.get("tipo") or ""), *extra[:2]]).strip()
+    if item.get("concepto"):
+        variante["concepto"] = f"{item['concepto']} {extra[-1]}"
+
+    palabras = str(item.get("descripcion_irregularidad") or "").split()
+    if palabras:
+        aleatorio.shuffle(palabras)
+        palabras = palabras[: max(8, len(palabras) * 2 // 3)]
+    variante["descripcion_irregularidad"] = " ".join(palabras + extra + [termino])
+
+    for campo, valor in item.items():
+        if "normatividad" in campo.lower() and isinstance(valor, str) and valor:
+            variante[campo] = _renumerar_articulos(valor, aleatorio)
+
+    variante["origen_fuente"] = f"sintetico-{indice}"
+    return variante
+
+
+def generar_corpus(auditoria_data, total, semilla=0):
+    """Devuelve {auditoría: [registros]} con ``total`` registros en total.
+
+    Los registros reales se incluyen tal cual; el resto son variantes.
+    """
+    aleatorio = random.Random(semilla)
+    vocabulario = _vocabulario(auditoria_data)
+    reales = {auditoria: [dict(item) for item in datos] for auditoria, datos in auditoria_data.items() if len(datos)}
+    total_real = sum(len(datos) for datos in reales.values())
+    # ~1 término nuevo por cada 20 registros: el vocabulario crece de forma sublineal
+    terminos_nuevos = max(1, total // 20)
+
+    corpus = {}
+    asignados = 0
+    auditorias = list(reales)
+    for posicion, auditoria in enumerate(auditorias):
+        base = reales[auditoria]
+        if posicion == len(auditorias) - 1:
+            cantidad = total - asignados
+        else:
+            cantidad = round(total * len(base) / total_real)
+        asignados += cantidad
+
+        registros = base[:cantidad]
+        for indice in range(len(registros), cantidad):
+            registros.append(_variante(aleatorio.choice(base), indice, vocabulario, aleatorio, terminos_nuevos))
+        corpus[auditoria] = registros
+    return corpus
+
+
+def generar_preguntas(corpus, cantidad, semilla=1):
+    """Preguntas tipo usuario tomadas de tipos/conceptos del corpus (repetibles con la semilla)."""
+    aleatorio = random.Random(semilla)
+    plantillas = ("¿Qué normativa aplica a {}?", "normativa de {}", "{}", "cuál es la normatividad del concepto {}")
+    registros = [item for datos in corpus.values() for item in datos]
+    preguntas = []
+    for _ in range(cantidad):
+        item = aleatorio.choice(registros)
+        palabras = str(item.get("concepto") or item.get("tipo") or "").split()
+        if len(palabras) > 6:
+            inicio = aleatorio.randrange(len(palabras) - 5)
+            palabras = palabras[inicio:inicio + 6]
+        preguntas.append(aleatorio.choice(plantillas).format(" ".join(palabras).lower()))
+    return preguntas
@@ -0,0 +1,281 @@
+"""
+Auditel — Benchmarks del pipeline de búsqueda y respuesta
+=========================================================
+Mide, con un corpus sintético de cada tamaño pedido:
+
+- arranque en frío: import de ``scripts.utils`` y de ``app`` en un proceso
+  nuevo, sin índice persistido y con él;
+- construcción del índice (ajuste TF-IDF, postings, textos normalizados) y
+  su carga desde disco;
+- latencia de una consulta sin caché (``obtener_respuesta_normativa``);
+- rendimiento por lote (``obtener_analisis_normativos_lote``), preguntas/s;
+- latencia con la respuesta ya en caché.
+
+Todo se ejecuta con índice, registros, métricas, trazas y cachés en un
+directorio temporal, así que no toca ``indice/`` ni los datos de ``logs/``
+(sólo ``logs/app.log``). El resultado se guarda en JSON
+(por defecto ``benchmarks/resultados/<commit>.json``) para comparar commits:
+
+    python -m benchmarks.ejecutar --tamanos 10000,100000
+    python -m benchmarks.ejecutar --tamanos 10000 --comparar benchmarks/resultados/abc1234.json
+
+1 000 000 de registros (``--tamanos 1000000``) necesita varios GB de RAM y
+algunos minutos para construir el índice.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+RAIZ = Path(__file__).resolve().parent.parent
+TAMANOS_POR_DEFECTO = (10_000, 100_000)
+
+
+def preparar_entorno(directorio):
+    """Aísla índice, registros, historial, métricas, trazas y cachés en ``directorio`` (antes de importar app).
+
+    Como en tests/conftest.py: trazas, caché compartida y marca de recarga no
+    van a logs/, así que una caché compartida ya caliente no altera los aciertos.
+    """
+    directorio = Path(directorio)
+    os.environ.update({
+        "AUDITEL_INDICE_DIR": str(directorio / "indice"),
+        "AUDITEL_REGISTRO_CONSULTAS": str(directorio / "consultas.jsonl"),
+        "AUDITEL_HISTORIAL_RUTA": str(directorio / "historial.sqlite3"),
+        "AUDITEL_METRICAS_DIR": str(directorio / "metricas"),
+        "AUDITEL_CACHE_COMPARTIDO_RUTA": str(directorio / "cache_compartido.sqlite3"),
+        "AUDITEL_TRAZAS_RUTA": str(directorio / "trazas.json"),
+        "AUDITEL_RECARGA_MARCA": str(directorio / "recarga.marca"),
+        "AUDITEL_CACHE_COMPARTIDO": "0",
+        "AUDITEL_PRECALENTAR_TOP": "0",
+        "AUDITEL_TRAZAS_MUESTREO": "0",
+    })
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+
+
+def resumir(tiempos):
+    """Estadísticos en milisegundos de una lista de duraciones en segundos."""
+    ordenados = sorted(tiempos)
+    return {
+        "n": len(ordenados),
+        "media_ms": round(statistics.fmean(ordenados) * 1000, 3),
+        "p50_ms": round(ordenados[len(ordenados) // 2] * 1000, 3),
+        "p95_ms": round(ordenados[min(int(len(ordenados) * 0.95), len(ordenados) - 1)] * 1000, 3),
+        "min_ms": round(ordenados[0] * 1000, 3),
+    }
+
+
+def _memoria_maxima_mb():
+    # ru_maxrss está en KiB en Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _tiempo_import(modulo, entorno):
+    codigo = (
+        "import time; inicio = time.perf_counter(); "
+        f"import {modulo}; print(time.perf_counter() - inicio)"
+    )
+    salida = subprocess.run(
+        [sys.executable, "-c", codigo],
+        cwd=RAIZ, env=entorno, capture_output=True, text=True, check=True,
+    )
+    return float(salida.stdout.strip().splitlines()[-1])
+
+
+def medir_arranque(directorio, repeticiones):
+    """Import de scripts.utils y app en procesos nuevos (sin índice persistido y con él)."""
+    entorno = dict(os.environ)
+    frio = []
+    for repeticion in range(repeticiones):
+        entorno["AUDITEL_INDICE_DIR"] = str(Path(directorio) / f"arranque-{repeticion}")
+        frio.append(_tiempo_import("app", entorno))
+    # El último directorio ya tiene el índice publicado
+    return {
+        "import_utils": resumir([_tiempo_import("scripts.utils", entorno) for _ in range(repeticiones)]),
+        "import_app_sin_indice": resumir(frio),
+        "import_app_con_indice": resumir([_tiempo_import("app", entorno) for _ in range(repeticiones)]),
+    }
+
+
+def medir_tamano(app, tamano, consultas, semilla=0):
+    """Construcción, carga, consulta individual, lote y caché sobre un corpus sintético de ``tamano`` registros."""
+    from benchmarks.corpus_sintetico import generar_corpus, generar_preguntas
+    from scripts.cache import SistemaCache
+    from scripts.utils import AUDITORIA_DATA, HUELLA_FUENTES
+
+    inicio = time.perf_counter()
+    corpus = generar_corpus(AUDITORIA_DATA, tamano, semilla)
+    generacion = time.perf_counter() - inicio
+    preguntas = generar_preguntas(corpus, consultas, semilla + 1)
+
+    # Huella propia del corpus sintético: su índice no se confunde con el real
+    huella = hashlib.sha256(f"{HUELLA_FUENTES}:{tamano}:{semilla}".encode()).hexdigest()[:16]
+
+    inicio = time.perf_counter()
+    motor = app.MotorBusquedaNormativasMejorado(datos=corpus, huella=huella)
+    construccion = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    app.MotorBusquedaNormativasMejorado(datos=corpus, huella=huella)
+    carga = time.perf_counter() - inicio
+
+    app.motor_busqueda = motor
+    app.cache_compartido = None
+    app.cache_busqueda = SistemaCache(max_size=len(preguntas) * 2)
+    app.cache_respuestas = SistemaCache(max_size=len(preguntas) * 2)
+
+    def limpiar_caches():
+        app.cache_busqueda.limpiar()
+        app.cache_respuestas.limpiar()
+
+    individual = []
+    encontradas = 0
+    for pregunta in preguntas:
+        limpiar_caches()
+        inicio = time.perf_counter()
+        analisis, _, _ = app.obtener_respuesta_normativa(pregunta, app.AUTO_AUDITORIA)
+        individual.append(time.perf_counter() - inicio)
+        encontradas += bool(analisis.get("encontrado"))
+
+    limpiar_caches()
+    inicio = time.perf_counter()
+    app.obtener_analisis_normativos_lote(preguntas, app.AUTO_AUDITORIA)
+    lote = time.perf_counter() - inicio
+
+    # Las respuestas del lote quedaron en caché
+    en_cache = []
+    for pregunta in preguntas:
+        inicio = time.perf_counter()
+        app.obtener_respuesta_normativa(pregunta, app.AUTO_AUDITORIA)
+        en_cache.append(time.perf_counter() - inicio)
+
+    return {
+        "registros": len(motor.metadatos_unificados),
+        "terminos": len(motor.vectorizer.vocabulary_),
+        "generacion_corpus_s": round(generacion, 3),
+        "construccion_indice_s": round(construccion, 3),
+        "carga_indice_s": round(carga, 3),
+        "consulta_sin_cache": resumir(individual),
+        # Fracción de preguntas con normativa encontrada (comprueba que se mide el camino completo)
+        "con_resultado": round(encontradas / len(preguntas), 3) if preguntas else 0.0,
+        "lote": {
+            "preguntas": len(preguntas),
+            "total_s": round(lote, 3),
+            "preguntas_por_s": round(len(preguntas) / lote, 1) if lote else None,
+        },
+        "consulta_en_cache": resumir(en_cache),
+        "memoria_maxima_mb": _memoria_maxima_mb(),
+    }
+
+
+def _commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        sucio = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=RAIZ, capture_output=True, text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconocido", False
+    return commit, bool(sucio)
+
+
+def _metricas_planas(datos, prefijo=""):
+    """{"tamanos.10000.consulta_sin_cache.p50_ms": 1.2, ...} para comparar dos resultados."""
+    planas = {}
+    for clave, valor in datos.items():
+        nombre = f"{prefijo}{clave}"
+        if isinstance(valor, dict):
+            planas.update(_metricas_planas(valor, nombre + "."))
+        elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            planas[nombre] = valor
+    return planas
+
+
+def comparar(anterior, actual):
+    """Líneas "métrica: antes -> ahora (xN)" de las métricas presentes en ambos resultados."""
+    antes = _metricas_planas(anterior["resultados"])
+    ahora = _metricas_planas(actual["resultados"])
+    lineas = [f"{anterior.get('commit')} -> {actual.get('commit')}"]
+    for nombre in sorted(antes.keys() & ahora.keys()):
+        if nombre.endswith((".n", ".preguntas", ".registros", ".terminos")):
+            continue
+        razon = f"x{ahora[nombre] / antes[nombre]:.2f}" if antes[nombre] else "-"
+        lineas.append(f"  {nombre}: {antes[nombre]} -> {ahora[nombre]} ({razon})")
+    return lineas
+
+
+def ejecutar(tamanos, consultas=200, repeticiones=3, arranque=True, semilla=0):
+    """Ejecuta la batería completa y devuelve el resultado (dict serializable a JSON)."""
+    commit, sucio = _commit()
+    resultados = {}
+
+    with tempfile.TemporaryDirectory(prefix="auditel-bench-") as directorio:
+        preparar_entorno(directorio)
+        if arranque:
+            resultados["arranque"] = medir_arranque(directorio, repeticiones)
+
+        sys.path.insert(0, str(RAIZ))
+        import app
+
+        logging.getLogger("auditel").setLevel(logging.WARNING)
+        resultados["tamanos"] = {
+            str(tamano): medir_tamano(app, tamano, consultas, semilla)
+            for tamano in tamanos
+        }
+
+    return {
+        "commit": commit,
+        "cambios_sin_commit": sucio,
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "nucleos": os.cpu_count(),
+        "parametros": {"consultas": consultas, "repeticiones": repeticiones, "semilla": semilla},
+        "resultados": resultados,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.ejecutar",
+        description="Benchmarks de arranque, índice, consulta, lote y caché con corpus sintético.",
+    )
+    parser.add_argument("--tamanos", default=",".join(str(t) for t in TAMANOS_POR_DEFECTO),
+                        help="Registros del corpus sintético, separados por coma (p. ej. 10000,100000,1000000)")
+    parser.add_argument("--consultas", type=int, default=200, help="Preguntas por tamaño")
+    parser.add_argument("--repeticiones", type=int, default=3, help="Repeticiones del arranque en frío")
+    parser.add_argument("--sin-arranque", action="store_true", help="No medir el arranque en frío")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", help="Archivo JSON de resultados (por defecto benchmarks/resultados/<commit>.json)")
+    parser.add_argument("--comparar", help="Resultado JSON anterior con el que comparar")
+    args = parser.parse_args(argv)
+
+    tamanos = [int(tamano) for tamano in args.tamanos.split(",") if tamano.strip()]
+    resultado = ejecutar(tamanos, args.consultas, args.repeticiones, not args.sin_arranque, args.semilla)
+
+    salida = Path(args.salida) if args.salida else RAIZ / "benchmarks" / "resultados" / f"{resultado['commit']}.json"
+    salida.parent.mkdir(parents=True, exist_ok=True)
+    salida.write_text(json.dumps(resultado, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(json.dumps(resultado["resultados"], ensure_ascii=False, indent=2))
+    print(f"Resultados guardados en {salida}")
+
+    if args.comparar:
+        anterior = json.loads(Path(args.comparar).read_text(encoding="utf-8"))
+        print("\n".join(comparar(anterior, resultado)))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
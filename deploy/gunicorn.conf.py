@@ -0,0 +1,45 @@
+"""
+Configuración de gunicorn para Auditel
+======================================
+
+    gunicorn -c deploy/gunicorn.conf.py app:app
+
+Con ``preload_app`` (por defecto; ``AUDITEL_PRELOAD=0`` lo desactiva) el
+master importa ``app`` una sola vez: carga registros e índice, y los workers
+los heredan por fork en vez de construirlos cada uno. Como recomienda la
+documentación de ``gc.freeze``: el GC se desactiva en el master antes de
+importar la aplicación (no deja huecos en páginas que luego se comparten),
+``app.preparar_para_fork()`` congela los objetos antes de cada fork y cada
+worker reactiva el GC al empezar (``app.tras_fork()``).
+
+``/api/health/detalle`` muestra en ``memoria_worker`` la memoria compartida
+y la privada del worker que responde.
+"""
+
+import gc
+import os
+
+bind = f"127.0.0.1:{os.getenv('PORT') or 5003}"
+workers = int(os.getenv("AUDITEL_WORKERS") or 2)
+timeout = 120
+accesslog = "logs/gunicorn-access.log"
+errorlog = "logs/gunicorn-error.log"
+
+preload_app = (os.getenv("AUDITEL_PRELOAD") or "1").strip().lower() in ("1", "true", "si", "sí")
+
+if preload_app:
+    gc.disable()
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        import app
+
+        app.preparar_para_fork()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import app
+
+        app.tras_fork()
@@ -0,0 +1,335 @@
+"""
+Auditel — Anotación masiva de hallazgos
+=======================================
+Lee un XLSX de irregularidades observadas y escribe, para cada fila, la
+normativa que mejor coincide según el mismo motor y filtros que usa /ask.
+
+Uso:
+
+    python -m scripts.anotar_hallazgos hallazgos.xlsx anotado.csv --columnas B,C
+    python -m scripts.anotar_hallazgos hallazgos.xlsx anotado.xlsx --auditoria "Obra Pública" --procesos 4
+
+Las filas se leen en streaming con ``_leer_filas_xlsx``, se reparten por
+bloques entre un pool de procesos (cada bloque se busca con un solo producto
+matricial) y se escriben en orden a medida que terminan, así que la memoria no
+depende del tamaño del libro.
+"""
+
+import argparse
+import csv
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from xml.sax.saxutils import escape
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from scripts.utils import _columna_a_indice, _leer_filas_xlsx
+
+TAMANO_BLOQUE = 256
+
+COLUMNAS_ANOTACION = [
+    "Tipo de irregularidad",
+    "Concepto",
+    "Normativa aplicable",
+    "Similitud",
+    "Auditoría",
+]
+
+
+def _auditel():
+    # Import diferido: cargar el motor es costoso y no hace falta para --help
+    import app
+    return app
+
+
+def _parsear_columnas(texto):
+    """Convierte "B,C" o "2,3" en índices base 0."""
+    columnas = []
+    for parte in texto.split(","):
+        parte = parte.strip()
+        if not parte:
+            continue
+        indice = int(parte) if parte.isdigit() else _columna_a_indice(parte)
+        if indice < 1:
+            raise argparse.ArgumentTypeError(f"Columna inválida: {parte}")
+        columnas.append(indice - 1)
+    if not columnas:
+        raise argparse.ArgumentTypeError("Indica al menos una columna")
+    return columnas
+
+
+def _texto_consulta(valores, columnas):
+    return " ".join(valores[columna] for columna in columnas if columna < len(valores) and valores[columna])
+
+
+def _anotacion(normativa):
+    if normativa is None:
+        return [""] * len(COLUMNAS_ANOTACION)
+    return [
+        normativa["tipo_irregularidad"],
+        normativa["concepto"],
+        "\n".join(f"{nombre}: {texto}" for nombre, texto in normativa["normativas"].items()),
+        f"{normativa['puntaje_similitud']:.3f}",
+        normativa["auditoria"],
+    ]
+
+
+def anotar_bloque(filas, auditoria_tipo, columnas):
+    """Anota un bloque de filas [(numero_fila, valores)] con su mejor normativa.
+
+    Todas las consultas del bloque se puntúan con un solo producto disperso
+    (buscar_semanticamente_lote) y luego pasan por los mismos filtros de
+    extraer_normativas_relevantes que una consulta individual.
+    """
+    auditel = _auditel()
+    contexto_consulta = None if auditel.es_busqueda_unificada(auditoria_tipo) else auditoria_tipo
+
+    preguntas = [_texto_consulta(valores, columnas) for _, valores in filas]
+    consultas = [auditel.preparar_consulta_busqueda(pregunta, contexto_consulta) for pregunta in preguntas]
+    con_texto = [consulta for consulta in dict.fromkeys(consultas) if consulta]
+    resultados = dict(zip(
+        con_texto,
+        auditel.motor_busqueda.buscar_semanticamente_lote(
+            con_texto,
+            auditoria_tipo,
+            top_n=auditel._top_n_busqueda(auditoria_tipo),
+        ),
+    ))
+
+    anotadas = []
+    for (_, valores), pregunta, consulta in zip(filas, preguntas, consultas):
+        normativas = []
+        if consulta:
+            normativas = auditel.extraer_normativas_relevantes(
+                auditoria_tipo,
+                pregunta,
+                resultados_semanticos=resultados[consulta],
+            )
+        anotadas.append(valores + _anotacion(normativas[0] if normativas else None))
+    return anotadas
+
+
+def _bloques(filas, tamano):
+    bloque = []
+    for fila in filas:
+        bloque.append(fila)
+        if len(bloque) >= tamano:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+
+def _anotar_en_orden(bloques, auditoria_tipo, columnas, procesos):
+    """Genera los bloques anotados en el orden de entrada, con a lo sumo 2 bloques en vuelo por proceso."""
+    if procesos <= 1:
+        for bloque in bloques:
+            yield anotar_bloque(bloque, auditoria_tipo, columnas)
+        return
+
+    # Con fork los procesos heredan el motor ya cargado (páginas compartidas)
+    metodos = multiprocessing.get_all_start_methods()
+    contexto = multiprocessing.get_context("fork" if "fork" in metodos else None)
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto) as executor:
+        pendientes = []
+        for bloque in bloques:
+            pendientes.append(executor.submit(anotar_bloque, bloque, auditoria_tipo, columnas))
+            if len(pendientes) >= 2 * procesos:
+                yield pendientes.pop(0).result()
+        for futuro in pendientes:
+            yield futuro.result()
+
+
+class _EscritorCSV:
+    def __init__(self, ruta):
+        self._archivo = open(ruta, "w", newline="", encoding="utf-8-sig")
+        self._csv = csv.writer(self._archivo)
+
+    def escribir(self, valores):
+        self._csv.writerow(valores)
+
+    def cerrar(self):
+        self._archivo.close()
+
+
+class _EscritorXLSX:
+    """Escribe una hoja XLSX mínima (cadenas inline) en streaming, sin dependencias externas."""
+
+    _CONTENT_TYPES = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    )
+    _RELS = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    )
+    _WORKBOOK = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Anotado" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+    _WORKBOOK_RELS = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    )
+
+    def __init__(self, ruta):
+        self._zip = ZipFile(ruta, "w", compression=ZIP_DEFLATED)
+        self._zip.writestr("[Content_Types].xml", self._CONTENT_TYPES)
+        self._zip.writestr("_rels/.rels", self._RELS)
+        self._zip.writestr("xl/workbook.xml", self._WORKBOOK)
+        self._zip.writestr("xl/_rels/workbook.xml.rels", self._WORKBOOK_RELS)
+        self._hoja = self._zip.open("xl/worksheets/sheet1.xml", "w", force_zip64=True)
+        self._hoja.write(
+            b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+        )
+        self._fila = 0
+
+    @staticmethod
+    def _letra(indice):
+        letras = ""
+        while indice:
+            indice, resto = divmod(indice - 1, 26)
+            letras = chr(65 + resto) + letras
+        return letras
+
+    def escribir(self, valores):
+        self._fila += 1
+        celdas = "".join(
+            f'<c r="{self._letra(columna)}{self._fila}" t="inlineStr"><is><t xml:space="preserve">'
+            f"{escape(str(valor))}</t></is></c>"
+            for columna, valor in enumerate(valores, start=1)
+            if valor != ""
+        )
+        self._hoja.write(f'<row r="{self._fila}">{celdas}</row>'.encode("utf-8"))
+
+    def cerrar(self):
+        self._hoja.write(b"</sheetData></worksheet>")
+        self._hoja.close()
+        self._zip.close()
+
+
+def _crear_escritor(ruta):
+    sufijo = ruta.suffix.lower()
+    if sufijo == ".csv":
+        return _EscritorCSV(ruta)
+    if sufijo == ".xlsx":
+        return _EscritorXLSX(ruta)
+    raise ValueError(f"Formato de salida no soportado: {ruta.suffix} (usa .csv o .xlsx)")
+
+
+def anotar_libro(entrada, salida, columnas, auditoria_tipo, hoja=None, fila_inicio=2,
+                 procesos=1, tamano_bloque=TAMANO_BLOQUE, progreso=None):
+    """Anota el libro ``entrada`` y escribe ``salida`` (CSV o XLSX). Devuelve el número de filas anotadas.
+
+    La fila anterior a ``fila_inicio`` (si existe) se copia como encabezado con
+    las columnas de anotación añadidas.
+    """
+    auditel = _auditel()
+    auditoria = auditel.validar_auditoria_tipo(auditoria_tipo)
+    if not auditoria:
+        raise ValueError(f"Tipo de auditoría inválido: {auditoria_tipo}")
+
+    entrada, salida = Path(entrada), Path(salida)
+    if not entrada.exists():
+        raise FileNotFoundError(entrada)
+
+    escritor = _crear_escritor(salida)
+    total = 0
+    try:
+        filas = _leer_filas_xlsx(entrada, sheet_name=hoja, start_row=max(fila_inicio - 1, 1))
+        if fila_inicio > 1:
+            filas = _separar_encabezado(filas, fila_inicio - 1, escritor)
+
+        for anotadas in _anotar_en_orden(_bloques(filas, tamano_bloque), auditoria, columnas, procesos):
+            for valores in anotadas:
+                escritor.escribir(valores)
+            total += len(anotadas)
+            if progreso:
+                progreso(total)
+    finally:
+        escritor.cerrar()
+    return total
+
+
+def _separar_encabezado(filas, fila_encabezado, escritor):
+    """Escribe la fila de encabezado (con las columnas de anotación) y genera el resto."""
+    for numero_fila, valores in filas:
+        if numero_fila == fila_encabezado:
+            escritor.escribir(valores + COLUMNAS_ANOTACION)
+            continue
+        if numero_fila > fila_encabezado:
+            yield numero_fila, valores
+
+
+def _reportar_progreso(inicio):
+    def reportar(total):
+        transcurrido = max(time.perf_counter() - inicio, 1e-9)
+        sys.stderr.write(f"\r  {total} filas anotadas ({total / transcurrido:.0f} filas/s)")
+        sys.stderr.flush()
+    return reportar
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m scripts.anotar_hallazgos",
+        description="Anota cada hallazgo de un XLSX con la normativa que mejor coincide.",
+    )
+    parser.add_argument("entrada", help="XLSX con las irregularidades observadas")
+    parser.add_argument("salida", help="Archivo de salida .csv o .xlsx")
+    parser.add_argument("--columnas", type=_parsear_columnas, default=[0],
+                        help="Columnas con el texto del hallazgo, p. ej. B o B,C (por defecto A)")
+    parser.add_argument("--hoja", default=None, help="Nombre de la hoja (por defecto la primera)")
+    parser.add_argument("--fila-inicio", type=int, default=2,
+                        help="Primera fila de datos; la anterior se toma como encabezado (por defecto 2)")
+    parser.add_argument("--auditoria", default="auto",
+                        help='"auto" (base unificada), "Obra Pública" o "Financiera"')
+    parser.add_argument("--procesos", type=int, default=os.cpu_count() or 1,
+                        help="Procesos en paralelo (por defecto, uno por núcleo)")
+    parser.add_argument("--tamano-bloque", type=int, default=TAMANO_BLOQUE,
+                        help=f"Filas por bloque enviado a cada proceso ({TAMANO_BLOQUE})")
+    args = parser.parse_args(argv)
+
+    inicio = time.perf_counter()
+    try:
+        total = anotar_libro(
+            args.entrada,
+            args.salida,
+            args.columnas,
+            args.auditoria,
+            hoja=args.hoja,
+            fila_inicio=args.fila_inicio,
+            procesos=max(args.procesos, 1),
+            tamano_bloque=max(args.tamano_bloque, 1),
+            progreso=_reportar_progreso(inicio),
+        )
+    except (ValueError, FileNotFoundError) as e:
+        parser.error(str(e))
+
+    sys.stderr.write(f"\n✅ {total} filas anotadas en {time.perf_counter() - inicio:.1f}s → {args.salida}\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,8 +5,11 @@ Autenticación por sesión basada en USER_CREDENTIALS env var.
 Formato: "usuario1:clave1,usuario2:clave2"
 """
 
+import logging
 import os
 import sys
+import threading
+import time
 from functools import wraps
 from pathlib import Path
 
@@ -18,6 +21,7 @@ if str(WORKSPACE_ROOT) not in sys.path:
 
 from werkzeug.security import check_password_hash, generate_password_hash
 
+import shared_user_catalog
 from shared_user_catalog import list_users
 
 PROJECT_KEY = "03-auditel"
@@ -27,11 +31,31 @@ USER_PRIORITY = {
     "gabo": 1,
 }
 
+logger = logging.getLogger("auditel.auth")
+
+# Archivo que lee shared_user_catalog: su mtime/tamaño invalida la caché de usuarios antes del TTL.
+# AUDITEL_USER_CATALOG manda; si no, la ruta que publique el módulo; si no, la ubicación habitual.
+USER_CATALOG_PATH = Path(
+    os.getenv("AUDITEL_USER_CATALOG")
+    or getattr(shared_user_catalog, "CATALOG_PATH", None)
+    or WORKSPACE_ROOT / "catalogos" / "catalogo_usuarios.json"
+)
+USER_CACHE_TTL = float(os.getenv("AUDITEL_USER_CACHE_TTL", "300"))
+
+_user_cache_lock = threading.Lock()
+_user_cache: dict = {"signature": None, "expires_at": 0.0, "users": None}
+_catalog_warning = {"logged": False}
+
 
 def _normalize(value: str) -> str:
     return str(value or "").strip().casefold()
 
 
+# Administradores: rol "admin" en el catálogo o usuarios listados en AUDITEL_ADMINS ("usuario1,usuario2")
+ADMIN_ROLE = "admin"
+ADMIN_USERNAMES = {_normalize(u) for u in os.getenv("AUDITEL_ADMINS", "").split(",") if u.strip()}
+
+
 def _load_env_users() -> dict[str, dict[str, str]]:
     users: dict[str, dict[str, str]] = {}
     for user in list_users(project_key=PROJECT_KEY):
@@ -46,13 +70,62 @@ def _load_env_users() -> dict[str, dict[str, str]]:
             "username": username,
             "password_hash": generate_password_hash(password),
             "display_name": display_name or username,
+            "role": _normalize(user.get("rol")),
         }
 
     return users
 
 
+def _catalog_signature():
+    """Firma (mtime, tamaño) del catálogo compartido; None si no es accesible."""
+    try:
+        stat = USER_CATALOG_PATH.stat()
+    except OSError:
+        if not _catalog_warning["logged"]:
+            _catalog_warning["logged"] = True
+            logger.warning(
+                "Catálogo de usuarios no encontrado en %s (AUDITEL_USER_CATALOG): "
+                "los cambios de usuarios se aplicarán al expirar AUDITEL_USER_CACHE_TTL",
+                USER_CATALOG_PATH,
+            )
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def invalidate_user_cache() -> None:
+    """Fuerza a recargar el catálogo (y rehashear claves) en la siguiente consulta."""
+    with _user_cache_lock:
+        _user_cache.update(signature=None, expires_at=0.0, users=None)
+
+
 def _build_user_map() -> dict[str, dict[str, str]]:
-    return _load_env_users()
+    """Mapa de usuarios con hashes calculados una sola vez por versión del catálogo.
+
+    Se recarga cuando cambia el mtime/tamaño del catálogo o expira el TTL.
+    """
+    signature = _catalog_signature()
+    users = _user_cache["users"]
+    if (
+        users is not None
+        and _user_cache["signature"] == signature
+        and time.monotonic() < _user_cache["expires_at"]
+    ):
+        return users
+
+    with _user_cache_lock:
+        users = _user_cache["users"]
+        if (
+            users is None
+            or _user_cache["signature"] != signature
+            or time.monotonic() >= _user_cache["expires_at"]
+        ):
+            users = _load_env_users()
+            _user_cache.update(
+                signature=signature,
+                expires_at=time.monotonic() + USER_CACHE_TTL,
+                users=users,
+            )
+        return users
 
 
 def get_users() -> dict[str, str]:
@@ -106,6 +179,16 @@ def is_authenticated() -> bool:
     return get_canonical_username(current_username or "") is not None
 
 
+def is_admin() -> bool:
+    """Verifica que la sesión activa sea de un usuario administrador."""
+    current_username = session.get("auth_user") or session.get("usuario")
+    normalized_username = _normalize(current_username)
+    user = _build_user_map().get(normalized_username)
+    if not user:
+        return False
+    return user["role"] == ADMIN_ROLE or normalized_username in ADMIN_USERNAMES
+
+
 def login_required(f):
     """Decorador que redirige al login si no hay sesión activa."""
 
@@ -0,0 +1,371 @@
+"""
+Auditel — Caché
+===============
+SistemaCache: caché LRU en memoria (por proceso) con TTL opcional por
+entrada. Usa un OrderedDict para que obtener/guardar sean O(1)
+(move_to_end y popitem en lugar de list.remove/pop(0)) y un lock para que
+sea seguro con workers gthread. Lleva contadores reales de aciertos,
+fallos, expulsiones y expiraciones.
+
+CacheCompartido: segundo nivel opcional en SQLite compartido por todos los
+workers del host.
+
+CacheRespuestasGeneradas: respuestas del proveedor de chat por consulta
+normalizada + registros recuperados + versión del índice, con búsqueda de
+casi-duplicados sobre el vector TF-IDF de la consulta.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger("auditel.cache")
+
+
+class SistemaCache:
+    def __init__(self, max_size=100, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expiraciones = 0
+
+    def _generar_clave(self, consulta, auditoria_tipo, version=None):
+        """Genera clave única para la consulta (y la versión del índice, si se indica)"""
+        contenido = f"{consulta}_{auditoria_tipo}"
+        if version is not None:
+            contenido = f"{contenido}_{version}"
+        return hashlib.md5(contenido.encode('utf-8')).hexdigest()
+
+    def obtener(self, consulta, auditoria_tipo, version=None):
+        return self.obtener_por_clave(self._generar_clave(consulta, auditoria_tipo, version))
+
+    def obtener_por_clave(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.misses += 1
+                return None
+
+            expira, resultado, _ = entrada
+            if expira is not None and time.monotonic() >= expira:
+                del self._entradas[clave]
+                self.expiraciones += 1
+                self.misses += 1
+                return None
+
+            # Mover al final (más reciente)
+            self._entradas.move_to_end(clave)
+            self.hits += 1
+            return resultado
+
+    def guardar(self, consulta, auditoria_tipo, resultado, ttl=None, version=None):
+        self.guardar_por_clave(self._generar_clave(consulta, auditoria_tipo, version), resultado, ttl=ttl, version=version)
+
+    def guardar_por_clave(self, clave, resultado, ttl=None, version=None):
+        ttl = self.ttl if ttl is None else ttl
+        expira = time.monotonic() + ttl if ttl else None
+
+        with self._lock:
+            self._entradas[clave] = (expira, resultado, version)
+            self._entradas.move_to_end(clave)
+
+            # Gestionar tamaño máximo expulsando la entrada menos reciente
+            while len(self._entradas) > self.max_size:
+                self._entradas.popitem(last=False)
+                self.evictions += 1
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def invalidar_version(self, version):
+        """Elimina sólo las entradas guardadas con esa versión del índice; devuelve cuántas."""
+        with self._lock:
+            claves = [clave for clave, (_, _, version_entrada) in self._entradas.items() if version_entrada == version]
+            for clave in claves:
+                del self._entradas[clave]
+            return len(claves)
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.hits + self.misses
+            return {
+                'tamaño_actual': len(self._entradas),
+                'tamaño_maximo': self.max_size,
+                'ttl_segundos': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expiraciones': self.expiraciones,
+                'tasa_aciertos': round(self.hits / consultas, 4) if consultas else 0.0,
+                'claves': list(self._entradas.keys())[:5]  # Primeras 5 claves como muestra
+            }
+
+
+class CacheCompartido:
+    """Segundo nivel de caché en SQLite (modo WAL) visible para todos los workers del host.
+
+    Guarda valores JSON bajo una clave ya calculada por quien llama y la
+    versión del índice con la que se generaron. Cada proceso/hilo abre su
+    propia conexión; cualquier error de SQLite degrada a un fallo de caché.
+    """
+
+    def __init__(self, ruta, ttl=None, max_entradas=10000):
+        self.ruta = Path(ruta)
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._escrituras = 0
+        self.hits = 0
+        self.misses = 0
+        self.errores = 0
+
+    def _conexion(self):
+        conexion = getattr(self._local, "conexion", None)
+        # Tras un fork la conexión heredada no es válida: se abre una nueva por proceso
+        if conexion is not None and getattr(self._local, "pid", None) == os.getpid():
+            return conexion
+
+        self.ruta.parent.mkdir(parents=True, exist_ok=True)
+        conexion = sqlite3.connect(self.ruta, timeout=2.0, isolation_level=None)
+        conexion.execute("PRAGMA journal_mode=WAL")
+        conexion.execute("PRAGMA synchronous=NORMAL")
+        conexion.execute(
+            "CREATE TABLE IF NOT EXISTS resultados ("
+            " clave TEXT PRIMARY KEY,"
+            " version TEXT NOT NULL,"
+            " valor TEXT NOT NULL,"
+            " creado REAL NOT NULL,"
+            " expira REAL)"
+        )
+        conexion.execute("CREATE INDEX IF NOT EXISTS idx_resultados_version ON resultados(version)")
+        conexion.execute("CREATE INDEX IF NOT EXISTS idx_resultados_creado ON resultados(creado)")
+        self._local.conexion = conexion
+        self._local.pid = os.getpid()
+        return conexion
+
+    def _registrar_error(self, operacion, error):
+        with self._lock:
+            self.errores += 1
+        logger.warning("Caché compartida no disponible (%s): %s", operacion, error)
+
+    def obtener(self, clave):
+        try:
+            fila = self._conexion().execute(
+                "SELECT valor, expira FROM resultados WHERE clave = ?",
+                (clave,),
+            ).fetchone()
+        except sqlite3.Error as e:
+            self._registrar_error("lectura", e)
+            return None
+
+        if fila is None or (fila[1] is not None and fila[1] <= time.time()):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return json.loads(fila[0])
+
+    def guardar(self, clave, valor, version, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        ahora = time.time()
+        try:
+            conexion = self._conexion()
+            conexion.execute(
+                "INSERT OR REPLACE INTO resultados (clave, version, valor, creado, expira) VALUES (?, ?, ?, ?, ?)",
+                (clave, version, json.dumps(valor, ensure_ascii=False), ahora, ahora + ttl if ttl else None),
+            )
+            with self._lock:
+                self._escrituras += 1
+                podar = self._escrituras % 100 == 0
+            if podar:
+                self._podar(conexion, ahora)
+        except sqlite3.Error as e:
+            self._registrar_error("escritura", e)
+
+    def _podar(self, conexion, ahora):
+        """Elimina expirados y, si hace falta, las entradas más antiguas sobre el límite."""
+        conexion.execute("DELETE FROM resultados WHERE expira IS NOT NULL AND expira <= ?", (ahora,))
+        conexion.execute(
+            "DELETE FROM resultados WHERE clave IN ("
+            " SELECT clave FROM resultados ORDER BY creado DESC LIMIT -1 OFFSET ?)",
+            (self.max_entradas,),
+        )
+
+    def limpiar(self):
+        try:
+            self._conexion().execute("DELETE FROM resultados")
+        except sqlite3.Error as e:
+            self._registrar_error("limpieza", e)
+
+    def invalidar_version(self, version):
+        """Elimina las entradas de una versión del índice (para todos los workers); devuelve cuántas."""
+        try:
+            return self._conexion().execute("DELETE FROM resultados WHERE version = ?", (version,)).rowcount
+        except sqlite3.Error as e:
+            self._registrar_error("invalidación", e)
+            return 0
+
+    def __len__(self):
+        try:
+            return self._conexion().execute("SELECT COUNT(*) FROM resultados").fetchone()[0]
+        except sqlite3.Error as e:
+            self._registrar_error("conteo", e)
+            return 0
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.hits + self.misses
+            return {
+                'ruta': str(self.ruta),
+                'tamaño_actual': len(self),
+                'tamaño_maximo': self.max_entradas,
+                'ttl_segundos': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'errores': self.errores,
+                'tasa_aciertos': round(self.hits / consultas, 4) if consultas else 0.0,
+            }
+
+
+class CacheRespuestasGeneradas:
+    """Caché de respuestas generadas agrupadas por el conjunto de registros recuperados.
+
+    Dos preguntas que recuperan los mismos registros (con la misma versión del
+    índice) producen el mismo contexto para el proveedor; si además sus
+    vectores TF-IDF tienen similitud coseno >= ``umbral_similitud``, la
+    respuesta ya generada se reutiliza. Las coincidencias exactas de la
+    consulta normalizada se resuelven en O(1).
+    """
+
+    def __init__(self, max_size=1000, ttl=None, umbral_similitud=0.9, max_por_grupo=32):
+        self.umbral_similitud = umbral_similitud
+        self.max_por_grupo = max_por_grupo
+        self._respuestas = SistemaCache(max_size=max_size, ttl=ttl)
+        # (registros, versión) -> {clave: (términos, pesos)} ; LRU de grupos acotado por max_size
+        self._grupos = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits_exactos = 0
+        self.hits_similares = 0
+        self.misses = 0
+
+    @staticmethod
+    def _clave(consulta, registros, version):
+        contenido = json.dumps([consulta, sorted(registros), version], ensure_ascii=False)
+        return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _grupo(registros, version):
+        return tuple(sorted(registros)), version
+
+    @staticmethod
+    def _similitud(vector_a, vector_b):
+        # Vectores TF-IDF normalizados (L2): el producto punto es el coseno
+        _, en_a, en_b = np.intersect1d(vector_a[0], vector_b[0], assume_unique=True, return_indices=True)
+        return float(np.dot(vector_a[1][en_a], vector_b[1][en_b]))
+
+    def obtener(self, consulta, registros, version, vector=None):
+        """Devuelve (respuesta, tipo) con tipo "exacta" o "similar"; (None, None) si no hay.
+
+        ``vector`` es la consulta como (índices de término ordenados, pesos).
+        """
+        clave = self._clave(consulta, registros, version)
+        respuesta = self._respuestas.obtener_por_clave(clave)
+        if respuesta is not None:
+            with self._lock:
+                self.hits_exactos += 1
+            return respuesta, "exacta"
+
+        if vector is not None and len(vector[0]):
+            grupo = self._grupo(registros, version)
+            with self._lock:
+                candidatos = list(self._grupos.get(grupo, {}).items())
+            mejor_clave, mejor_similitud = None, self.umbral_similitud
+            for clave_candidata, vector_candidato in candidatos:
+                similitud = self._similitud(vector, vector_candidato)
+                if similitud >= mejor_similitud:
+                    mejor_clave, mejor_similitud = clave_candidata, similitud
+            if mejor_clave is not None:
+                respuesta = self._respuestas.obtener_por_clave(mejor_clave)
+                if respuesta is not None:
+                    with self._lock:
+                        self.hits_similares += 1
+                    return respuesta, "similar"
+                self._descartar(grupo, mejor_clave)
+
+        with self._lock:
+            self.misses += 1
+        return None, None
+
+    def guardar(self, consulta, registros, version, respuesta, vector=None):
+        clave = self._clave(consulta, registros, version)
+        self._respuestas.guardar_por_clave(clave, respuesta, version=version)
+        if vector is None or not len(vector[0]):
+            return
+
+        grupo = self._grupo(registros, version)
+        with self._lock:
+            entradas = self._grupos.setdefault(grupo, OrderedDict())
+            self._grupos.move_to_end(grupo)
+            entradas[clave] = vector
+            entradas.move_to_end(clave)
+            while len(entradas) > self.max_por_grupo:
+                entradas.popitem(last=False)
+            while len(self._grupos) > self._respuestas.max_size:
+                self._grupos.popitem(last=False)
+
+    def _descartar(self, grupo, clave):
+        # La respuesta expiró o fue expulsada: su vector ya no sirve
+        with self._lock:
+            entradas = self._grupos.get(grupo)
+            if entradas is not None:
+                entradas.pop(clave, None)
+                if not entradas:
+                    del self._grupos[grupo]
+
+    def limpiar(self):
+        self._respuestas.limpiar()
+        with self._lock:
+            self._grupos.clear()
+
+    def invalidar_version(self, version):
+        with self._lock:
+            for grupo in [grupo for grupo in self._grupos if grupo[1] == version]:
+                del self._grupos[grupo]
+        return self._respuestas.invalidar_version(version)
+
+    def __len__(self):
+        return len(self._respuestas)
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.hits_exactos + self.hits_similares + self.misses
+            return {
+                'tamaño_actual': len(self._respuestas),
+                'grupos_de_registros': len(self._grupos),
+                'umbral_similitud': self.umbral_similitud,
+                'hits_exactos': self.hits_exactos,
+                'hits_similares': self.hits_similares,
+                'misses': self.misses,
+                'tasa_aciertos': (
+                    round((self.hits_exactos + self.hits_similares) / consultas, 4) if consultas else 0.0
+                ),
+            }
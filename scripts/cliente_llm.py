@@ -0,0 +1,332 @@
+"""
+Auditel — Cliente LLM asíncrono
+===============================
+Capa de acceso al proveedor de chat (Qwen u otro compatible con la API
+``/chat/completions`` de OpenAI) pensada para workers síncronos de gunicorn.
+
+- Un solo ``httpx.AsyncClient`` por proceso, con conexiones reutilizadas
+  (keep-alive) y un semáforo que limita las solicitudes concurrentes.
+- Cada llamada tiene un plazo total; los reintentos (errores de red, 429 y
+  5xx) usan backoff exponencial con jitter y nunca exceden ese plazo.
+- Un cortocircuito deja de llamar al proveedor tras varios fallos seguidos y
+  lo vuelve a probar después de un enfriamiento.
+- El bucle de eventos vive en un hilo en segundo plano; el worker sólo espera
+  el resultado hasta el plazo, nunca el timeout completo de gunicorn.
+
+``ServidorLLMSimulado`` levanta un proveedor local para tests y desarrollo:
+
+    python -m scripts.cliente_llm --puerto 8089
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+logger = logging.getLogger("auditel")
+
+_ESTADOS_REINTENTABLES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class ErrorLLM(Exception):
+    """Fallo al obtener una respuesta del proveedor."""
+
+    def __init__(self, mensaje, reintentable=True):
+        super().__init__(mensaje)
+        self.reintentable = reintentable
+
+
+class CircuitoAbierto(ErrorLLM):
+    """El cortocircuito está abierto: no se intenta llamar al proveedor."""
+
+
+class PlazoAgotado(ErrorLLM):
+    """Se agotó el plazo de la solicitud (incluidos los reintentos)."""
+
+
+class Cortocircuito:
+    """Cortocircuito simple: cerrado → abierto tras N fallos → semiabierto tras el enfriamiento."""
+
+    def __init__(self, umbral_fallos=5, enfriamiento=30.0):
+        self.umbral_fallos = umbral_fallos
+        self.enfriamiento = enfriamiento
+        self._fallos = 0
+        self._abierto_desde = None
+        self._prueba_en_curso = False
+        self._lock = threading.Lock()
+
+    @property
+    def estado(self):
+        with self._lock:
+            return self._estado()
+
+    def _estado(self):
+        if self._abierto_desde is None:
+            return "cerrado"
+        if time.monotonic() - self._abierto_desde >= self.enfriamiento:
+            return "semiabierto"
+        return "abierto"
+
+    def permitir(self):
+        """Indica si se puede intentar una llamada (en semiabierto, sólo una de prueba a la vez)."""
+        with self._lock:
+            estado = self._estado()
+            if estado == "cerrado":
+                return True
+            if estado == "semiabierto" and not self._prueba_en_curso:
+                self._prueba_en_curso = True
+                return True
+            return False
+
+    def registrar_exito(self):
+        with self._lock:
+            self._fallos = 0
+            self._abierto_desde = None
+            self._prueba_en_curso = False
+
+    def registrar_fallo(self):
+        with self._lock:
+            self._fallos += 1
+            if self._prueba_en_curso or self._fallos >= self.umbral_fallos:
+                self._abierto_desde = time.monotonic()
+            self._prueba_en_curso = False
+
+    def liberar_prueba(self):
+        """Libera la prueba semiabierta de una llamada cancelada o con error no reintentable sin contarla como fallo."""
+        with self._lock:
+            self._prueba_en_curso = False
+
+
+class _BucleEnSegundoPlano:
+    """Bucle asyncio en un hilo daemon, creado por proceso (seguro tras fork)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._loop = None
+
+    def obtener(self):
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._pid = os.getpid()
+                threading.Thread(
+                    target=self._loop.run_forever,
+                    name="auditel-llm-loop",
+                    daemon=True,
+                ).start()
+            return self._loop
+
+    def ejecutar(self, coro, timeout):
+        """Ejecuta ``coro`` en el bucle y espera como máximo ``timeout`` segundos."""
+        futuro = asyncio.run_coroutine_threadsafe(coro, self.obtener())
+        try:
+            return futuro.result(timeout)
+        except concurrent.futures.TimeoutError:
+            futuro.cancel()
+            raise PlazoAgotado(f"Sin respuesta del proveedor en {timeout:.1f}s") from None
+
+
+class ClienteLLM:
+    """Cliente del proveedor de chat con pool de conexiones, plazos, reintentos y cortocircuito."""
+
+    def __init__(self, base_url, api_key, modelo, plazo=25.0, max_concurrencia=4,
+                 reintentos=2, backoff_base=0.5, cortocircuito=None):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.modelo = modelo
+        self.plazo = plazo
+        self.max_concurrencia = max_concurrencia
+        self.reintentos = reintentos
+        self.backoff_base = backoff_base
+        self.cortocircuito = cortocircuito or Cortocircuito()
+        self._bucle = _BucleEnSegundoPlano()
+        # Cliente HTTP y semáforo pertenecen al bucle en que se crearon
+        self._cliente = None
+        self._semaforo = None
+        self._loop_recursos = None
+
+    def _recursos(self):
+        loop = asyncio.get_running_loop()
+        if self._cliente is None or self._loop_recursos is not loop:
+            self._cliente = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrencia,
+                    max_keepalive_connections=self.max_concurrencia,
+                ),
+            )
+            self._semaforo = asyncio.Semaphore(self.max_concurrencia)
+            self._loop_recursos = loop
+        return self._cliente, self._semaforo
+
+    def completar(self, mensajes, plazo=None):
+        """Versión síncrona: espera la respuesta en el hilo actual como máximo ``plazo`` segundos."""
+        plazo = self.plazo if plazo is None else plazo
+        # Pequeño margen para que el plazo interno (con su error más preciso) venza primero
+        return self._bucle.ejecutar(self.completar_async(mensajes, plazo), timeout=plazo + 1.0)
+
+    async def completar_async(self, mensajes, plazo=None):
+        """Devuelve el texto de la respuesta del proveedor para ``mensajes`` (formato chat)."""
+        plazo = self.plazo if plazo is None else plazo
+        loop = asyncio.get_running_loop()
+        limite = loop.time() + plazo
+        cliente, semaforo = self._recursos()
+        ultimo_error = None
+
+        for intento in range(self.reintentos + 1):
+            if not self.cortocircuito.permitir():
+                raise CircuitoAbierto("Proveedor de chat temporalmente deshabilitado")
+
+            restante = limite - loop.time()
+            if restante <= 0:
+                break
+
+            try:
+                texto = await asyncio.wait_for(
+                    self._solicitar(cliente, semaforo, mensajes, restante),
+                    timeout=restante,
+                )
+            except (httpx.TransportError, asyncio.TimeoutError, ErrorLLM) as e:
+                if isinstance(e, ErrorLLM) and not e.reintentable:
+                    # Error de la solicitud (400/401/404, JSON inválido): el proveedor responde, no abre el corte
+                    self.cortocircuito.liberar_prueba()
+                    raise
+                self.cortocircuito.registrar_fallo()
+                ultimo_error = e
+                logger.warning(f"⚠️ Proveedor de chat falló (intento {intento + 1}): {e!r}")
+            except BaseException:
+                # Cancelación (plazo del hilo que espera) u otro error: la prueba semiabierta no queda tomada
+                self.cortocircuito.liberar_prueba()
+                raise
+            else:
+                self.cortocircuito.registrar_exito()
+                return texto
+
+            # Backoff exponencial con jitter completo, sin pasarse del plazo
+            espera = random.uniform(0, self.backoff_base * (2 ** intento))
+            if loop.time() + espera >= limite:
+                break
+            await asyncio.sleep(espera)
+
+        raise PlazoAgotado(f"El proveedor de chat no respondió a tiempo: {ultimo_error!r}")
+
+    async def _solicitar(self, cliente, semaforo, mensajes, restante):
+        async with semaforo:
+            respuesta = await cliente.post(
+                "/chat/completions",
+                json={"model": self.modelo, "messages": mensajes},
+                timeout=restante,
+            )
+
+        if respuesta.status_code != 200:
+            raise ErrorLLM(
+                f"HTTP {respuesta.status_code}",
+                reintentable=respuesta.status_code in _ESTADOS_REINTENTABLES,
+            )
+
+        try:
+            return respuesta.json()["choices"][0]["message"]["content"]
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise ErrorLLM(f"Respuesta inválida del proveedor: {e!r}", reintentable=False) from e
+
+
+# =============================================================================
+# PROVEEDOR SIMULADO (tests y desarrollo local)
+# =============================================================================
+
+class ServidorLLMSimulado:
+    """Proveedor local compatible con ``/chat/completions`` para pruebas.
+
+    ``fallos`` es una lista de códigos HTTP que se devuelven, en orden, antes de
+    responder con éxito; ``latencia`` retrasa cada respuesta. La respuesta
+    repite el último mensaje del usuario, lo que permite verificar el contexto
+    enviado.
+    """
+
+    def __init__(self, puerto=0, latencia=0.0, fallos=None):
+        self.latencia = latencia
+        self.fallos = list(fallos or [])
+        self.solicitudes = []
+        servidor = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                cuerpo = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                servidor.solicitudes.append(cuerpo)
+                if servidor.latencia:
+                    time.sleep(servidor.latencia)
+
+                if self.path.rstrip("/").endswith("/chat/completions") and servidor.fallos:
+                    self._responder(servidor.fallos.pop(0), {"error": "simulado"})
+                elif self.path.rstrip("/").endswith("/chat/completions"):
+                    mensajes = cuerpo.get("messages") or [{}]
+                    self._responder(200, {
+                        "model": cuerpo.get("model"),
+                        "choices": [{"message": {
+                            "role": "assistant",
+                            "content": f"[simulado] {mensajes[-1].get('content', '')}",
+                        }}],
+                    })
+                else:
+                    self._responder(404, {"error": "no encontrado"})
+
+            def _responder(self, estado, datos):
+                contenido = json.dumps(datos, ensure_ascii=False).encode("utf-8")
+                self.send_response(estado)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(contenido)))
+                self.end_headers()
+                self.wfile.write(contenido)
+
+            def log_message(self, *args):
+                pass
+
+        self._http = ThreadingHTTPServer(("127.0.0.1", puerto), Manejador)
+        self._http.daemon_threads = True
+        self._hilo = None
+
+    @property
+    def url(self):
+        host, puerto = self._http.server_address[:2]
+        return f"http://{host}:{puerto}/v1"
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._http.serve_forever, daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        self._http.shutdown()
+        self._http.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.detener()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Proveedor de chat simulado para desarrollo local.")
+    parser.add_argument("--puerto", type=int, default=8089)
+    parser.add_argument("--latencia", type=float, default=0.0, help="Segundos de retraso por respuesta")
+    args = parser.parse_args()
+
+    simulado = ServidorLLMSimulado(puerto=args.puerto, latencia=args.latencia)
+    print(f"Proveedor simulado en {simulado.url} (QWEN_BASE_URL={simulado.url})")
+    try:
+        simulado._http.serve_forever()
+    except KeyboardInterrupt:
+        simulado.detener()
@@ -0,0 +1,125 @@
+"""
+Auditel — Historial de chat
+===========================
+Historial de conversaciones en SQLite (modo WAL) en lugar de la cookie de
+sesión firmada. La cookie sólo guarda el identificador de la conversación;
+los mensajes se leen por (conversación, usuario), así que un identificador
+ajeno no expone el historial de otro usuario.
+"""
+
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger("auditel.historial")
+
+
+def nuevo_id_conversacion():
+    return secrets.token_urlsafe(18)
+
+
+class HistorialChat:
+    """Mensajes por conversación y usuario, con el mismo recorte que tenía la sesión.
+
+    Al superar ``max_mensajes`` se conservan los 2 primeros mensajes y los más
+    recientes. Los mensajes con más de ``retencion`` segundos se eliminan
+    periódicamente. Cualquier error de SQLite degrada a un historial vacío.
+    """
+
+    def __init__(self, ruta, max_mensajes=50, retencion=None):
+        self.ruta = Path(ruta)
+        self.max_mensajes = max_mensajes
+        self.retencion = retencion
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._escrituras = 0
+        self.errores = 0
+
+    def _conexion(self):
+        conexion = getattr(self._local, "conexion", None)
+        # Tras un fork la conexión heredada no es válida: se abre una nueva por proceso
+        if conexion is not None and getattr(self._local, "pid", None) == os.getpid():
+            return conexion
+
+        self.ruta.parent.mkdir(parents=True, exist_ok=True)
+        conexion = sqlite3.connect(self.ruta, timeout=2.0, isolation_level=None)
+        conexion.execute("PRAGMA journal_mode=WAL")
+        conexion.execute("PRAGMA synchronous=NORMAL")
+        conexion.execute(
+            "CREATE TABLE IF NOT EXISTS mensajes ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " conversacion TEXT NOT NULL,"
+            " usuario TEXT NOT NULL,"
+            " datos TEXT NOT NULL,"
+            " creado REAL NOT NULL)"
+        )
+        conexion.execute("CREATE INDEX IF NOT EXISTS idx_mensajes_usuario ON mensajes(usuario, conversacion, id)")
+        conexion.execute("CREATE INDEX IF NOT EXISTS idx_mensajes_creado ON mensajes(creado)")
+        self._local.conexion = conexion
+        self._local.pid = os.getpid()
+        return conexion
+
+    def _registrar_error(self, operacion, error):
+        with self._lock:
+            self.errores += 1
+        logger.warning("Historial de chat no disponible (%s): %s", operacion, error)
+
+    def obtener(self, conversacion, usuario):
+        """Mensajes de la conversación en orden cronológico."""
+        try:
+            filas = self._conexion().execute(
+                "SELECT datos FROM mensajes WHERE usuario = ? AND conversacion = ? ORDER BY id",
+                (usuario, conversacion),
+            ).fetchall()
+        except sqlite3.Error as e:
+            self._registrar_error("lectura", e)
+            return []
+        return [json.loads(datos) for (datos,) in filas]
+
+    def agregar(self, conversacion, usuario, mensaje):
+        ahora = time.time()
+        try:
+            conexion = self._conexion()
+            conexion.execute(
+                "INSERT INTO mensajes (conversacion, usuario, datos, creado) VALUES (?, ?, ?, ?)",
+                (conversacion, usuario, json.dumps(mensaje, ensure_ascii=False), ahora),
+            )
+            self._recortar(conexion, conversacion, usuario)
+            with self._lock:
+                self._escrituras += 1
+                podar = self.retencion and self._escrituras % 100 == 0
+            if podar:
+                conexion.execute("DELETE FROM mensajes WHERE creado < ?", (ahora - self.retencion,))
+        except sqlite3.Error as e:
+            self._registrar_error("escritura", e)
+
+    def _recortar(self, conexion, conversacion, usuario):
+        """Conserva los 2 primeros mensajes y los (max_mensajes - 2) más recientes."""
+        conservar_inicio = min(2, self.max_mensajes)
+        conexion.execute(
+            "DELETE FROM mensajes WHERE usuario = ? AND conversacion = ? AND id IN ("
+            " SELECT id FROM mensajes WHERE usuario = ? AND conversacion = ?"
+            " ORDER BY id LIMIT ? OFFSET ?)"
+            " AND id NOT IN ("
+            " SELECT id FROM mensajes WHERE usuario = ? AND conversacion = ?"
+            " ORDER BY id DESC LIMIT ?)",
+            (
+                usuario, conversacion,
+                usuario, conversacion, -1, conservar_inicio,
+                usuario, conversacion, self.max_mensajes - conservar_inicio,
+            ),
+        )
+
+    def limpiar(self, conversacion, usuario):
+        try:
+            self._conexion().execute(
+                "DELETE FROM mensajes WHERE usuario = ? AND conversacion = ?",
+                (usuario, conversacion),
+            )
+        except sqlite3.Error as e:
+            self._registrar_error("limpieza", e)
@@ -0,0 +1,174 @@
+"""
+Auditel — Índice incremental
+============================
+Agregar unos cuantos registros no reajusta el vectorizador: los registros
+nuevos se vectorizan con el vocabulario e IDF del índice base y forman un
+segmento delta (como los segmentos de un LSM). Cada segmento tiene sus
+propios postings y se puntúa junto al base; los números de fila de los
+deltas continúan después de los del base, así que los ya asignados no
+cambian. Agregar cuesta O(registros nuevos), no O(corpus).
+
+Tolerancia documentada
+----------------------
+Mientras haya deltas, documentos y consultas usan el IDF del base. La
+frecuencia documental de cada término se sigue llevando (base + deltas)
+para medir cuánto se aleja ese IDF del que daría un reajuste completo:
+
+    deriva = max_t |idf_actual(t) - idf_base(t)| / idf_base(t)
+
+Cada peso TF-IDF está entonces dentro de un factor (1 ± deriva) del
+reajuste completo y, como documentos y consulta se normalizan (L2), la
+similitud coseno de las filas del base queda dentro de un factor
+((1 + deriva) / (1 - deriva))^2 de la que daría el reajuste (cota de peor
+caso). Los términos que no existían en el vocabulario base se ignoran hasta
+la compactación: las filas delta no se encuentran por ellos y su similitud
+por los demás términos puede quedar por encima de la del reajuste (su norma
+no incluye esos términos); por eso también se limita la fracción de tokens
+nuevos. Con 1 % de filas agregadas a un corpus sintético de 2 000 registros
+la similitud de cada resultado difiere < 3 % de la del reajuste y el top 5
+coincide en ≥ 4 de 5 (ver tests/test_app.py). Cuando la deriva, la fracción
+de filas en deltas, la fracción de tokens nuevos o el número de segmentos
+supera su límite, se compacta: se reconstruye el índice completo (nueva
+versión), como en un arranque con las fuentes actuales.
+
+Detección de agregados
+----------------------
+Para saber que las fuentes sólo agregaron registros al final se comparan
+las huellas por registro (hash de 64 bits, ver
+``indice_persistido.huella_registro``) que la tabla columnar calcula al
+construirse y persiste junto a los registros: la carga anterior ya las
+tiene y la comparación es un ``array_equal`` sobre el prefijo, sin
+decodificar vistas ``Registro``. Lo que sigue siendo O(corpus) es leer y
+convertir los XLSX (y calcular las huellas de la carga nueva en esa misma
+pasada): "O(registros nuevos)" se refiere al índice, no al parseo de las
+fuentes.
+"""
+
+import hashlib
+from collections.abc import Sequence
+
+import numpy as np
+
+
+def calcular_idf(documentos, frecuencias):
+    """IDF suavizado de scikit-learn (smooth_idf=True): ln((1 + n) / (1 + df)) + 1."""
+    return np.log((1 + documentos) / (1 + frecuencias)) + 1
+
+
+def frecuencias_documentales(postings):
+    """Documentos que contienen cada término, a partir de los postings (término × filas)."""
+    return np.diff(postings.indptr).astype(np.int64)
+
+
+class SegmentoDelta:
+    """Filas agregadas después del índice base, con sus postings locales."""
+
+    __slots__ = ("inicio", "postings", "codigos", "metadatos", "frecuencias", "huella", "tokens", "tokens_nuevos")
+
+    def __init__(self, inicio, matriz, codigos, metadatos, documentos, tokens=0, tokens_nuevos=0):
+        self.inicio = inicio
+        self.postings = matriz.T.tocsr()
+        self.codigos = codigos
+        self.metadatos = metadatos
+        self.frecuencias = frecuencias_documentales(self.postings)
+        # Identifica el contenido del segmento: workers con los mismos agregados llegan a la misma versión
+        resumen = hashlib.sha256()
+        for metadato, documento in zip(metadatos, documentos):
+            resumen.update(f"{metadato['auditoria']}\x1f{documento}\x1e".encode("utf-8"))
+        self.huella = resumen.hexdigest()[:16]
+        self.tokens = tokens
+        self.tokens_nuevos = tokens_nuevos
+
+    def __len__(self):
+        return len(self.codigos)
+
+    def candidatos(self, filas, similitudes, umbral, codigo=None):
+        """(filas globales, similitudes) de los puntajes de una consulta sobre este segmento."""
+        filas = filas.astype(np.int64, copy=False)
+        mascara = similitudes > umbral
+        if codigo is not None:
+            mascara &= self.codigos[filas] == codigo
+        return filas[mascara] + self.inicio, similitudes[mascara]
+
+
+class MetadatosSegmentados(Sequence):
+    """Metadatos del base (TablaMetadatos) seguidos de los de cada segmento delta."""
+
+    def __init__(self, base, segmentos):
+        self.base = base
+        self.segmentos = segmentos
+        self.auditorias = base.auditorias
+        self._total = len(base) + sum(len(segmento) for segmento in segmentos)
+
+    def __len__(self):
+        return self._total
+
+    def __getitem__(self, fila):
+        if isinstance(fila, slice):
+            return [self[i] for i in range(*fila.indices(len(self)))]
+        if fila < 0:
+            fila += len(self)
+        if fila < len(self.base):
+            return self.base[fila]
+        for segmento in self.segmentos:
+            if fila < segmento.inicio + len(segmento):
+                return segmento.metadatos[fila - segmento.inicio]
+        raise IndexError("fila fuera de rango")
+
+
+class SecuenciaConcatenada(Sequence):
+    """Registros de una auditoría: los originales seguidos de los agregados, sin copiarlos."""
+
+    def __init__(self, base, agregados):
+        self.base = base
+        self.agregados = list(agregados)
+
+    def __len__(self):
+        return len(self.base) + len(self.agregados)
+
+    def __getitem__(self, posicion):
+        if isinstance(posicion, slice):
+            return [self[i] for i in range(*posicion.indices(len(self)))]
+        if posicion < 0:
+            posicion += len(self)
+        if posicion < len(self.base):
+            return self.base[posicion]
+        return self.agregados[posicion - len(self.base)]
+
+
+def registros_agregados(anteriores, actuales):
+    """{auditoría: registros nuevos} si ``actuales`` sólo agrega registros al final de cada auditoría.
+
+    Devuelve None si se modificó, eliminó o reordenó algún registro existente
+    (o cambió el conjunto de auditorías): eso requiere reconstruir el índice.
+    Si ambas secuencias traen ``huellas`` (VistaRegistros) se comparan las
+    huellas del prefijo; si no, los registros campo por campo.
+    """
+    if list(anteriores) != list(actuales):
+        return None
+
+    nuevos = {}
+    for auditoria, registros in anteriores.items():
+        registros_actuales = actuales[auditoria]
+        if len(registros_actuales) < len(registros):
+            return None
+        huellas = getattr(registros, "huellas", None)
+        huellas_actuales = getattr(registros_actuales, "huellas", None)
+        if huellas is not None and huellas_actuales is not None:
+            if not np.array_equal(huellas, huellas_actuales[:len(registros)]):
+                return None
+        elif any(registros[i] != registros_actuales[i] for i in range(len(registros))):
+            return None
+        agregados = registros_actuales[len(registros):]
+        if len(agregados):
+            nuevos[auditoria] = list(agregados)
+    return nuevos
+
+
+def deriva_idf(idf_base, documentos_base, frecuencias_base, segmentos):
+    """Máxima diferencia relativa entre el IDF base y el que resultaría de reajustar con los deltas."""
+    if not segmentos:
+        return 0.0
+    documentos = documentos_base + sum(len(segmento) for segmento in segmentos)
+    frecuencias = frecuencias_base + sum(segmento.frecuencias for segmento in segmentos)
+    return float(np.max(np.abs(calcular_idf(documentos, frecuencias) - idf_base) / idf_base))
@@ -0,0 +1,150 @@
+"""
+Auditel — Índice invertido
+==========================
+Motor de puntuación alternativo para MotorBusquedaNormativasMejorado.
+
+Trabaja sobre la matriz TF-IDF en formato CSC (una lista de postings por
+término, es decir la transpuesta en CSR que ya mantiene el motor) y puntúa
+término a término, en un acumulador denso por documento, sólo los documentos
+que contienen términos de la consulta. Aplica poda max-score: cuando la cota
+de los términos restantes ya no alcanza al k-ésimo candidato, deja de admitir
+documentos nuevos y los postings restantes sólo se consultan en las filas de
+los candidatos vivos.
+"""
+
+import numpy as np
+
+# Margen para que el redondeo de las cotas nunca descarte un candidato válido
+_HOLGURA = 1e-9
+
+
+class IndiceInvertido:
+    """Listas de postings por término con cotas máximas para poda max-score."""
+
+    def __init__(self, postings_por_termino):
+        # Se reutilizan los arreglos (posiblemente mapeados en memoria) sin copiarlos
+        postings = postings_por_termino.tocsr()
+        if not postings.has_sorted_indices:
+            postings = postings.sorted_indices()
+
+        self.num_documentos = postings.shape[1]
+        self.punteros = postings.indptr
+        self.filas = postings.indices
+        self.pesos = postings.data
+
+        # Peso máximo de cada término en cualquier documento (cota superior por término)
+        self.peso_maximo = np.zeros(postings.shape[0], dtype=np.float64)
+        longitudes = np.diff(self.punteros)
+        con_postings = np.flatnonzero(longitudes)
+        if len(con_postings):
+            self.peso_maximo[con_postings] = np.maximum.reduceat(
+                self.pesos, self.punteros[con_postings]
+            )
+
+    def _postings(self, termino):
+        inicio, fin = self.punteros[termino], self.punteros[termino + 1]
+        return self.filas[inicio:fin], self.pesos[inicio:fin]
+
+    @staticmethod
+    def _pesos_en_candidatos(candidatos, filas_termino, pesos_termino):
+        """Peso del término en cada candidato (0 si no está en el posting), por búsqueda binaria."""
+        pesos = np.zeros(len(candidatos), dtype=np.float64)
+        if not len(candidatos) or not len(filas_termino):
+            return pesos
+        posiciones = np.searchsorted(filas_termino, candidatos)
+        posiciones = np.minimum(posiciones, len(filas_termino) - 1)
+        presentes = filas_termino[posiciones] == candidatos
+        pesos[presentes] = pesos_termino[posiciones[presentes]]
+        return pesos
+
+    def buscar(self, consulta_tfidf, top_n, umbral=0.0, filas_permitidas=None):
+        """Devuelve (filas, similitudes) de los candidatos que pueden entrar al top_n.
+
+        Los términos se recorren de mayor a menor cota acumulando en un búfer
+        denso indexado por documento. Mientras un documento no visto todavía
+        pueda superar al k-ésimo candidato se admiten documentos nuevos; después
+        los postings restantes sólo se consultan (búsqueda binaria) en las filas
+        de los candidatos vivos, que se podan con la cota de los términos que
+        faltan. Los puntajes devueltos se recalculan sólo para los finalistas en
+        el orden de términos del producto disperso, así que coinciden
+        exactamente con la búsqueda matricial. El orden final lo decide quien
+        llama.
+        """
+        vacio = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+        consulta = consulta_tfidf.tocsr()
+        terminos = consulta.indices
+        pesos_consulta = consulta.data
+        if top_n <= 0 or not len(terminos):
+            return vacio
+
+        cotas = pesos_consulta * self.peso_maximo[terminos]
+        orden = np.argsort(-cotas, kind="stable")
+        cota_restante = float(cotas.sum())
+
+        # Búfer denso por documento (np.zeros sólo materializa las páginas que se tocan)
+        puntajes = np.zeros(self.num_documentos, dtype=np.float64)
+        vivo = np.zeros(self.num_documentos, dtype=bool)
+        candidatos = np.empty(0, dtype=np.int64)
+        admitiendo = True
+
+        for posicion in orden:
+            peso_consulta = pesos_consulta[posicion]
+            cota_restante -= cotas[posicion]
+            filas_termino, pesos_termino = self._postings(terminos[posicion])
+
+            if admitiendo:
+                # Fase de admisión: cualquier documento del posting puede ser candidato
+                if filas_permitidas is not None:
+                    mascara = filas_permitidas[filas_termino]
+                    filas_termino, pesos_termino = filas_termino[mascara], pesos_termino[mascara]
+                # Las filas de un posting no se repiten: la suma indexada es exacta
+                puntajes[filas_termino] += peso_consulta * pesos_termino
+                nuevas = filas_termino[~vivo[filas_termino]]
+                vivo[nuevas] = True
+                candidatos = np.concatenate((candidatos, nuevas.astype(np.int64, copy=False)))
+
+                # Un documento aún no visto puntúa como máximo cota_restante
+                if cota_restante + _HOLGURA > umbral:
+                    if len(candidatos) < top_n:
+                        continue
+                    parciales = puntajes[candidatos]
+                    corte = np.partition(parciales, len(parciales) - top_n)[len(parciales) - top_n]
+                    if cota_restante + _HOLGURA >= corte:
+                        continue
+                admitiendo = False
+            elif len(candidatos):
+                # Fase de continuación: el posting sólo se consulta en las filas de los candidatos vivos
+                if len(candidatos) < len(filas_termino):
+                    pesos_candidatos = self._pesos_en_candidatos(candidatos, filas_termino, pesos_termino)
+                    puntajes[candidatos] += peso_consulta * pesos_candidatos
+                else:
+                    mascara = vivo[filas_termino]
+                    puntajes[filas_termino[mascara]] += peso_consulta * pesos_termino[mascara]
+            else:
+                break
+
+            if len(candidatos) > top_n:
+                parciales = puntajes[candidatos]
+                corte = np.partition(parciales, len(parciales) - top_n)[len(parciales) - top_n]
+                cota = parciales + cota_restante + _HOLGURA
+                descartados = (cota < corte) | (cota <= umbral)
+                vivo[candidatos[descartados]] = False
+                candidatos = candidatos[~descartados]
+
+        if not len(candidatos):
+            return vacio
+
+        # Finalistas: el top_n por puntaje acumulado (con margen para empates de redondeo)
+        if len(candidatos) > top_n:
+            parciales = puntajes[candidatos]
+            corte = np.partition(parciales, len(parciales) - top_n)[len(parciales) - top_n]
+            candidatos = candidatos[parciales >= corte - _HOLGURA]
+
+        # Puntaje final exacto en el orden original de términos de la consulta
+        similitudes = np.zeros(len(candidatos), dtype=np.float64)
+        for termino, peso_consulta in zip(terminos, pesos_consulta):
+            filas_termino, pesos_termino = self._postings(termino)
+            similitudes += peso_consulta * self._pesos_en_candidatos(candidatos, filas_termino, pesos_termino)
+
+        seleccion = similitudes > umbral
+        return candidatos[seleccion], similitudes[seleccion]
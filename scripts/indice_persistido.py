@@ -0,0 +1,707 @@
+"""
+Auditel — Índice persistido
+===========================
+Artefactos en disco para que cada worker cargue el corpus y el índice TF-IDF
+en milisegundos en lugar de leer los XLSX y reajustar el vectorizador.
+
+Estructura (por defecto en ``indice/``, configurable con AUDITEL_INDICE_DIR):
+
+    registros-<huella>-f<formato>/campos.json, esquemas.json   nombres de campo y orden de campos por registro
+    registros-<huella>-f<formato>/celdas.npy           filas × campos: índice del valor en la tabla de cadenas
+    registros-<huella>-f<formato>/esquema_por_fila.npy esquema (campos presentes) de cada registro
+    registros-<huella>-f<formato>/cadenas.npy, cadenas_desplazamientos.npy
+                                            valores distintos (UTF-8) y su inicio en el blob
+    registros-<huella>-f<formato>/auditorias.json      rango de filas de cada auditoría
+    registros-<huella>-f<formato>/huellas.npy          hash de 64 bits del contenido de cada registro
+    <version>/metadatos.json                formato, huella, parámetros y conteos
+    <version>/vocabulario.json              término -> columna
+    <version>/terminos_podados.json         términos descartados por max_df/min_df/max_features
+    <version>/idf.npy                       pesos IDF
+    <version>/matriz_{data,indices,indptr}.npy     matriz TF-IDF (CSR)
+    <version>/postings_{data,indices,indptr}.npy   postings por término (CSR de la transpuesta)
+    <version>/normalizados/                 textos normalizados (ids en una tabla de cadenas)
+                                            y tokens por fila (CSR de ids de token)
+
+La huella es un hash del contenido de las fuentes; la versión combina la
+huella con los parámetros del vectorizador. Las escrituras son atómicas
+(directorio temporal + rename), así que varios workers pueden intentar
+construir el mismo artefacto sin corromperlo.
+
+Los arreglos se abren con ``mmap_mode="r"``: todos los workers mapean los
+mismos archivos de sólo lectura y comparten las páginas del page cache, así
+que la memoria residente por worker no crece con el tamaño del índice.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger("auditel.indice")
+
+FORMATO_INDICE = 5
+FORMATO_REGISTROS = 4
+VERSIONES_CONSERVADAS = 3
+
+_BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def persistencia_habilitada() -> bool:
+    return (os.getenv("AUDITEL_INDICE_PERSISTIDO") or "1").strip().lower() not in ("0", "false", "no")
+
+
+def directorio_indices() -> Path:
+    return Path(os.getenv("AUDITEL_INDICE_DIR") or _BASE_DIR / "indice")
+
+
+def calcular_version(huella: str, parametros: dict) -> str:
+    """Identificador del índice: huella de fuentes + parámetros + formato."""
+    contenido = json.dumps(
+        {"formato": FORMATO_INDICE, "huella": huella, "parametros": parametros},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()[:16]
+
+
+def _directorio_registros(huella: str) -> Path:
+    return directorio_indices() / f"registros-{huella}-f{FORMATO_REGISTROS}"
+
+
+def _podar_antiguos(es_candidato) -> None:
+    """Conserva sólo los artefactos más recientes del tipo indicado."""
+    candidatos = sorted(
+        (
+            path for path in directorio_indices().iterdir()
+            if not path.name.startswith(".") and es_candidato(path)
+        ),
+        key=lambda path: path.stat().st_mtime,
+        reverse=True,
+    )
+    for path in candidatos[VERSIONES_CONSERVADAS:]:
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+
+
+def _publicar_directorio(destino: Path, escribir) -> bool:
+    """Escribe en un directorio temporal y lo publica con rename atómico."""
+    raiz = destino.parent
+    raiz.mkdir(parents=True, exist_ok=True)
+    temporal = Path(tempfile.mkdtemp(dir=raiz, prefix=f".{destino.name}."))
+    try:
+        escribir(temporal)
+        os.rename(temporal, destino)
+    except OSError:
+        shutil.rmtree(temporal, ignore_errors=True)
+        if not destino.exists():
+            raise
+        # Otro worker publicó el mismo artefacto primero
+        return False
+    except BaseException:
+        shutil.rmtree(temporal, ignore_errors=True)
+        raise
+    return True
+
+
+def _guardar_json(path: Path, contenido, **opciones) -> None:
+    with path.open("w", encoding="utf-8") as archivo:
+        json.dump(contenido, archivo, ensure_ascii=False, **opciones)
+
+
+def _leer_json(path: Path):
+    with path.open(encoding="utf-8") as archivo:
+        return json.load(archivo)
+
+
+def _mapear(path: Path):
+    # ndarray sobre el mapeo (no np.memmap): cortar una subclase cuesta varias veces más por acceso
+    return np.asarray(np.load(path, mmap_mode="r"))
+
+
+def _guardar_csr(directorio: Path, prefijo: str, matriz) -> None:
+    matriz = matriz.tocsr()
+    matriz.sort_indices()
+    np.save(directorio / f"{prefijo}_data.npy", matriz.data)
+    np.save(directorio / f"{prefijo}_indices.npy", matriz.indices)
+    np.save(directorio / f"{prefijo}_indptr.npy", matriz.indptr)
+
+
+def _mapear_csr(directorio: Path, prefijo: str, forma):
+    matriz = sparse.csr_matrix(
+        (
+            _mapear(directorio / f"{prefijo}_data.npy"),
+            _mapear(directorio / f"{prefijo}_indices.npy"),
+            _mapear(directorio / f"{prefijo}_indptr.npy"),
+        ),
+        shape=tuple(forma),
+        copy=False,
+    )
+    matriz.has_sorted_indices = True
+    return matriz
+
+
+# =============================================================================
+# REGISTROS (AUDITORIA_DATA) MAPEADOS EN MEMORIA
+# =============================================================================
+
+def huella_registro(registro) -> int:
+    """Hash de 64 bits del contenido de un registro (independiente del orden de sus campos)."""
+    resumen = hashlib.blake2b(digest_size=8)
+    for campo in sorted(registro):
+        valor = registro[campo]
+        texto = valor if isinstance(valor, str) else json.dumps(valor, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+        resumen.update(f"{campo}\x1f{texto}\x1e".encode("utf-8"))
+    return int.from_bytes(resumen.digest(), "little")
+
+
+class TablaColumnar:
+    """Registros (dicts de cadenas) guardados por columnas en arreglos.
+
+    Los nombres de campo se guardan una vez (internados); cada valor distinto
+    una vez en una tabla de cadenas UTF-8 con desplazamientos enteros. Cada
+    celda (fila × campo, int32) apunta a su valor: ``i >= 0`` es la cadena
+    ``i`` y ``i < 0`` la cadena ``-i - 1`` con el valor en JSON (listas,
+    números). Los campos presentes y su orden por registro se comparten en
+    ``esquemas``. ``registro(fila)`` devuelve una vista ``Registro`` que
+    decodifica sólo los campos que se leen. ``huellas`` guarda un hash de
+    64 bits del contenido de cada fila (ver ``huella_registro``) para saber
+    qué registros cambiaron entre dos cargas sin decodificarlos.
+    """
+
+    __slots__ = ("campos", "indice_campo", "esquemas", "_presentes", "esquema_por_fila", "celdas", "_cadenas", "_desplazamientos", "huellas")
+
+    def __init__(self, campos, esquemas, esquema_por_fila, celdas, cadenas, desplazamientos, huellas):
+        self.campos = [sys.intern(campo) for campo in campos]
+        self.indice_campo = {campo: indice for indice, campo in enumerate(self.campos)}
+        self.esquemas = [tuple(esquema) for esquema in esquemas]
+        self._presentes = [frozenset(esquema) for esquema in self.esquemas]
+        self.esquema_por_fila = esquema_por_fila
+        self.celdas = celdas
+        self._cadenas = cadenas
+        self._desplazamientos = desplazamientos
+        self.huellas = huellas
+
+    @classmethod
+    def desde_registros(cls, filas):
+        """Construye la tabla (arreglos en memoria) a partir de una secuencia de dicts."""
+        campos = {}
+        esquemas = {}
+        cadenas = {}
+        esquema_por_fila = np.zeros(len(filas), dtype=np.int32)
+        huellas = np.zeros(len(filas), dtype=np.uint64)
+        celdas_por_fila = []
+        for posicion, fila in enumerate(filas):
+            esquema = tuple(campos.setdefault(campo, len(campos)) for campo in fila)
+            esquema_por_fila[posicion] = esquemas.setdefault(esquema, len(esquemas))
+            celdas_fila = []
+            for campo, valor in zip(esquema, fila.values()):
+                if isinstance(valor, str):
+                    codigo = cadenas.setdefault(valor, len(cadenas))
+                else:
+                    texto = json.dumps(valor, ensure_ascii=False, separators=(",", ":"))
+                    codigo = -cadenas.setdefault(texto, len(cadenas)) - 1
+                celdas_fila.append((campo, codigo))
+            celdas_por_fila.append(celdas_fila)
+            huellas[posicion] = huella_registro(fila)
+
+        celdas = np.zeros((len(filas), len(campos)), dtype=np.int32)
+        for posicion, celdas_fila in enumerate(celdas_por_fila):
+            for campo, codigo in celdas_fila:
+                celdas[posicion, campo] = codigo
+
+        codificadas = [cadena.encode("utf-8") for cadena in cadenas]
+        desplazamientos = np.zeros(len(codificadas) + 1, dtype=np.int64)
+        np.cumsum([len(contenido) for contenido in codificadas], out=desplazamientos[1:])
+        return cls(
+            list(campos),
+            list(esquemas),
+            esquema_por_fila,
+            celdas,
+            np.frombuffer(b"".join(codificadas), dtype=np.uint8),
+            desplazamientos,
+            huellas,
+        )
+
+    def guardar(self, directorio: Path) -> None:
+        _guardar_json(directorio / "campos.json", self.campos)
+        _guardar_json(directorio / "esquemas.json", [list(esquema) for esquema in self.esquemas])
+        np.save(directorio / "esquema_por_fila.npy", self.esquema_por_fila)
+        np.save(directorio / "celdas.npy", self.celdas)
+        np.save(directorio / "cadenas.npy", self._cadenas)
+        np.save(directorio / "cadenas_desplazamientos.npy", self._desplazamientos)
+        np.save(directorio / "huellas.npy", self.huellas)
+
+    @classmethod
+    def mapear(cls, directorio: Path):
+        return cls(
+            _leer_json(directorio / "campos.json"),
+            _leer_json(directorio / "esquemas.json"),
+            _mapear(directorio / "esquema_por_fila.npy"),
+            _mapear(directorio / "celdas.npy"),
+            _mapear(directorio / "cadenas.npy"),
+            _mapear(directorio / "cadenas_desplazamientos.npy"),
+            _mapear(directorio / "huellas.npy"),
+        )
+
+    def __len__(self):
+        return len(self.esquema_por_fila)
+
+    def esquema(self, fila):
+        return int(self.esquema_por_fila[fila])
+
+    def valor(self, fila, campo):
+        codigo = int(self.celdas[fila, campo])
+        indice = codigo if codigo >= 0 else -codigo - 1
+        inicio = int(self._desplazamientos[indice])
+        fin = int(self._desplazamientos[indice + 1])
+        texto = self._cadenas[inicio:fin].tobytes().decode("utf-8")
+        return texto if codigo >= 0 else json.loads(texto)
+
+    def registro(self, fila):
+        return Registro(self, fila)
+
+    __getitem__ = registro
+
+
+class Registro(Mapping):
+    """Vista de sólo lectura de una fila de TablaColumnar con la interfaz de un dict."""
+
+    __slots__ = ("_tabla", "_fila")
+
+    def __init__(self, tabla, fila):
+        self._tabla = tabla
+        self._fila = fila
+
+    def __getitem__(self, campo):
+        tabla = self._tabla
+        indice = tabla.indice_campo.get(campo)
+        if indice is None or indice not in tabla._presentes[tabla.esquema(self._fila)]:
+            raise KeyError(campo)
+        return tabla.valor(self._fila, indice)
+
+    def __iter__(self):
+        tabla = self._tabla
+        return (tabla.campos[indice] for indice in tabla.esquemas[tabla.esquema(self._fila)])
+
+    def __len__(self):
+        return len(self._tabla.esquemas[self._tabla.esquema(self._fila)])
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class VistaRegistros(Sequence):
+    """Rango contiguo de una TablaColumnar que se comporta como una lista de dicts."""
+
+    __slots__ = ("_tabla", "_inicio", "_fin")
+
+    def __init__(self, tabla, inicio, fin):
+        self._tabla = tabla
+        self._inicio = inicio
+        self._fin = fin
+
+    def __len__(self):
+        return self._fin - self._inicio
+
+    @property
+    def huellas(self):
+        """Huella de contenido de cada registro del rango (arreglo uint64)."""
+        return self._tabla.huellas[self._inicio:self._fin]
+
+    def __getitem__(self, posicion):
+        if isinstance(posicion, slice):
+            return [self[i] for i in range(*posicion.indices(len(self)))]
+        if posicion < 0:
+            posicion += len(self)
+        if not 0 <= posicion < len(self):
+            raise IndexError("registro fuera de rango")
+        return self._tabla.registro(self._inicio + posicion)
+
+
+class TablaMetadatos(Sequence):
+    """Metadatos del corpus unificado guardados como arreglos compactos.
+
+    En lugar de un dict por fila sólo guarda el código de auditoría y la
+    posición del registro dentro de su base; la vista ``Metadato`` se arma
+    al acceder.
+    ``normalizados`` (opcional) es una secuencia paralela por fila con los
+    textos normalizados y tokens precalculados del registro.
+    """
+
+    def __init__(self, bases, normalizados=None):
+        self.auditorias = list(bases)
+        self.normalizados = normalizados
+        self._bases = [bases[auditoria] for auditoria in self.auditorias]
+        longitudes = [len(datos) for datos in self._bases]
+        self.codigos = np.repeat(np.arange(len(longitudes), dtype=np.uint8), longitudes)
+        self.posiciones = (
+            np.concatenate([np.arange(longitud, dtype=np.int64) for longitud in longitudes])
+            if longitudes else np.empty(0, dtype=np.int64)
+        )
+
+    def __len__(self):
+        return len(self.codigos)
+
+    def auditoria(self, fila):
+        return self.auditorias[int(self.codigos[fila])]
+
+    def __getitem__(self, fila):
+        if isinstance(fila, slice):
+            return [self[i] for i in range(*fila.indices(len(self)))]
+        if fila < 0:
+            fila += len(self)
+        codigo = int(self.codigos[fila])
+        return Metadato(
+            fila,
+            self.auditorias[codigo],
+            self._bases[codigo][int(self.posiciones[fila])],
+            self.normalizados[fila] if self.normalizados is not None else None,
+        )
+
+
+class Metadato:
+    """Fila del corpus unificado: número de fila, auditoría, registro y textos normalizados.
+
+    Referencia el registro sin copiar sus campos; admite ``metadato['item']``.
+    """
+
+    __slots__ = ("indice", "auditoria", "item", "normalizado")
+
+    def __init__(self, indice, auditoria, item, normalizado=None):
+        self.indice = indice
+        self.auditoria = auditoria
+        self.item = item
+        self.normalizado = normalizado
+
+    def __getitem__(self, clave):
+        if clave not in self.__slots__:
+            raise KeyError(clave)
+        return getattr(self, clave)
+
+
+class TablaNormalizados:
+    """Textos normalizados y tokens precalculados por fila, en arreglos.
+
+    Cada texto distinto (campos, nombres y textos de normativas) se guarda una
+    vez en una tabla de cadenas UTF-8 con desplazamientos; ``textos`` (filas ×
+    campos, int32) apunta a ella y las normativas de cada fila son un CSR de
+    pares (nombre, texto). Los tokens se guardan como ids (CSR por fila ×
+    campo) de un vocabulario de tokens.
+
+    Al cargar sólo se lee el vocabulario de tokens (crece con las palabras
+    distintas, no con las filas); tabla de cadenas, textos, tokens y
+    normativas siguen mapeados. Los dicts y ``frozenset`` de una fila se arman
+    al leerla (sólo los candidatos que se re-rankean) y se conservan en un LRU
+    pequeño por proceso. ``normalizado(fila)`` devuelve una vista
+    ``Normalizado``.
+    """
+
+    CAMPOS = ("tipo_irregularidad", "concepto", "descripcion")
+    FILAS_EN_CACHE = 4096
+
+    __slots__ = (
+        "tokens", "cadenas", "desplazamientos", "textos", "tokens_indptr", "tokens_ids", "normativas_indptr",
+        "normativas", "_cadenas", "_desplazamientos", "_textos", "_tokens_indptr", "_normativas_indptr", "_filas", "_lock",
+    )
+
+    def __init__(self, tokens, cadenas, desplazamientos, textos, tokens_indptr, tokens_ids, normativas_indptr, normativas):
+        self.tokens = [sys.intern(token) for token in tokens]
+        self.cadenas = cadenas
+        self.desplazamientos = desplazamientos
+        self.textos = textos
+        self.tokens_indptr = tokens_indptr
+        self.tokens_ids = tokens_ids
+        self.normativas_indptr = normativas_indptr
+        self.normativas = normativas
+        # memoryview: el corte devuelve enteros (o bytes) de Python sin crear un arreglo NumPy por acceso
+        self._cadenas = memoryview(np.ascontiguousarray(cadenas))
+        self._desplazamientos = memoryview(np.ascontiguousarray(desplazamientos))
+        self._textos = memoryview(np.ascontiguousarray(textos).reshape(-1))
+        self._tokens_indptr = memoryview(np.ascontiguousarray(tokens_indptr))
+        self._normativas_indptr = memoryview(np.ascontiguousarray(normativas_indptr))
+        self._filas = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def desde_filas(cls, filas):
+        """Construye la tabla a partir de los dicts de ``precalcular_textos_normalizados``."""
+        tokens = {}
+        cadenas = {}
+        textos = np.zeros((len(filas), len(cls.CAMPOS)), dtype=np.int32)
+        tokens_indptr = [0]
+        tokens_ids = []
+        normativas_indptr = [0]
+        normativas = []
+        for posicion, fila in enumerate(filas):
+            for columna, campo in enumerate(cls.CAMPOS):
+                textos[posicion, columna] = cadenas.setdefault(fila["textos"][campo], len(cadenas))
+                tokens_ids.extend(sorted(tokens.setdefault(token, len(tokens)) for token in set(fila["tokens"][campo])))
+                tokens_indptr.append(len(tokens_ids))
+            for nombre, texto in fila["normativas"].items():
+                normativas.append((cadenas.setdefault(nombre, len(cadenas)), cadenas.setdefault(texto, len(cadenas))))
+            normativas_indptr.append(len(normativas))
+
+        codificadas = [cadena.encode("utf-8") for cadena in cadenas]
+        desplazamientos = np.zeros(len(codificadas) + 1, dtype=np.int64)
+        np.cumsum([len(contenido) for contenido in codificadas], out=desplazamientos[1:])
+        return cls(
+            list(tokens),
+            np.frombuffer(b"".join(codificadas), dtype=np.uint8),
+            desplazamientos,
+            textos,
+            np.asarray(tokens_indptr, dtype=np.int64),
+            np.asarray(tokens_ids, dtype=np.int32),
+            np.asarray(normativas_indptr, dtype=np.int64),
+            np.asarray(normativas, dtype=np.int32).reshape(-1, 2),
+        )
+
+    def guardar(self, directorio: Path) -> None:
+        directorio.mkdir()
+        _guardar_json(directorio / "tokens.json", self.tokens)
+        np.save(directorio / "cadenas.npy", self.cadenas)
+        np.save(directorio / "cadenas_desplazamientos.npy", self.desplazamientos)
+        np.save(directorio / "textos.npy", self.textos)
+        np.save(directorio / "tokens_indptr.npy", self.tokens_indptr)
+        np.save(directorio / "tokens_ids.npy", self.tokens_ids)
+        np.save(directorio / "normativas_indptr.npy", self.normativas_indptr)
+        np.save(directorio / "normativas.npy", self.normativas)
+
+    @classmethod
+    def mapear(cls, directorio: Path):
+        return cls(
+            _leer_json(directorio / "tokens.json"),
+            _mapear(directorio / "cadenas.npy"),
+            _mapear(directorio / "cadenas_desplazamientos.npy"),
+            _mapear(directorio / "textos.npy"),
+            _mapear(directorio / "tokens_indptr.npy"),
+            _mapear(directorio / "tokens_ids.npy"),
+            _mapear(directorio / "normativas_indptr.npy"),
+            _mapear(directorio / "normativas.npy"),
+        )
+
+    def __len__(self):
+        return len(self.textos)
+
+    def cadena(self, indice):
+        inicio, fin = self._desplazamientos[indice:indice + 2]
+        return str(self._cadenas[inicio:fin], "utf-8")
+
+    def _fila(self, fila):
+        """(textos, tokens, normativas) de una fila, armados al leerla y guardados en el LRU."""
+        with self._lock:
+            valor = self._filas.get(fila)
+            if valor is not None:
+                self._filas.move_to_end(fila)
+                return valor
+
+        inicio = fila * len(self.CAMPOS)
+        textos = dict(zip(self.CAMPOS, map(self.cadena, self._textos[inicio:inicio + len(self.CAMPOS)])))
+        limites = self._tokens_indptr[inicio:inicio + len(self.CAMPOS) + 1].tolist()
+        ids = self.tokens_ids[limites[0]:limites[-1]].tolist()
+        token = self.tokens.__getitem__
+        tokens = {
+            campo: frozenset(map(token, ids[desde - limites[0]:hasta - limites[0]]))
+            for campo, desde, hasta in zip(self.CAMPOS, limites, limites[1:])
+        }
+        desde, hasta = self._normativas_indptr[fila:fila + 2]
+        pares = self.normativas[desde:hasta].tolist()
+        normativas = {self.cadena(nombre): self.cadena(texto) for nombre, texto in pares}
+
+        valor = (textos, tokens, normativas)
+        with self._lock:
+            self._filas[fila] = valor
+            if len(self._filas) > self.FILAS_EN_CACHE:
+                self._filas.popitem(last=False)
+        return valor
+
+    def textos_de(self, fila):
+        return self._fila(fila)[0]
+
+    def tokens_de(self, fila):
+        return self._fila(fila)[1]
+
+    def normativas_de(self, fila):
+        return self._fila(fila)[2]
+
+    def normalizado(self, fila):
+        return Normalizado(self, fila)
+
+    __getitem__ = normalizado
+
+
+class Normalizado(Mapping):
+    """Vista de una fila de TablaNormalizados con la forma de ``precalcular_textos_normalizados``."""
+
+    __slots__ = ("_tabla", "_fila")
+
+    _SECCIONES = ("textos", "tokens", "normativas")
+
+    def __init__(self, tabla, fila):
+        self._tabla = tabla
+        self._fila = fila
+
+    def __getitem__(self, seccion):
+        if seccion == "textos":
+            return self._tabla.textos_de(self._fila)
+        if seccion == "tokens":
+            return self._tabla.tokens_de(self._fila)
+        if seccion == "normativas":
+            return self._tabla.normativas_de(self._fila)
+        raise KeyError(seccion)
+
+    def __iter__(self):
+        return iter(self._SECCIONES)
+
+    def __len__(self):
+        return len(self._SECCIONES)
+
+    def __repr__(self):
+        return repr({seccion: dict(valor) for seccion, valor in self.items()})
+
+
+def guardar_registros(huella: str, registros: dict) -> bool:
+    """Guarda AUDITORIA_DATA asociado a la huella de sus fuentes."""
+    if not persistencia_habilitada():
+        return False
+
+    destino = _directorio_registros(huella)
+    if destino.exists():
+        return True
+
+    filas, rangos = _unir_registros(registros)
+    if not filas:
+        return False
+
+    def escribir(directorio):
+        TablaColumnar.desde_registros(filas).guardar(directorio)
+        _guardar_json(directorio / "auditorias.json", rangos)
+
+    try:
+        _publicar_directorio(destino, escribir)
+        _podar_antiguos(lambda path: path.name.startswith("registros-"))
+        return True
+    except OSError as e:
+        logger.warning("No se pudieron persistir los registros: %s", e)
+        return False
+
+
+def cargar_registros(huella: str):
+    """Devuelve AUDITORIA_DATA mapeado (auditoría -> VistaRegistros) o None si no existe."""
+    if not persistencia_habilitada():
+        return None
+
+    origen = _directorio_registros(huella)
+    if not origen.is_dir():
+        return None
+
+    try:
+        return _vistas_por_auditoria(TablaColumnar.mapear(origen), _leer_json(origen / "auditorias.json"))
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning("Registros persistidos ilegibles (%s): %s", origen.name, e)
+        return None
+
+
+def registros_columnares(registros: dict) -> dict:
+    """AUDITORIA_DATA como tabla columnar en memoria (auditoría -> VistaRegistros), sin persistir."""
+    filas, rangos = _unir_registros(registros)
+    return _vistas_por_auditoria(TablaColumnar.desde_registros(filas), rangos)
+
+
+def _unir_registros(registros):
+    filas = []
+    rangos = []
+    for auditoria, datos in registros.items():
+        inicio = len(filas)
+        filas.extend(datos)
+        rangos.append({"auditoria": auditoria, "inicio": inicio, "fin": len(filas)})
+    return filas, rangos
+
+
+def _vistas_por_auditoria(tabla, rangos):
+    return {
+        rango["auditoria"]: VistaRegistros(tabla, rango["inicio"], rango["fin"])
+        for rango in rangos
+    }
+
+
+# =============================================================================
+# ÍNDICE TF-IDF MAPEADO EN MEMORIA
+# =============================================================================
+
+def guardar_indice(version: str, huella: str, parametros: dict, vocabulario: dict, idf, matriz, postings, normalizados, conteos: dict, terminos_podados=()) -> bool:
+    """Escribe el índice en un directorio temporal y lo publica con rename atómico."""
+    if not persistencia_habilitada():
+        return False
+
+    destino = directorio_indices() / version
+    if destino.exists():
+        return True
+
+    def escribir(directorio):
+        _guardar_json(
+            directorio / "vocabulario.json",
+            {termino: int(columna) for termino, columna in vocabulario.items()},
+        )
+        _guardar_json(directorio / "terminos_podados.json", sorted(terminos_podados))
+        np.save(directorio / "idf.npy", np.asarray(idf, dtype=np.float64))
+        _guardar_csr(directorio, "matriz", matriz)
+        _guardar_csr(directorio, "postings", postings)
+        TablaNormalizados.desde_filas(normalizados).guardar(directorio / "normalizados")
+        _guardar_json(directorio / "metadatos.json", {
+            "formato": FORMATO_INDICE,
+            "version": version,
+            "huella": huella,
+            "parametros": parametros,
+            "documentos": int(matriz.shape[0]),
+            "terminos": int(matriz.shape[1]),
+            "conteos_por_auditoria": conteos,
+        }, indent=2)
+
+    try:
+        if _publicar_directorio(destino, escribir):
+            _podar_antiguos(lambda path: path.is_dir() and not path.name.startswith("registros-"))
+            logger.info("💾 Índice persistido: %s", destino)
+        return True
+    except OSError as e:
+        logger.warning("No se pudo persistir el índice %s: %s", version, e)
+        return False
+
+
+def cargar_indice(version: str):
+    """Mapea vocabulario, IDF, matriz, postings y textos normalizados de una versión, o None si no existe."""
+    if not persistencia_habilitada():
+        return None
+
+    origen = directorio_indices() / version
+    if not origen.is_dir():
+        return None
+
+    try:
+        metadatos = _leer_json(origen / "metadatos.json")
+        if metadatos.get("formato") != FORMATO_INDICE:
+            return None
+        forma = (metadatos["documentos"], metadatos["terminos"])
+        return {
+            "metadatos": metadatos,
+            "vocabulario": _leer_json(origen / "vocabulario.json"),
+            "terminos_podados": _leer_json(origen / "terminos_podados.json"),
+            "idf": _mapear(origen / "idf.npy"),
+            "matriz": _mapear_csr(origen, "matriz", forma),
+            "postings": _mapear_csr(origen, "postings", forma[::-1]),
+            "normalizados": TablaNormalizados.mapear(origen / "normalizados"),
+        }
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning("Índice persistido ilegible (%s): %s", version, e)
+        return None
@@ -0,0 +1,325 @@
+"""
+Auditel — Métricas
+==================
+MonitorRendimiento: contadores de solicitudes, caché y errores, e
+histogramas de latencia por endpoint y etapa del pipeline (normalizar,
+vectorizar, puntuar, post_filtro, formatear, total).
+
+Los histogramas tienen cubetas fijas en escala logarítmica (4 por cada
+potencia de 2, de ~61 µs a 128 s), así que los percentiles p50/p95/p99 se
+estiman con un error relativo acotado (< 19 %) sin guardar muestras.
+
+Cada worker publica periódicamente su instantánea en
+``<directorio>/<pid>.json``; ``agregadas()`` suma las de todos los workers
+vivos del host. ``prometheus()`` las expone en formato de texto de Prometheus.
+``memoria_proceso()`` separa la memoria residente compartida (páginas
+heredadas del master con ``--preload``) de la privada de cada worker.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from pathlib import Path
+
+logger = logging.getLogger("auditel.metricas")
+
+SUBDIVISIONES = 4
+# Límites superiores de las cubetas, en segundos: 2^(k/4) para k en [-56, 28]
+LIMITES = [2 ** (k / SUBDIVISIONES) for k in range(-14 * SUBDIVISIONES, 7 * SUBDIVISIONES + 1)]
+# Para Prometheus se exponen sólo las potencias de 2 (subconjunto de LIMITES)
+INDICES_PROMETHEUS = list(range(0, len(LIMITES), SUBDIVISIONES))
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+class Histograma:
+    """Histograma de cubetas fijas (la última cubeta acumula valores > LIMITES[-1])."""
+
+    __slots__ = ("conteos", "suma", "total")
+
+    def __init__(self, conteos=None, suma=0.0, total=0):
+        self.conteos = list(conteos) if conteos else [0] * (len(LIMITES) + 1)
+        self.suma = suma
+        self.total = total
+
+    def observar(self, valor):
+        self.conteos[bisect_left(LIMITES, valor)] += 1
+        self.suma += valor
+        self.total += 1
+
+    def combinar(self, otro):
+        for indice, conteo in enumerate(otro.conteos):
+            self.conteos[indice] += conteo
+        self.suma += otro.suma
+        self.total += otro.total
+
+    def percentil(self, fraccion):
+        """Estimación por interpolación lineal dentro de la cubeta (como histogram_quantile)."""
+        if not self.total:
+            return 0.0
+        objetivo = fraccion * self.total
+        acumulado = 0
+        for indice, conteo in enumerate(self.conteos):
+            if conteo and acumulado + conteo >= objetivo:
+                inferior = LIMITES[indice - 1] if indice > 0 else 0.0
+                superior = LIMITES[indice] if indice < len(LIMITES) else LIMITES[-1]
+                return inferior + (superior - inferior) * (objetivo - acumulado) / conteo
+            acumulado += conteo
+        return LIMITES[-1]
+
+    def a_dict(self):
+        return {"conteos": self.conteos, "suma": self.suma, "total": self.total}
+
+    @classmethod
+    def desde_dict(cls, datos):
+        return cls(datos["conteos"], datos["suma"], datos["total"])
+
+
+def _proceso_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MonitorRendimiento:
+    def __init__(self, directorio=None, intervalo_publicacion=2.0):
+        self.directorio = Path(directorio) if directorio else None
+        self.intervalo_publicacion = intervalo_publicacion
+        self._lock = threading.Lock()
+        self._ultima_publicacion = 0.0
+        self.metricas = {
+            'solicitudes_totales': 0,
+            'solicitudes_exitosas': 0,
+            'solicitudes_fallidas': 0,
+            'cache_hits': 0,
+            'cache_misses': 0,
+            'errores_por_tipo': {}
+        }
+        # (endpoint, etapa) -> Histograma
+        self.histogramas = defaultdict(Histograma)
+
+    def reiniciar(self):
+        """Vacía contadores e histogramas (p. ej. los heredados del master tras un fork)."""
+        with self._lock:
+            for clave in self.metricas:
+                self.metricas[clave] = {} if clave == 'errores_por_tipo' else 0
+            self.histogramas.clear()
+            self._ultima_publicacion = 0.0
+
+    def registrar_solicitud(self, exitosa, tiempo_procesamiento, endpoint="interno"):
+        with self._lock:
+            self.metricas['solicitudes_totales'] += 1
+            if exitosa:
+                self.metricas['solicitudes_exitosas'] += 1
+                self.histogramas[(endpoint, 'total')].observar(tiempo_procesamiento)
+            else:
+                self.metricas['solicitudes_fallidas'] += 1
+        self._publicar_si_corresponde()
+
+    def observar(self, endpoint, etapa, segundos):
+        with self._lock:
+            self.histogramas[(endpoint, etapa)].observar(segundos)
+
+    def registrar_cache_hit(self):
+        with self._lock:
+            self.metricas['cache_hits'] += 1
+
+    def registrar_cache_miss(self):
+        with self._lock:
+            self.metricas['cache_misses'] += 1
+
+    def registrar_error(self, tipo_error):
+        with self._lock:
+            errores = self.metricas['errores_por_tipo']
+            errores[tipo_error] = errores.get(tipo_error, 0) + 1
+
+    def _instantanea(self):
+        with self._lock:
+            return {
+                'metricas': {**self.metricas, 'errores_por_tipo': dict(self.metricas['errores_por_tipo'])},
+                'histogramas': [
+                    [endpoint, etapa, histograma.a_dict()]
+                    for (endpoint, etapa), histograma in self.histogramas.items()
+                ],
+            }
+
+    def _publicar_si_corresponde(self):
+        if self.directorio is None:
+            return
+        ahora = time.monotonic()
+        if ahora - self._ultima_publicacion >= self.intervalo_publicacion:
+            self._ultima_publicacion = ahora
+            self.publicar()
+
+    def publicar(self):
+        """Escribe la instantánea de este worker (reemplazo atómico del archivo)."""
+        if self.directorio is None:
+            return
+        try:
+            self.directorio.mkdir(parents=True, exist_ok=True)
+            destino = self.directorio / f"{os.getpid()}.json"
+            temporal = destino.with_suffix(".tmp")
+            temporal.write_text(json.dumps(self._instantanea()), encoding="utf-8")
+            os.replace(temporal, destino)
+        except OSError as e:
+            logger.warning("No se pudieron publicar las métricas: %s", e)
+
+    def _instantaneas_workers(self):
+        if self.directorio is None:
+            yield self._instantanea()
+            return
+
+        self.publicar()
+        for ruta in self.directorio.glob("*.json"):
+            try:
+                pid = int(ruta.stem)
+            except ValueError:
+                continue
+            if not _proceso_vivo(pid):
+                # Worker terminado: sus contadores dejan de sumarse (Prometheus lo trata como reinicio)
+                ruta.unlink(missing_ok=True)
+                continue
+            try:
+                yield json.loads(ruta.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+
+    def agregadas(self):
+        """Contadores e histogramas sumados entre todos los workers vivos."""
+        metricas = {
+            'solicitudes_totales': 0,
+            'solicitudes_exitosas': 0,
+            'solicitudes_fallidas': 0,
+            'cache_hits': 0,
+            'cache_misses': 0,
+            'errores_por_tipo': defaultdict(int),
+        }
+        histogramas = defaultdict(Histograma)
+        workers = 0
+
+        for instantanea in self._instantaneas_workers():
+            workers += 1
+            for clave, valor in instantanea['metricas'].items():
+                if clave == 'errores_por_tipo':
+                    for tipo, conteo in valor.items():
+                        metricas['errores_por_tipo'][tipo] += conteo
+                elif clave in metricas:
+                    metricas[clave] += valor
+            for endpoint, etapa, datos in instantanea['histogramas']:
+                histogramas[(endpoint, etapa)].combinar(Histograma.desde_dict(datos))
+
+        metricas['errores_por_tipo'] = dict(metricas['errores_por_tipo'])
+        return metricas, dict(histogramas), workers
+
+    def obtener_metricas(self):
+        """Métricas de este worker (compatibles con /metrics) más percentiles por endpoint y etapa."""
+        instantanea = self._instantanea()
+        metricas = instantanea['metricas']
+        histogramas = {
+            (endpoint, etapa): Histograma.desde_dict(datos)
+            for endpoint, etapa, datos in instantanea['histogramas']
+        }
+
+        totales = [histograma for (_, etapa), histograma in histogramas.items() if etapa == 'total']
+        suma = sum(histograma.suma for histograma in totales)
+        conteo = sum(histograma.total for histograma in totales)
+        metricas['tiempo_respuesta_promedio'] = suma / conteo if conteo else 0
+        metricas['percentiles'] = _percentiles_por_etapa(histogramas)
+        return metricas
+
+    def prometheus(self):
+        """Métricas agregadas entre workers en formato de texto de Prometheus."""
+        metricas, histogramas, workers = self.agregadas()
+        lineas = [
+            "# HELP auditel_workers Workers que publicaron métricas.",
+            "# TYPE auditel_workers gauge",
+            f"auditel_workers {workers}",
+            "# HELP auditel_solicitudes_total Solicitudes atendidas por resultado.",
+            "# TYPE auditel_solicitudes_total counter",
+            f'auditel_solicitudes_total{{resultado="exitosa"}} {metricas["solicitudes_exitosas"]}',
+            f'auditel_solicitudes_total{{resultado="fallida"}} {metricas["solicitudes_fallidas"]}',
+            "# HELP auditel_cache_busqueda_total Consultas a la caché de búsqueda semántica.",
+            "# TYPE auditel_cache_busqueda_total counter",
+            f'auditel_cache_busqueda_total{{resultado="hit"}} {metricas["cache_hits"]}',
+            f'auditel_cache_busqueda_total{{resultado="miss"}} {metricas["cache_misses"]}',
+            "# HELP auditel_errores_total Errores por tipo.",
+            "# TYPE auditel_errores_total counter",
+        ]
+        lineas.extend(
+            f'auditel_errores_total{{tipo="{_escapar(tipo)}"}} {conteo}'
+            for tipo, conteo in sorted(metricas["errores_por_tipo"].items())
+        )
+
+        lineas += [
+            "# HELP auditel_duracion_segundos Latencia por endpoint y etapa del pipeline.",
+            "# TYPE auditel_duracion_segundos histogram",
+        ]
+        for (endpoint, etapa), histograma in sorted(histogramas.items()):
+            etiquetas = f'endpoint="{_escapar(endpoint)}",etapa="{_escapar(etapa)}"'
+            acumulado = 0
+            siguiente = 0
+            for indice in INDICES_PROMETHEUS:
+                while siguiente <= indice:
+                    acumulado += histograma.conteos[siguiente]
+                    siguiente += 1
+                lineas.append(f'auditel_duracion_segundos_bucket{{{etiquetas},le="{LIMITES[indice]:.6g}"}} {acumulado}')
+            lineas.append(f'auditel_duracion_segundos_bucket{{{etiquetas},le="+Inf"}} {histograma.total}')
+            lineas.append(f"auditel_duracion_segundos_sum{{{etiquetas}}} {histograma.suma:.9g}")
+            lineas.append(f"auditel_duracion_segundos_count{{{etiquetas}}} {histograma.total}")
+
+        lineas += [
+            "# HELP auditel_duracion_percentil_segundos Percentiles estimados de latencia por endpoint y etapa.",
+            "# TYPE auditel_duracion_percentil_segundos gauge",
+        ]
+        for (endpoint, etapa), histograma in sorted(histogramas.items()):
+            for fraccion in PERCENTILES:
+                lineas.append(
+                    f'auditel_duracion_percentil_segundos{{endpoint="{_escapar(endpoint)}",'
+                    f'etapa="{_escapar(etapa)}",percentil="{fraccion}"}} {histograma.percentil(fraccion):.9g}'
+                )
+
+        return "\n".join(lineas) + "\n"
+
+
+def memoria_proceso(pid="self"):
+    """Memoria residente del proceso en MB: compartida con otros procesos y privada (None fuera de Linux)."""
+    try:
+        contenido = Path(f"/proc/{pid}/smaps_rollup").read_text(encoding="ascii")
+    except OSError:
+        return None
+
+    kilobytes = {}
+    for linea in contenido.splitlines():
+        campo, _, valor = linea.partition(":")
+        if valor.strip().endswith("kB"):
+            kilobytes[campo] = int(valor.split()[0])
+    return {
+        "rss_mb": round(kilobytes.get("Rss", 0) / 1024, 1),
+        # Reparto proporcional de las páginas compartidas: sumar el pss de todos los workers da el total real
+        "pss_mb": round(kilobytes.get("Pss", 0) / 1024, 1),
+        "compartida_mb": round((kilobytes.get("Shared_Clean", 0) + kilobytes.get("Shared_Dirty", 0)) / 1024, 1),
+        "privada_mb": round((kilobytes.get("Private_Clean", 0) + kilobytes.get("Private_Dirty", 0)) / 1024, 1),
+        # Páginas que el proceso escribió (heap, copias por COW); las limpias del índice mapeado son page cache
+        "privada_sucia_mb": round(kilobytes.get("Private_Dirty", 0) / 1024, 1),
+    }
+
+
+def _percentiles_por_etapa(histogramas):
+    resultado = {}
+    for (endpoint, etapa), histograma in sorted(histogramas.items()):
+        resultado.setdefault(endpoint, {})[etapa] = {
+            f"p{round(fraccion * 100)}": round(histograma.percentil(fraccion) * 1000, 3)
+            for fraccion in PERCENTILES
+        } | {"conteo": histograma.total}
+    return resultado
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,182 @@
+"""
+Auditel — Registro de consultas
+===============================
+Registro estructurado (JSONL, sólo anexado) de cada consulta atendida:
+consulta normalizada, auditoría, latencia, registros devueltos, similitud
+máxima y resultado de caché. Sirve para ajustar SIMILARITY_THRESHOLD /
+TOP_N_RESULTS y para precalentar la caché con las consultas más frecuentes
+al arrancar.
+
+Todos los workers anexan al mismo archivo, así que ninguno lo rota (dos
+workers rotando a la vez pierden o pisan copias): lo rota logrotate
+(deploy/logrotate/portfolio-auditel, ``consultas.jsonl.1`` … ``.5``) y cada
+worker reabre el archivo cuando detecta que fue movido (WatchedFileHandler).
+
+Resumen del registro:
+
+    python -m scripts.registro_consultas logs/consultas.jsonl --top 20
+"""
+
+import argparse
+import json
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime
+from logging.handlers import WatchedFileHandler
+from pathlib import Path
+
+logger = logging.getLogger("auditel")
+
+LONGITUD_MAXIMA_PREGUNTA = 300
+
+
+class RegistroConsultas:
+    """Escribe una línea JSON por consulta; ``copias`` es cuántas rotadas (externamente) se leen."""
+
+    def __init__(self, ruta, copias=5):
+        self.ruta = Path(ruta)
+        self.ruta.parent.mkdir(parents=True, exist_ok=True)
+        self.copias = copias
+
+        # Logger propio sin propagación: sólo el JSON, sin el formato de app.log
+        self._logger = logging.getLogger("auditel.consultas." + str(self.ruta.resolve()).replace(".", "_"))
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+        if not self._logger.handlers:
+            handler = WatchedFileHandler(self.ruta, encoding="utf-8", delay=True)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger.addHandler(handler)
+
+    def registrar(self, endpoint, pregunta, consulta, auditoria, latencia, registros, encontrado,
+                  max_similitud, cache, version):
+        self._logger.info(json.dumps({
+            "ts": datetime.now().isoformat(timespec="milliseconds"),
+            "endpoint": endpoint,
+            "consulta": consulta,
+            "pregunta": pregunta[:LONGITUD_MAXIMA_PREGUNTA],
+            "auditoria": auditoria,
+            "latencia_ms": round(latencia * 1000, 2),
+            "registros": registros,
+            "encontrado": encontrado,
+            "max_similitud": round(max_similitud, 4),
+            "cache": cache,
+            "version": version,
+        }, ensure_ascii=False))
+
+    def archivos(self):
+        """Archivo actual y rotados, del más antiguo al más reciente."""
+        rotados = [self.ruta.with_name(f"{self.ruta.name}.{numero}") for numero in range(self.copias, 0, -1)]
+        return [ruta for ruta in rotados + [self.ruta] if ruta.exists()]
+
+
+def leer_registros(archivos, max_bytes=None):
+    """Genera los registros de los archivos dados, ignorando líneas corruptas (p. ej. cortadas).
+
+    Con ``max_bytes`` sólo se leen los últimos ``max_bytes`` del conjunto
+    (los archivos más recientes primero), empezando en la primera línea
+    completa.
+    """
+    tramos = [(ruta, 0) for ruta in archivos]
+    if max_bytes is not None:
+        tramos = []
+        restante = max_bytes
+        for ruta in reversed(archivos):
+            if restante <= 0:
+                break
+            tamano = ruta.stat().st_size
+            tramos.append((ruta, max(tamano - restante, 0)))
+            restante -= tamano
+        tramos.reverse()
+
+    for ruta, desde in tramos:
+        with open(ruta, "rb") as archivo:
+            if desde:
+                archivo.seek(desde - 1)
+                # Si el corte cae a mitad de línea, se descarta ese fragmento
+                archivo.readline()
+            for linea in archivo:
+                try:
+                    registro = json.loads(linea)
+                except ValueError:
+                    continue
+                if isinstance(registro, dict) and registro.get("consulta"):
+                    yield registro
+
+
+def minar_consultas_frecuentes(registros, top_n=100):
+    """Las ``top_n`` (consulta normalizada, auditoría) más frecuentes.
+
+    Cada una lleva la última pregunta original vista como representante para
+    volver a ejecutarla.
+    """
+    frecuencias = Counter()
+    representantes = {}
+    for registro in registros:
+        clave = (registro["consulta"], registro.get("auditoria"))
+        frecuencias[clave] += 1
+        representantes[clave] = registro.get("pregunta") or registro["consulta"]
+
+    return [
+        {
+            "consulta": consulta,
+            "auditoria": auditoria,
+            "pregunta": representantes[(consulta, auditoria)],
+            "frecuencia": frecuencia,
+        }
+        for (consulta, auditoria), frecuencia in frecuencias.most_common(top_n)
+    ]
+
+
+def _percentil(valores, fraccion):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(int(fraccion * len(ordenados)), len(ordenados) - 1)]
+
+
+def resumir(registros):
+    """Indicadores para ajustar umbrales: tasa sin resultado, similitud máxima, latencias y caché."""
+    total = 0
+    sin_resultado = 0
+    latencias = []
+    similitudes = []
+    cache = Counter()
+    por_auditoria = defaultdict(int)
+
+    for registro in registros:
+        total += 1
+        sin_resultado += not registro.get("encontrado")
+        latencias.append(registro.get("latencia_ms", 0.0))
+        similitudes.append(registro.get("max_similitud", 0.0))
+        cache[registro.get("cache") or "calculado"] += 1
+        por_auditoria[registro.get("auditoria")] += 1
+
+    return {
+        "consultas": total,
+        "sin_resultado": round(sin_resultado / total, 4) if total else 0.0,
+        "latencia_ms": {"p50": _percentil(latencias, 0.5), "p95": _percentil(latencias, 0.95)},
+        "max_similitud": {"p10": _percentil(similitudes, 0.1), "p50": _percentil(similitudes, 0.5)},
+        "cache": dict(cache),
+        "por_auditoria": dict(por_auditoria),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m scripts.registro_consultas",
+        description="Resume el registro de consultas y lista las más frecuentes.",
+    )
+    parser.add_argument("ruta", nargs="?", default="logs/consultas.jsonl")
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    archivos = RegistroConsultas(args.ruta).archivos()
+    print(json.dumps({
+        "resumen": resumir(leer_registros(archivos)),
+        "frecuentes": minar_consultas_frecuentes(leer_registros(archivos), args.top),
+    }, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,170 @@
+"""
+Auditel — Trazas por etapa
+==========================
+Spans de tiempo ligeros dentro de una solicitud muestreada. La traza activa
+vive en un ``ContextVar``, así que ``span()`` no cuesta nada (salvo la
+consulta de la variable) cuando la solicitud no fue muestreada.
+
+Las trazas terminadas se anexan a un archivo en formato Chrome Trace Event
+(arreglo JSON de eventos ``"ph": "X"``, sin cerrar, como permite el formato)
+que se abre en ``chrome://tracing`` o https://ui.perfetto.dev.
+
+El archivo rota por tamaño: el worker que lo ve pasar de ``max_bytes`` lo
+renombra a ``<nombre>.<fecha>-<pid>.json`` (nombre único, así dos workers
+que rotan a la vez no se pisan) y sólo se conservan las ``copias`` más
+recientes. La siguiente traza crea un archivo nuevo con su ``[`` inicial.
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+logger = logging.getLogger("auditel.trazas")
+
+_traza_actual = ContextVar("auditel_traza", default=None)
+
+
+class Traza:
+    """Spans (nombre, inicio, duración) de una solicitud, en microsegundos desde el inicio."""
+
+    __slots__ = ("nombre", "inicio", "inicio_epoca", "spans", "_abiertos", "duracion")
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.inicio = time.perf_counter()
+        self.inicio_epoca = time.time()
+        self.spans = []
+        self._abiertos = 0
+        self.duracion = None
+
+    def _microsegundos(self, instante):
+        return (instante - self.inicio) * 1e6
+
+    @contextmanager
+    def span(self, nombre):
+        inicio = time.perf_counter()
+        self._abiertos += 1
+        try:
+            yield
+        finally:
+            self._abiertos -= 1
+            fin = time.perf_counter()
+            self.spans.append((nombre, self._microsegundos(inicio), (fin - inicio) * 1e6, self._abiertos))
+
+    def cerrar(self):
+        if self.duracion is None:
+            self.duracion = (time.perf_counter() - self.inicio) * 1e6
+
+    def a_dict(self):
+        """Resumen para la respuesta JSON: spans en orden de inicio, en milisegundos."""
+        return {
+            "nombre": self.nombre,
+            "duracion_ms": round((self.duracion or 0) / 1000, 3),
+            "spans": [
+                {
+                    "nombre": nombre,
+                    "inicio_ms": round(inicio / 1000, 3),
+                    "duracion_ms": round(duracion / 1000, 3),
+                    "nivel": nivel,
+                }
+                for nombre, inicio, duracion, nivel in sorted(self.spans, key=lambda span: (span[1], span[3]))
+            ],
+        }
+
+    def eventos_chrome(self):
+        """Eventos completos (``ph: X``) con marcas de tiempo absolutas en microsegundos."""
+        base = self.inicio_epoca * 1e6
+        pid = os.getpid()
+        tid = threading.get_ident()
+        eventos = [{
+            "name": self.nombre, "cat": "solicitud", "ph": "X",
+            "ts": round(base, 3), "dur": round(self.duracion or 0, 3), "pid": pid, "tid": tid,
+        }]
+        eventos.extend(
+            {
+                "name": nombre, "cat": "etapa", "ph": "X",
+                "ts": round(base + inicio, 3), "dur": round(duracion, 3), "pid": pid, "tid": tid,
+            }
+            for nombre, inicio, duracion, _ in self.spans
+        )
+        return eventos
+
+
+@contextmanager
+def span(nombre):
+    """Mide el bloque dentro de la traza activa; no hace nada si no hay traza."""
+    traza = _traza_actual.get()
+    if traza is None:
+        yield
+        return
+    with traza.span(nombre):
+        yield
+
+
+class Trazador:
+    """Muestrea solicitudes y escribe sus trazas en un archivo Chrome Trace compartido por los workers."""
+
+    def __init__(self, muestreo=0.0, ruta=None, max_bytes=10 * 1024 * 1024, copias=5):
+        self.muestreo = muestreo
+        self.ruta = Path(ruta) if ruta else None
+        self.max_bytes = max_bytes
+        self.copias = copias
+        self._lock = threading.Lock()
+
+    def iniciar(self, nombre, forzar=False):
+        """Abre una traza si la solicitud sale muestreada (o ``forzar``); devuelve (traza, token)."""
+        if not forzar and (self.muestreo <= 0 or random.random() >= self.muestreo):
+            return None, None
+        traza = Traza(nombre)
+        return traza, _traza_actual.set(traza)
+
+    def finalizar(self, traza, token):
+        if traza is None:
+            return
+        _traza_actual.reset(token)
+        traza.cerrar()
+        if self.ruta is not None:
+            self._escribir(traza.eventos_chrome())
+
+    def _escribir(self, eventos):
+        lineas = "".join(json.dumps(evento, ensure_ascii=False) + ",\n" for evento in eventos)
+        try:
+            with self._lock:
+                self.ruta.parent.mkdir(parents=True, exist_ok=True)
+                # Sólo quien crea el archivo antepone el "[" inicial
+                try:
+                    descriptor = os.open(self.ruta, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o644)
+                    lineas = "[\n" + lineas
+                except FileExistsError:
+                    descriptor = os.open(self.ruta, os.O_WRONLY | os.O_APPEND)
+                # Una sola escritura con O_APPEND por traza: no se intercalan entre workers
+                with os.fdopen(descriptor, "w", encoding="utf-8") as archivo:
+                    archivo.write(lineas)
+                    archivo.flush()
+                    tamano = os.fstat(archivo.fileno()).st_size
+                if self.max_bytes and tamano >= self.max_bytes:
+                    self._rotar()
+        except OSError as e:
+            logger.warning("No se pudo escribir la traza: %s", e)
+
+    def rotados(self):
+        """Archivos rotados, del más antiguo al más reciente."""
+        return sorted(self.ruta.parent.glob(f"{self.ruta.stem}.*-*{self.ruta.suffix}"))
+
+    def _rotar(self):
+        ahora = time.time_ns()
+        marca = time.strftime("%Y%m%dT%H%M%S", time.localtime(ahora // 10**9)) + f"{ahora // 1000 % 10**6:06d}"
+        destino = self.ruta.with_name(f"{self.ruta.stem}.{marca}-{os.getpid()}{self.ruta.suffix}")
+        try:
+            os.rename(self.ruta, destino)
+        except FileNotFoundError:
+            # Otro worker lo rotó primero
+            return
+        for antiguo in self.rotados()[:-self.copias or None]:
+            antiguo.unlink(missing_ok=True)
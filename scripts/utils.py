@@ -1,4 +1,5 @@
 # Utility data and helpers for Auditel.
+import hashlib
 import json
 import logging
 import re
@@ -6,9 +7,17 @@ from pathlib import Path
 from zipfile import ZipFile
 import xml.etree.ElementTree as ET
 
+from scripts.indice_persistido import cargar_registros, guardar_registros, registros_columnares
+
 logger = logging.getLogger("auditel.utils")
 
 _BASE_DIR = Path(__file__).resolve().parent.parent
+_FUENTE_FINANCIERA_XLSX = _BASE_DIR / "Financiero" / "Normatividad.xlsx"
+_FUENTE_OBRA_PUBLICA_XLSX = _BASE_DIR / "Obra Pública" / "Base_2025_Entes_Estatales_con_anexo_vinculado.xlsx"
+# Archivos que se vigilan para recargar las fuentes sin reiniciar
+FUENTES_XLSX = (_FUENTE_OBRA_PUBLICA_XLSX, _FUENTE_FINANCIERA_XLSX)
+# Incrementar cuando cambie la forma de interpretar las fuentes (invalida índices persistidos)
+_VERSION_CARGA = 1
 _XML_NS = {
     "a": "http://schemas.openxmlformats.org/spreadsheetml/2006/main",
     "p": "http://schemas.openxmlformats.org/package/2006/relationships",
@@ -331,15 +340,22 @@ def _columna_a_indice(columna):
     return indice
 
 
+def _etiqueta(nombre):
+    return f"{{{_XML_NS['a']}}}{nombre}"
+
+
 def _cargar_shared_strings(zip_file):
     shared_strings = []
     if "xl/sharedStrings.xml" not in zip_file.namelist():
         return shared_strings
 
-    root = ET.fromstring(zip_file.read("xl/sharedStrings.xml"))
-    for item in root.findall("a:si", _XML_NS):
-        textos = [texto.text or "" for texto in item.iterfind(".//a:t", _XML_NS)]
-        shared_strings.append("".join(textos))
+    with zip_file.open("xl/sharedStrings.xml") as contenido:
+        for _, elemento in ET.iterparse(contenido, events=("end",)):
+            if elemento.tag != _etiqueta("si"):
+                continue
+            textos = [texto.text or "" for texto in elemento.iterfind(".//a:t", _XML_NS)]
+            shared_strings.append("".join(textos))
+            elemento.clear()
 
     return shared_strings
 
@@ -398,48 +414,64 @@ def _resolver_ruta_hoja(zip_file, sheet_name=None):
 
 
 def _leer_filas_xlsx(path, sheet_name=None, start_row=1):
-    """Lee filas no vacías de un archivo XLSX sin dependencias externas."""
+    """Genera filas no vacías de un archivo XLSX sin dependencias externas.
+
+    La hoja se recorre en streaming con iterparse y cada fila se libera al
+    procesarla, así que la memoria no depende del tamaño de la hoja.
+    """
     if not path.exists():
         logger.warning("Fuente XLSX no encontrada: %s", path)
-        return []
+        return
 
     with ZipFile(path) as zip_file:
         shared_strings = _cargar_shared_strings(zip_file)
         sheet_path = _resolver_ruta_hoja(zip_file, sheet_name=sheet_name)
         if not sheet_path:
             logger.warning("Hoja no encontrada en %s: %s", path.name, sheet_name)
-            return []
+            return
 
-        root = ET.fromstring(zip_file.read(sheet_path))
-        filas = []
+        etiqueta_fila = _etiqueta("row")
+        etiqueta_datos = _etiqueta("sheetData")
+        sheet_data = None
 
-        for fila in root.findall(".//a:sheetData/a:row", _XML_NS):
-            numero_fila = int(fila.get("r", "0"))
-            if numero_fila < start_row:
-                continue
+        with zip_file.open(sheet_path) as contenido:
+            for evento, elemento in ET.iterparse(contenido, events=("start", "end")):
+                if evento == "start":
+                    if elemento.tag == etiqueta_datos:
+                        sheet_data = elemento
+                    continue
 
-            celdas = {}
-            for celda in fila.findall("a:c", _XML_NS):
-                referencia = celda.get("r", "")
-                columna = "".join(caracter for caracter in referencia if caracter.isalpha())
-                indice = _columna_a_indice(columna)
-                celdas[indice] = _normalizar_valor_excel(_leer_valor_celda(celda, shared_strings))
+                if elemento.tag != etiqueta_fila:
+                    continue
 
-            if not celdas:
-                continue
+                fila = elemento
+                numero_fila = int(fila.get("r", "0"))
+                valores = None
 
-            max_columna = max(celdas)
-            valores = [celdas.get(indice, "") for indice in range(1, max_columna + 1)]
+                if numero_fila >= start_row:
+                    celdas = {}
+                    for celda in fila.findall("a:c", _XML_NS):
+                        referencia = celda.get("r", "")
+                        columna = "".join(caracter for caracter in referencia if caracter.isalpha())
+                        indice = _columna_a_indice(columna)
+                        celdas[indice] = _normalizar_valor_excel(_leer_valor_celda(celda, shared_strings))
 
-            if any(valor for valor in valores):
-                filas.append((numero_fila, valores))
+                    if celdas:
+                        max_columna = max(celdas)
+                        valores = [celdas.get(indice, "") for indice in range(1, max_columna + 1)]
 
-        return filas
+                # Liberar la fila ya procesada para no acumular el árbol completo
+                fila.clear()
+                if sheet_data is not None:
+                    sheet_data.remove(fila)
+
+                if valores and any(valor for valor in valores):
+                    yield numero_fila, valores
 
 
 def _cargar_fuente_financiera_excel():
     """Carga la fuente adicional de conceptos normativos de auditoría financiera."""
-    path = _BASE_DIR / "Financiero" / "Normatividad.xlsx"
+    path = _FUENTE_FINANCIERA_XLSX
     registros = []
 
     for _, fila in _leer_filas_xlsx(path, sheet_name="Normatividad", start_row=2):
@@ -464,7 +496,7 @@ def _cargar_fuente_financiera_excel():
 
 def _cargar_fuente_obra_publica_excel():
     """Carga la fuente adicional de obra pública basada en concepto y normativa."""
-    path = _BASE_DIR / "Obra Pública" / "Base_2025_Entes_Estatales_con_anexo_vinculado.xlsx"
+    path = _FUENTE_OBRA_PUBLICA_XLSX
     registros = []
 
     for _, fila in _leer_filas_xlsx(path, sheet_name="Irregularidades", start_row=3):
@@ -519,4 +551,41 @@ def _construir_auditoria_data():
 
     return auditoria_data
 
-AUDITORIA_DATA = _construir_auditoria_data()
+
+def calcular_huella_fuentes():
+    """Hash del contenido de las fuentes: JSON embebido y archivos XLSX."""
+    hasher = hashlib.sha256(f"carga:{_VERSION_CARGA}".encode("utf-8"))
+    for contenido in (_OBRA_PUBLICA_JSON, _FINANCIERO_JSON):
+        hasher.update(contenido.encode("utf-8"))
+
+    for path in FUENTES_XLSX:
+        hasher.update(path.name.encode("utf-8"))
+        if not path.exists():
+            hasher.update(b"<ausente>")
+            continue
+        with path.open("rb") as archivo:
+            for bloque in iter(lambda: archivo.read(1024 * 1024), b""):
+                hasher.update(bloque)
+
+    return hasher.hexdigest()[:16]
+
+
+def cargar_auditoria_data(huella):
+    """Usa los registros persistidos (mapeados en memoria) si las fuentes no cambiaron."""
+    auditoria_data = cargar_registros(huella)
+    if auditoria_data is not None:
+        logger.info("Registros cargados desde el índice persistido (%s)", huella)
+        return auditoria_data
+
+    auditoria_data = _construir_auditoria_data()
+    if guardar_registros(huella, auditoria_data):
+        # Releer la versión mapeada para compartir páginas con los demás workers
+        mapeados = cargar_registros(huella)
+        if mapeados is not None:
+            return mapeados
+    # Sin persistencia: la misma tabla columnar, en memoria, en vez de un dict por registro
+    return registros_columnares(auditoria_data)
+
+
+HUELLA_FUENTES = calcular_huella_fuentes()
+AUDITORIA_DATA = cargar_auditoria_data(HUELLA_FUENTES)
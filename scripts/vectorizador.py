@@ -0,0 +1,82 @@
+"""
+Auditel — Vectorizador de consultas
+===================================
+``VectorizadorConsultas`` reproduce ``TfidfVectorizer.transform`` con los
+parámetros del motor (palabras de 2+ caracteres, minúsculas, stop words, TF
+crudo × IDF, normalización L2) usando sólo NumPy/SciPy, a partir del
+vocabulario y el IDF de un índice ya ajustado.
+
+Con el índice persistido un worker nunca importa scikit-learn, que es casi
+todo el tiempo de arranque; ``ajustar_vectorizador`` lo importa sólo cuando
+hay que construir el índice.
+"""
+
+import re
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+
+# token_pattern por defecto de scikit-learn
+PATRON_TOKEN = r"(?u)\b\w\w+\b"
+
+
+class VectorizadorConsultas:
+    """Transformación TF-IDF (solo lectura) con el vocabulario e IDF de un índice ajustado."""
+
+    def __init__(self, vocabulario, idf, stop_words=None, terminos_podados=None):
+        self.vocabulary_ = vocabulario
+        self.idf_ = idf
+        self.stop_words = frozenset(stop_words or ())
+        # Términos que el ajuste descartó por max_df/min_df/max_features (``stop_words_`` de scikit-learn)
+        self.stop_words_ = frozenset(terminos_podados or ())
+        self._patron = re.compile(PATRON_TOKEN)
+
+    def build_analyzer(self):
+        """Tokens de un documento (mismo análisis que el ``build_analyzer`` de scikit-learn)."""
+        patron, stop_words = self._patron, self.stop_words
+
+        def analizar(documento):
+            return [token for token in patron.findall(documento.lower()) if token not in stop_words]
+
+        return analizar
+
+    def transform(self, documentos):
+        """Matriz CSR (documentos × términos) con filas TF-IDF normalizadas (L2)."""
+        analizar = self.build_analyzer()
+        vocabulario = self.vocabulary_
+        indptr = [0]
+        columnas = []
+        conteos = []
+        for documento in documentos:
+            frecuencias = Counter(vocabulario[token] for token in analizar(documento) if token in vocabulario)
+            for columna in sorted(frecuencias):
+                columnas.append(columna)
+                conteos.append(frecuencias[columna])
+            indptr.append(len(columnas))
+
+        indices = np.asarray(columnas, dtype=np.int32)
+        datos = np.asarray(conteos, dtype=np.float64) * self.idf_[indices]
+        indptr = np.asarray(indptr, dtype=np.int32)
+        por_fila = np.diff(indptr)
+        normas = np.sqrt(np.bincount(np.repeat(np.arange(len(por_fila)), por_fila), datos * datos, len(por_fila)))
+        normas[normas == 0] = 1.0
+        datos /= np.repeat(normas, por_fila)
+        return sparse.csr_matrix((datos, indices, indptr), shape=(len(por_fila), len(self.idf_)))
+
+
+def ajustar_vectorizador(documentos, parametros):
+    """Ajusta TF-IDF sobre ``documentos``; devuelve (VectorizadorConsultas, matriz documentos × términos)."""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    tfidf = TfidfVectorizer(**parametros)
+    matriz = tfidf.fit_transform(documentos)
+    # scikit-learn >= 1.7 ya no expone stop_words_: los podados son lo analizado que quedó fuera del vocabulario
+    analizar = tfidf.build_analyzer()
+    terminos = set()
+    for documento in documentos:
+        terminos.update(analizar(documento))
+    vectorizador = VectorizadorConsultas(
+        tfidf.vocabulary_, tfidf.idf_, parametros.get('stop_words'), terminos.difference(tfidf.vocabulary_),
+    )
+    return vectorizador, matriz
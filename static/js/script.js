@@ -435,10 +435,16 @@ document.addEventListener("DOMContentLoaded", function () {
         formData.append("ente", hiddenEnte?.value || chatbotConfig.defaultEnte || "No aplica");
 
         try {
-            const response = await fetchConTimeout("/ask", {
+            const response = await fetchConTimeout(window.ReadableStream ? "/ask/stream" : "/ask", {
                 method: "POST",
                 body: formData,
             });
+
+            if (response.body && (response.headers.get("Content-Type") || "").startsWith("text/event-stream")) {
+                await renderizarRespuestaEnStreaming(response, loadingMessage);
+                return;
+            }
+
             const data = await response.json();
 
             loadingMessage.remove();
@@ -446,14 +452,14 @@ document.addEventListener("DOMContentLoaded", function () {
             if (data.success) {
                 showBotMessage(data.answer, construirContextoRespuesta(data));
             } else {
-                showBotMessage(`
-                    <div class="error-message">
-                        <p><strong>No pude procesar la consulta.</strong></p>
-                        <p>${escapeHtml(data.message || "Ocurrió un error inesperado.")}</p>
-                    </div>
-                `);
+                mostrarErrorProcesamiento(data.message);
             }
         } catch (error) {
+            if (!loadingMessage.isConnected) {
+                // La respuesta ya comenzó a mostrarse; se conserva lo recibido
+                console.error("Error recibiendo la respuesta en streaming:", error);
+                return;
+            }
             loadingMessage.remove();
             showBotMessage(`
                 <div class="error-message">
@@ -472,6 +478,75 @@ document.addEventListener("DOMContentLoaded", function () {
         }
     }
 
+    function mostrarErrorProcesamiento(message) {
+        showBotMessage(`
+            <div class="error-message">
+                <p><strong>No pude procesar la consulta.</strong></p>
+                <p>${escapeHtml(message || "Ocurrió un error inesperado.")}</p>
+            </div>
+        `);
+    }
+
+    async function renderizarRespuestaEnStreaming(response, loadingMessage) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        let html = "";
+        let botMessage = null;
+        let content = null;
+
+        function procesarEvento(evento, data) {
+            if (evento === "inicio") {
+                html = data.html || "";
+                loadingMessage.remove();
+                botMessage = showBotMessage(html, construirContextoRespuesta(data));
+                content = botMessage.querySelector(".message-content");
+            } else if (evento === "fragmento" && content) {
+                // El navegador cierra los contenedores abiertos; cada fragmento amplía la respuesta
+                html += data.html || "";
+                content.innerHTML = renderAssistantContent(html);
+                scrollToBottom();
+            } else if (evento === "error") {
+                loadingMessage.remove();
+                mostrarErrorProcesamiento(data.message);
+            }
+        }
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                break;
+            }
+
+            buffer += decoder.decode(value, { stream: true });
+            let separador = buffer.indexOf("\n\n");
+            while (separador !== -1) {
+                const bloque = buffer.slice(0, separador);
+                buffer = buffer.slice(separador + 2);
+                separador = buffer.indexOf("\n\n");
+
+                let evento = "message";
+                const datos = [];
+                bloque.split("\n").forEach(function (linea) {
+                    if (linea.startsWith("event:")) {
+                        evento = linea.slice(6).trim();
+                    } else if (linea.startsWith("data:")) {
+                        datos.push(linea.slice(5).trimStart());
+                    }
+                });
+
+                if (datos.length) {
+                    procesarEvento(evento, JSON.parse(datos.join("\n")));
+                }
+            }
+        }
+
+        if (!botMessage && loadingMessage.isConnected) {
+            loadingMessage.remove();
+            mostrarErrorProcesamiento();
+        }
+    }
+
     function construirContextoRespuesta(data) {
         const partes = [];
 
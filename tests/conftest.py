@@ -1,2 +1,21 @@
-import sys, os
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# Antes de importar app: índice, registros, historial, métricas y cachés en un
+# directorio temporal, nunca en logs/ ni indice/ del repositorio
+_DIRECTORIO_PRUEBAS = tempfile.mkdtemp(prefix="auditel-tests-")
+atexit.register(shutil.rmtree, _DIRECTORIO_PRUEBAS, ignore_errors=True)
+os.environ.update({
+    "AUDITEL_INDICE_DIR": os.path.join(_DIRECTORIO_PRUEBAS, "indice"),
+    "AUDITEL_REGISTRO_CONSULTAS": os.path.join(_DIRECTORIO_PRUEBAS, "consultas.jsonl"),
+    "AUDITEL_HISTORIAL_RUTA": os.path.join(_DIRECTORIO_PRUEBAS, "historial.sqlite3"),
+    "AUDITEL_METRICAS_DIR": os.path.join(_DIRECTORIO_PRUEBAS, "metricas"),
+    "AUDITEL_CACHE_COMPARTIDO_RUTA": os.path.join(_DIRECTORIO_PRUEBAS, "cache_compartido.sqlite3"),
+    "AUDITEL_TRAZAS_RUTA": os.path.join(_DIRECTORIO_PRUEBAS, "trazas.json"),
+    "AUDITEL_RECARGA_MARCA": os.path.join(_DIRECTORIO_PRUEBAS, "recarga.marca"),
+})
@@ -28,6 +28,21 @@ def test_health_compat_route(client):
     assert r.status_code == 200
 
 
+def test_health_publico_es_minimo_y_el_detalle_requiere_sesion(client):
+    """Sin sesión sólo se expone estado y versión del índice; el diagnóstico exige login."""
+    import app
+
+    assert set(client.get("/health").get_json()) == {"status", "version_indice"}
+    assert client.get("/health").get_json()["version_indice"] == app.motor_actual().version_indice
+    assert client.get("/api/health/detalle").status_code == 302
+
+    with client.session_transaction() as sess:
+        sess["auth_user"] = "luis"
+        sess["usuario"] = "luis"
+    detalle = client.get("/api/health/detalle").get_json()
+    assert {"cache_respuestas_estadisticas", "memoria_worker", "llm_cortocircuito"} <= set(detalle)
+
+
 def test_index_redirects_when_not_logged_in(client):
     """GET / sin sesión debe redirigir al login."""
     r = client.get("/")
@@ -234,3 +249,1305 @@ def test_logout_clears_session(client):
     r = client.post("/logout")
     assert r.status_code == 302
     assert "login" in r.headers["Location"]
+
+
+def test_buscar_semanticamente_coincide_con_calculo_denso():
+    """El top-k vectorizado debe respetar umbral, auditoría y orden del cálculo completo."""
+    from app import Config, motor_busqueda
+
+    consulta_tfidf = motor_busqueda.vectorizer.transform(["conceptos pagados no ejecutados"])
+    similitudes = (motor_busqueda.matriz_tfidf_unificada @ consulta_tfidf.T).toarray().ravel()
+    esperados = sorted(
+        (
+            idx for idx, similitud in enumerate(similitudes)
+            if similitud > Config.SIMILARITY_THRESHOLD
+            and motor_busqueda.metadatos_unificados[idx]["auditoria"] == "Obra Pública"
+        ),
+        key=lambda idx: similitudes[idx],
+        reverse=True,
+    )[:5]
+
+    resultados = motor_busqueda.buscar_semanticamente(
+        "conceptos pagados no ejecutados",
+        "Obra Pública",
+        top_n=5,
+    )
+
+    assert [r["indice"] for r in resultados] == esperados
+    assert all(r["auditoria"] == "Obra Pública" for r in resultados)
+
+
+def test_motor_invertido_devuelve_mismo_ranking_que_matricial():
+    """El índice invertido con poda max-score debe reproducir el ranking matricial."""
+    from app import MotorBusquedaNormativasMejorado, motor_busqueda
+
+    motor_invertido = MotorBusquedaNormativasMejorado(motor_puntuacion="invertido")
+    assert motor_invertido.indice_invertido is not None
+
+    consultas = [
+        "conceptos pagados no ejecutados",
+        "presentan polizas",
+        "ingresos no registrados saldos",
+        "volumenes obra pagados",
+    ]
+    for consulta in consultas:
+        for auditoria in ("auto", "Obra Pública", "Financiera"):
+            esperados = motor_busqueda.buscar_semanticamente(consulta, auditoria, top_n=5)
+            obtenidos = motor_invertido.buscar_semanticamente(consulta, auditoria, top_n=5)
+            assert [r["indice"] for r in obtenidos] == [r["indice"] for r in esperados]
+
+
+def test_indice_persistido_se_reutiliza_entre_instancias(tmp_path, monkeypatch):
+    """Un segundo motor debe cargar el índice desde disco sin reajustar el vectorizador."""
+    from app import MotorBusquedaNormativasMejorado
+
+    monkeypatch.setenv("AUDITEL_INDICE_DIR", str(tmp_path))
+
+    motor_inicial = MotorBusquedaNormativasMejorado()
+    assert motor_inicial.indice_desde_disco is False
+    assert (tmp_path / motor_inicial.version_indice / "matriz_data.npy").exists()
+
+    motor_cargado = MotorBusquedaNormativasMejorado()
+    assert motor_cargado.indice_desde_disco is True
+    assert motor_cargado.version_indice == motor_inicial.version_indice
+    # Los arreglos se mapean de sólo lectura para compartir páginas entre workers
+    assert not motor_cargado.matriz_tfidf_unificada.data.flags.writeable
+    assert not motor_cargado.postings_por_termino.indices.flags.writeable
+
+    esperados = motor_inicial.buscar_semanticamente("no presentan polizas", "auto", top_n=5)
+    obtenidos = motor_cargado.buscar_semanticamente("no presentan polizas", "auto", top_n=5)
+    assert [(r["indice"], r["similitud"]) for r in obtenidos] == [
+        (r["indice"], r["similitud"]) for r in esperados
+    ]
+
+
+def test_textos_normalizados_persistidos_devuelven_tokens_como_frozenset(tmp_path, monkeypatch):
+    """Los tokens persistidos se guardan como ids y se leen como frozenset al leer cada fila, sin JSON."""
+    from app import MotorBusquedaNormativasMejorado
+
+    monkeypatch.setenv("AUDITEL_INDICE_DIR", str(tmp_path))
+    motor_inicial = MotorBusquedaNormativasMejorado()
+    motor_cargado = MotorBusquedaNormativasMejorado()
+    assert motor_cargado.indice_desde_disco is True
+
+    normalizados = motor_cargado.metadatos_unificados.normalizados
+    assert normalizados.tokens_ids.dtype.name == "int32"
+    assert not normalizados.tokens_ids.flags.writeable and not normalizados.cadenas.flags.writeable
+    # Cargar no arma objetos por fila: sólo las filas leídas pasan por el LRU
+    assert len(normalizados._filas) == 0
+    for fila in (0, len(normalizados) - 1):
+        esperado = motor_inicial.metadatos_unificados.normalizados[fila]
+        cargado = normalizados[fila]
+        assert isinstance(cargado["tokens"]["descripcion"], frozenset)
+        assert cargado == esperado
+    assert len(normalizados._filas) == 2
+
+
+def test_registros_persistidos_se_leen_como_vistas_mapeadas(tmp_path, monkeypatch):
+    """AUDITORIA_DATA persistido debe comportarse como lista de dicts sin cargarse completo."""
+    from scripts.indice_persistido import VistaRegistros, cargar_registros, guardar_registros
+
+    monkeypatch.setenv("AUDITEL_INDICE_DIR", str(tmp_path))
+    registros = {
+        "Obra Pública": [{"tipo": "Obra", "acciones_irregularidad": ["uno", "dos"]}],
+        "Financiera": [{"tipo": "Pólizas"}, {"tipo": "Ingresos", "concepto": "Ingresos"}],
+    }
+
+    assert guardar_registros("huella-prueba", registros) is True
+    cargados = cargar_registros("huella-prueba")
+
+    assert isinstance(cargados["Financiera"], VistaRegistros)
+    assert len(cargados["Financiera"]) == 2
+    assert list(cargados["Obra Pública"]) == registros["Obra Pública"]
+    assert cargados["Financiera"][-1]["concepto"] == "Ingresos"
+
+
+def test_leer_filas_xlsx_es_un_generador_en_streaming():
+    """La lectura de XLSX debe entregar filas bajo demanda en lugar de una lista completa."""
+    import inspect
+    from scripts.utils import _FUENTE_OBRA_PUBLICA_XLSX, _leer_filas_xlsx
+
+    filas = _leer_filas_xlsx(_FUENTE_OBRA_PUBLICA_XLSX, sheet_name="Irregularidades", start_row=3)
+    assert inspect.isgenerator(filas)
+
+    numero_fila, valores = next(filas)
+    assert numero_fila >= 3
+    assert any(valores)
+    filas.close()
+
+
+def test_mapa_de_usuarios_se_cachea_hasta_que_cambia_el_catalogo(tmp_path, monkeypatch):
+    """Las verificaciones de sesión no deben recargar ni rehashear el catálogo en cada request."""
+    import os
+    import scripts.auth as auth
+
+    catalogo = tmp_path / "catalogo_usuarios.json"
+    catalogo.write_text("[]", encoding="utf-8")
+    llamadas = []
+    usuarios = [{"usuario": "luis", "clave": "luis2025", "nombre_completo": "Luis"}]
+
+    def list_users_contado(project_key=None):
+        llamadas.append(project_key)
+        return usuarios
+
+    monkeypatch.setattr(auth, "USER_CATALOG_PATH", catalogo)
+    monkeypatch.setattr(auth, "list_users", list_users_contado)
+    auth.invalidate_user_cache()
+
+    try:
+        assert auth.get_canonical_username("LUIS") == "luis"
+        assert auth.get_user_display_name("luis") == "Luis"
+        assert auth.authenticate("luis", "luis2025") is True
+        assert len(llamadas) == 1
+
+        stat = catalogo.stat()
+        os.utime(catalogo, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        assert auth.get_canonical_username("luis") == "luis"
+        assert len(llamadas) == 2
+    finally:
+        auth.invalidate_user_cache()
+
+
+def test_catalogo_de_usuarios_ausente_se_avisa_una_vez(tmp_path, monkeypatch, caplog):
+    """Si la ruta del catálogo no existe, la invalidación por mtime no puede funcionar: se avisa una sola vez."""
+    import logging
+    import scripts.auth as auth
+
+    monkeypatch.setattr(auth, "USER_CATALOG_PATH", tmp_path / "no_existe.json")
+    monkeypatch.setitem(auth._catalog_warning, "logged", False)
+    with caplog.at_level(logging.WARNING, logger="auditel.auth"):
+        assert auth._catalog_signature() is None
+        assert auth._catalog_signature() is None
+    avisos = [registro for registro in caplog.records if "AUDITEL_USER_CATALOG" in registro.getMessage()]
+    assert len(avisos) == 1
+
+
+def test_sistema_cache_lru_con_ttl_y_contadores(monkeypatch):
+    """La caché debe expulsar la entrada menos reciente, expirar por TTL y contar aciertos."""
+    import scripts.cache as cache_mod
+
+    reloj = [1000.0]
+    monkeypatch.setattr(cache_mod.time, "monotonic", lambda: reloj[0])
+    cache = cache_mod.SistemaCache(max_size=2, ttl=10)
+
+    cache.guardar("a", "auto", 1)
+    cache.guardar("b", "auto", 2)
+    assert cache.obtener("a", "auto") == 1   # "a" pasa a ser la más reciente
+    cache.guardar("c", "auto", 3)             # expulsa "b"
+
+    assert cache.obtener("b", "auto") is None
+    assert cache.obtener("c", "auto") == 3
+
+    reloj[0] += 11
+    assert cache.obtener("a", "auto") is None
+
+    estadisticas = cache.estadisticas()
+    assert estadisticas["hits"] == 2
+    assert estadisticas["misses"] == 2
+    assert estadisticas["evictions"] == 1
+    assert estadisticas["expiraciones"] == 1
+    assert len(cache) == 1
+
+
+def test_cache_compartido_sirve_analisis_entre_instancias(tmp_path, monkeypatch):
+    """Un análisis guardado por un worker debe servirse a otro que abra la misma base."""
+    import app
+    from scripts.cache import CacheCompartido, SistemaCache
+
+    ruta = tmp_path / "cache_compartido.sqlite3"
+    monkeypatch.setattr(app, "cache_compartido", CacheCompartido(ruta, ttl=60))
+    monkeypatch.setattr(app, "cache_respuestas", SistemaCache(max_size=10))
+
+    primero, _, origen = app.obtener_respuesta_normativa("No presentan pólizas", "Financiera", "Municipio")
+    assert primero["encontrado"] is True
+    assert origen is None
+
+    # Otro worker: caché de proceso vacía, misma base compartida
+    otro_worker = CacheCompartido(ruta, ttl=60)
+    monkeypatch.setattr(app, "cache_compartido", otro_worker)
+    monkeypatch.setattr(app, "cache_respuestas", SistemaCache(max_size=10))
+    monkeypatch.setattr(app, "generar_analisis_normativo", lambda *args: pytest.fail("no debió recalcular"))
+
+    # Otra redacción con la misma consulta normalizada reutiliza la entrada
+    segundo, answer, origen = app.obtener_respuesta_normativa("¿no presentan polizas?", "Financiera", "Estatal")
+    assert origen == "compartida"
+    assert segundo["normativas"] == primero["normativas"]
+    assert segundo["ente_tipo"] == "Estatal"
+    assert "analysis-response" in answer
+    assert otro_worker.estadisticas()["hits"] == 1
+
+
+def test_respuesta_sin_coincidencia_se_cachea_con_html(monkeypatch):
+    """Las consultas sin coincidencia también deben servirse desde caché (caché negativa)."""
+    import app
+    from scripts.cache import SistemaCache
+
+    monkeypatch.setattr(app, "cache_compartido", None)
+    monkeypatch.setattr(app, "cache_respuestas", SistemaCache(max_size=10))
+
+    analisis, answer, origen = app.obtener_respuesta_normativa("licitacion obra publica", "Obra Pública")
+    assert analisis["encontrado"] is False
+    assert origen is None
+
+    monkeypatch.setattr(app, "generar_analisis_normativo", lambda *args: pytest.fail("no debió recalcular"))
+    analisis_cache, answer_cache, origen = app.obtener_respuesta_normativa("Licitación, obra pública", "Obra Pública")
+    assert origen == "memoria"
+    assert analisis_cache == analisis
+    assert answer_cache == answer
+
+
+def test_textos_normalizados_precalculados_no_se_recalculan_por_consulta(monkeypatch):
+    """El re-ranking debe usar los textos y tokens precalculados del corpus."""
+    import app
+
+    metadatos = app.motor_busqueda.metadatos_unificados
+    for fila in (0, len(metadatos) - 1):
+        metadato = metadatos[fila]
+        item = metadato["item"]
+        esperado = app.precalcular_textos_normalizados(item, metadato["auditoria"])
+        assert metadato["normalizado"] == esperado
+        assert esperado["tokens"]["descripcion"] == frozenset(app.extraer_tokens_relevantes(item.get("descripcion_irregularidad", "")))
+
+    pregunta = "No presentan pólizas"
+    esperado = app.generar_analisis_normativo(pregunta, "Financiera")
+
+    # Sólo se normaliza la consulta, nunca el texto de los candidatos
+    normalizar = app.normalizar_texto_comparable
+    llamadas = []
+
+    def normalizar_contando(texto):
+        llamadas.append(texto)
+        return normalizar(texto)
+
+    monkeypatch.setattr(app, "normalizar_texto_comparable", normalizar_contando)
+    analisis = app.generar_analisis_normativo(pregunta, "Financiera")
+
+    assert analisis == esperado
+    assert all("_normalizado" not in normativa for normativa in analisis["normativas"])
+    textos_candidatos = {normativa["descripcion"] for normativa in analisis["normativas"]}
+    assert not textos_candidatos & set(llamadas)
+
+
+def test_ask_batch_coincide_con_consultas_individuales(client, monkeypatch):
+    """El lote debe devolver el mismo análisis que cada pregunta por separado, sin tocar el historial."""
+    import app
+    from scripts.cache import SistemaCache
+
+    preguntas = [
+        "conceptos pagados no ejecutados",
+        "No presentan pólizas",
+        "licitacion obra publica",
+        "¿no presentan polizas?",
+    ]
+    monkeypatch.setattr(app, "cache_compartido", None)
+    monkeypatch.setattr(app, "cache_busqueda", SistemaCache(max_size=10))
+    monkeypatch.setattr(app, "cache_respuestas", SistemaCache(max_size=10))
+    esperados = [app.generar_analisis_normativo(pregunta, "auto", "No aplica") for pregunta in preguntas]
+    monkeypatch.setattr(app, "cache_busqueda", SistemaCache(max_size=10))
+
+    with client.session_transaction() as sess:
+        sess["auth_user"] = "luis"
+        sess["usuario"] = "luis"
+
+    r = client.post("/api/ask/batch", json={
+        "preguntas": preguntas + ["x"],
+        "auditoria": "auto",
+        "ente": "No aplica",
+    })
+
+    assert r.status_code == 200
+    data = r.get_json()
+    assert data["success"] is True
+    assert [resultado.get("analisis") for resultado in data["resultados"][:-1]] == esperados
+    assert "error" in data["resultados"][-1]
+    with client.session_transaction() as sess:
+        assert "historial_id" not in sess
+
+    r = client.post("/api/ask/batch", json={"preguntas": "no es lista"})
+    assert r.status_code == 400
+
+
+def test_anotar_hallazgos_escribe_mejor_normativa_por_fila(tmp_path):
+    """La anotación por lotes (con pool de procesos) debe coincidir con la búsqueda individual."""
+    import csv
+    import app
+    from scripts.anotar_hallazgos import _EscritorXLSX, anotar_libro
+    from scripts.utils import _leer_filas_xlsx
+
+    hallazgos = [
+        "conceptos pagados no ejecutados",
+        "No presentan pólizas",
+        "zzz",
+        "pagos improcedentes de nómina",
+        "bitácora de obra incompleta",
+    ]
+    entrada = tmp_path / "hallazgos.xlsx"
+    escritor = _EscritorXLSX(entrada)
+    escritor.escribir(["Número", "Hallazgo"])
+    for numero, hallazgo in enumerate(hallazgos, start=1):
+        escritor.escribir([str(numero), hallazgo])
+    escritor.cerrar()
+
+    salida_csv = tmp_path / "anotado.csv"
+    salida_xlsx = tmp_path / "anotado.xlsx"
+    assert anotar_libro(entrada, salida_csv, [1], "auto", procesos=2, tamano_bloque=2) == len(hallazgos)
+    assert anotar_libro(entrada, salida_xlsx, [1], "auto") == len(hallazgos)
+
+    with open(salida_csv, newline="", encoding="utf-8-sig") as archivo:
+        filas_csv = list(csv.reader(archivo))
+    filas_xlsx = [valores for _, valores in _leer_filas_xlsx(salida_xlsx)]
+
+    assert filas_csv[0][:3] == ["Número", "Hallazgo", "Tipo de irregularidad"]
+    for hallazgo, fila in zip(hallazgos, filas_csv[1:]):
+        normativas = app.extraer_normativas_relevantes("auto", hallazgo)
+        esperado = normativas[0]["tipo_irregularidad"] if normativas else ""
+        assert fila[1] == hallazgo
+        assert fila[2] == esperado
+    # El lector XLSX omite celdas vacías al final de la fila
+    assert [(fila + [""] * 3)[:3] for fila in filas_xlsx] == [fila[:3] for fila in filas_csv]
+
+
+def test_ask_stream_envia_resumen_y_normativas_por_eventos(client):
+    """/ask/stream debe emitir la misma respuesta que /ask, por partes y en orden."""
+    import json
+
+    with client.session_transaction() as sess:
+        sess["auth_user"] = "luis"
+        sess["usuario"] = "luis"
+
+    datos = {
+        "question": "conceptos pagados no ejecutados",
+        "auditoria": "auto",
+        "ente": "No aplica",
+    }
+    esperado = client.post("/ask", data=datos).get_json()
+
+    r = client.post("/ask/stream", data=datos)
+    assert r.status_code == 200
+    assert r.mimetype == "text/event-stream"
+
+    eventos = []
+    for bloque in r.get_data(as_text=True).strip().split("\n\n"):
+        evento, data = bloque.split("\n", 1)
+        eventos.append((evento.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+
+    nombres = [evento for evento, _ in eventos]
+    assert nombres[0] == "inicio" and nombres[-1] == "fin"
+    assert set(nombres[1:-1]) == {"fragmento"}
+    assert "analysis-result" in eventos[0][1]["html"]
+    assert eventos[0][1]["normativas_encontradas"] == esperado["normativas_encontradas"]
+    assert "".join(data.get("html", "") for _, data in eventos) == esperado["answer"]
+
+    import app
+
+    with client.session_transaction() as sess:
+        historial = app.historial_chat.obtener(sess["historial_id"], "luis")
+    assert [msg["answer"] for msg in historial] == [esperado["answer"]] * 2
+
+
+def test_ask_stream_formatea_cada_normativa_una_vez_y_cachea_lo_enviado(client, monkeypatch):
+    """En un fallo de caché el stream no formatea la respuesta completa antes del primer evento."""
+    import json
+
+    import app
+
+    with client.session_transaction() as sess:
+        sess["auth_user"] = "luis"
+        sess["usuario"] = "luis"
+
+    monkeypatch.setattr(app, "formatear_respuesta_normativa", lambda analisis: pytest.fail("no debió formatear todo"))
+    formatear = app.formatear_normativa_individual
+    formateadas = []
+
+    def formatear_contando(normativa, numero, solo_normativa=False):
+        formateadas.append(numero)
+        return formatear(normativa, numero, solo_normativa=solo_normativa)
+
+    monkeypatch.setattr(app, "formatear_normativa_individual", formatear_contando)
+    monkeypatch.setattr(app, "cache_compartido", None)
+    app.cache_respuestas.limpiar()
+    pregunta = "conceptos pagados no ejecutados"
+    clave = app.clave_cache_analisis(pregunta, "auto")
+
+    r = client.post("/ask/stream", data={"question": pregunta, "auditoria": "auto", "ente": "No aplica"})
+    eventos = [
+        json.loads(bloque.split("\n", 1)[1].removeprefix("data: "))
+        for bloque in r.get_data(as_text=True).strip().split("\n\n")
+    ]
+    assert "tiempo_procesamiento" in eventos[-1]
+
+    respuesta = app.cache_respuestas.obtener_por_clave(clave)
+    assert respuesta["analisis"]["encontrado"] is True
+    assert formateadas == list(range(1, len(respuesta["analisis"]["normativas"]) + 1))
+    assert respuesta["answer"] == "".join(evento.get("html", "") for evento in eventos)
+    assert respuesta["answer"] == "\n".join(app.generar_fragmentos_respuesta(respuesta["analisis"]))
+
+
+def test_cliente_llm_reintenta_respeta_plazo_y_abre_cortocircuito():
+    """El cliente debe reintentar errores transitorios, cortar en el plazo y abrir el cortocircuito."""
+    import time
+    from scripts.cliente_llm import CircuitoAbierto, ClienteLLM, Cortocircuito, PlazoAgotado, ServidorLLMSimulado
+
+    mensajes = [{"role": "user", "content": "hola"}]
+
+    with ServidorLLMSimulado(fallos=[503, 429]) as simulado:
+        cliente = ClienteLLM(simulado.url, "clave", "modelo", plazo=5, backoff_base=0.01)
+        assert cliente.completar(mensajes) == "[simulado] hola"
+        assert len(simulado.solicitudes) == 3
+
+    with ServidorLLMSimulado(latencia=2.0) as lento:
+        cliente = ClienteLLM(lento.url, "clave", "modelo", plazo=0.3, reintentos=5, backoff_base=0.01)
+        inicio = time.monotonic()
+        with pytest.raises(PlazoAgotado):
+            cliente.completar(mensajes)
+        assert time.monotonic() - inicio < 1.5
+
+    with ServidorLLMSimulado(fallos=[500] * 10) as caido:
+        cliente = ClienteLLM(
+            caido.url, "clave", "modelo", plazo=5, reintentos=1, backoff_base=0.01,
+            cortocircuito=Cortocircuito(umbral_fallos=2, enfriamiento=60),
+        )
+        with pytest.raises(PlazoAgotado):
+            cliente.completar(mensajes)
+        with pytest.raises(CircuitoAbierto):
+            cliente.completar(mensajes)
+        assert len(caido.solicitudes) == 2
+        assert cliente.cortocircuito.estado == "abierto"
+
+
+def test_cortocircuito_libera_prueba_semiabierta_cancelada():
+    """Una prueba semiabierta cancelada no debe dejar el cortocircuito bloqueado para siempre."""
+    import asyncio
+    from scripts.cliente_llm import ClienteLLM, Cortocircuito, ServidorLLMSimulado
+
+    cortocircuito = Cortocircuito(umbral_fallos=1, enfriamiento=0)
+    cortocircuito.registrar_fallo()
+    assert cortocircuito.estado == "semiabierto"
+
+    with ServidorLLMSimulado(latencia=1.0) as lento:
+        cliente = ClienteLLM(lento.url, "clave", "modelo", plazo=5, cortocircuito=cortocircuito)
+
+        async def cancelar_prueba():
+            tarea = asyncio.ensure_future(cliente.completar_async([{"role": "user", "content": "hola"}]))
+            await asyncio.sleep(0.2)
+            tarea.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await tarea
+
+        asyncio.run(cancelar_prueba())
+
+    assert cortocircuito.permitir() is True
+
+
+def test_errores_no_reintentables_no_abren_el_cortocircuito():
+    """Un 400/401 es un error de la solicitud: no cuenta como fallo del proveedor ni bloquea la prueba semiabierta."""
+    from scripts.cliente_llm import ClienteLLM, Cortocircuito, ErrorLLM, ServidorLLMSimulado
+
+    cortocircuito = Cortocircuito(umbral_fallos=2, enfriamiento=60)
+    with ServidorLLMSimulado(fallos=[400, 401, 404]) as simulado:
+        cliente = ClienteLLM(simulado.url, "clave", "modelo", plazo=5, reintentos=0, cortocircuito=cortocircuito)
+        for _ in range(3):
+            with pytest.raises(ErrorLLM):
+                cliente.completar([{"role": "user", "content": "hola"}])
+        assert cortocircuito.estado == "cerrado"
+
+        # Semiabierto (enfriamiento ya cumplido): la prueba con error 400 se libera sin reabrir el corte
+        semiabierto = Cortocircuito(umbral_fallos=1, enfriamiento=60)
+        semiabierto.registrar_fallo()
+        semiabierto._abierto_desde -= 61
+        simulado.fallos = [400]
+        cliente.cortocircuito = semiabierto
+        with pytest.raises(ErrorLLM):
+            cliente.completar([{"role": "user", "content": "hola"}])
+        assert semiabierto.estado == "semiabierto" and semiabierto.permitir() is True
+
+
+def test_ask_agrega_respuesta_generativa_con_contexto_normativo(client, monkeypatch):
+    """Con proveedor activo, /ask debe enviar las normativas recuperadas como contexto."""
+    import app
+    from scripts.cliente_llm import ClienteLLM, ServidorLLMSimulado
+
+    with client.session_transaction() as sess:
+        sess["auth_user"] = "luis"
+        sess["usuario"] = "luis"
+
+    with ServidorLLMSimulado() as simulado:
+        monkeypatch.setattr(app, "cliente_llm", ClienteLLM(simulado.url, "clave", "qwen-plus", plazo=5))
+        r = client.post("/ask", data={
+            "question": "conceptos pagados no ejecutados",
+            "auditoria": "Obra Pública",
+            "ente": "No aplica",
+        })
+
+    data = r.get_json()
+    assert data["success"] is True
+    assert "analysis-generated" in data["answer"]
+    assert "[simulado]" in data["answer"]
+
+    contexto = simulado.solicitudes[0]["messages"][-1]["content"]
+    assert contexto.startswith("Contexto normativo:")
+    assert "[1] " in contexto
+    assert contexto.endswith("Consulta: conceptos pagados no ejecutados")
+
+
+def test_respuestas_generadas_se_reutilizan_por_registros_y_casi_duplicados(monkeypatch):
+    """Preguntas con los mismos registros recuperados y consulta casi idéntica no deben volver al proveedor."""
+    import app
+    from scripts.cache import CacheRespuestasGeneradas
+
+    llamadas = []
+
+    class ProveedorContado:
+        def completar(self, mensajes):
+            llamadas.append(mensajes)
+            return f"respuesta {len(llamadas)}"
+
+    cache_llm = CacheRespuestasGeneradas(max_size=10, umbral_similitud=0.95)
+    monkeypatch.setattr(app, "cliente_llm", ProveedorContado())
+    monkeypatch.setattr(app, "cache_llm", cache_llm)
+
+    def responder(pregunta):
+        analisis = app.generar_analisis_normativo(pregunta, "Obra Pública")
+        assert analisis["registros_recuperados"]
+        return app.generar_respuesta_llm(pregunta, analisis, "Obra Pública")
+
+    primera = responder("conceptos pagados no ejecutados")
+    assert "respuesta 1" in primera
+    assert responder("¿Conceptos pagados NO ejecutados?") == primera
+    assert responder("los conceptos pagados no ejecutados de la estimacion") == primera
+    assert len(llamadas) == 1
+
+    estadisticas = cache_llm.estadisticas()
+    assert estadisticas["hits_exactos"] == 1
+    assert estadisticas["hits_similares"] == 1
+
+    # Otro conjunto de registros recuperados nunca reutiliza la respuesta
+    vector = app.motor_busqueda.vectorizar_consulta("conceptos pagados ejecutados")
+    assert cache_llm.obtener("conceptos pagados ejecutados", [0], app.motor_busqueda.version_indice, vector) == (None, None)
+
+
+def test_historial_se_guarda_en_servidor_y_la_cookie_solo_lleva_el_id(client, tmp_path, monkeypatch):
+    """La cookie debe llevar sólo el id; el historial se lee del almacén y respeta el recorte."""
+    import app
+    from scripts.historial import HistorialChat
+
+    monkeypatch.setattr(app, "historial_chat", HistorialChat(tmp_path / "historial.sqlite3", max_mensajes=4))
+
+    with client.session_transaction() as sess:
+        sess["auth_user"] = "luis"
+        sess["usuario"] = "luis"
+        # Sesión con el historial antiguo dentro de la cookie: se migra al almacén
+        sess["chat_history"] = [{"question": "previa", "answer": "<p>x</p>", "timestamp": "2026-01-01T00:00:00"}]
+
+    preguntas = ["No presentan pólizas", "conceptos pagados no ejecutados", "licitacion obra publica", "pagos de nómina"]
+    for pregunta in preguntas:
+        r = client.post("/ask", data={"question": pregunta, "auditoria": "auto", "ente": "No aplica"})
+        assert r.status_code == 200
+
+    with client.session_transaction() as sess:
+        assert "chat_history" not in sess
+        conversacion = sess["historial_id"]
+
+    cookie = client.get_cookie("session")
+    assert cookie is not None and len(cookie.value) < 300
+
+    historial = app.historial_chat.obtener(conversacion, "luis")
+    assert [msg["question"] for msg in historial] == ["previa", preguntas[0], preguntas[-2], preguntas[-1]]
+    assert app.historial_chat.obtener(conversacion, "otro_usuario") == []
+    assert preguntas[-1] in client.get("/").get_data(as_text=True)
+
+    client.post("/clear")
+    assert app.historial_chat.obtener(conversacion, "luis") == []
+
+
+def test_registro_de_consultas_alimenta_el_precalentamiento(client, tmp_path, monkeypatch):
+    """Cada consulta se registra en JSONL y las más frecuentes se precalculan en caché al arrancar."""
+    import json
+    import app
+    from scripts.cache import SistemaCache
+    from scripts.registro_consultas import RegistroConsultas
+
+    registro = RegistroConsultas(tmp_path / "consultas.jsonl")
+    monkeypatch.setattr(app, "registro_consultas", registro)
+    monkeypatch.setattr(app, "cache_compartido", None)
+    monkeypatch.setattr(app, "cache_respuestas", SistemaCache(max_size=10))
+
+    with client.session_transaction() as sess:
+        sess["auth_user"] = "luis"
+        sess["usuario"] = "luis"
+
+    for pregunta in ["No presentan pólizas", "¿no presentan polizas?", "conceptos pagados no ejecutados"]:
+        client.post("/ask", data={"question": pregunta, "auditoria": "Financiera", "ente": "No aplica"})
+
+    lineas = [json.loads(linea) for linea in (tmp_path / "consultas.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert [linea["cache"] for linea in lineas] == [None, "memoria", None]
+    assert lineas[0]["consulta"] == lineas[1]["consulta"]
+    assert lineas[0]["registros"] and lineas[0]["latencia_ms"] > 0
+    assert lineas[0]["version"] == app.motor_busqueda.version_indice
+
+    # Nuevo worker: caché vacía, se precalienta con la consulta más frecuente
+    monkeypatch.setattr(app, "cache_respuestas", SistemaCache(max_size=10))
+    assert app.precalentar_cache(top_n=1) == 1
+    _, _, origen = app.obtener_respuesta_normativa("No presentan polizas", "Financiera")
+    assert origen == "memoria"
+
+
+def test_precalentamiento_lee_solo_el_final_del_registro(tmp_path):
+    """Con max_bytes sólo se leen las líneas completas del final, empezando por el archivo más reciente."""
+    import json
+    from scripts.registro_consultas import RegistroConsultas, leer_registros
+
+    registro = RegistroConsultas(tmp_path / "consultas.jsonl", copias=2)
+    lineas = {
+        "consultas.jsonl.2": ["antigua"] * 50,
+        "consultas.jsonl.1": ["intermedia"] * 50,
+        "consultas.jsonl": ["reciente"] * 3,
+    }
+    for nombre, consultas in lineas.items():
+        (tmp_path / nombre).write_text(
+            "".join(json.dumps({"consulta": consulta, "pregunta": consulta}) + "\n" for consulta in consultas),
+            encoding="utf-8",
+        )
+
+    archivos = registro.archivos()
+    assert [ruta.name for ruta in archivos] == list(lineas)
+    assert len(list(leer_registros(archivos))) == 103
+
+    tamano_linea = len(json.dumps({"consulta": "intermedia", "pregunta": "intermedia"})) + 1
+    leidos = [r["consulta"] for r in leer_registros(archivos, max_bytes=(tmp_path / "consultas.jsonl").stat().st_size + 2 * tamano_linea + 5)]
+    assert leidos == ["intermedia"] * 2 + ["reciente"] * 3
+
+
+def test_metricas_prometheus_por_etapa_y_agregadas_entre_workers(client, tmp_path, monkeypatch):
+    """Histogramas por endpoint y etapa, sumados entre workers y expuestos en formato Prometheus."""
+    import json
+    import os
+    import app
+    from scripts.cache import SistemaCache
+    from scripts.metricas import Histograma, MonitorRendimiento
+
+    histograma = Histograma()
+    for milisegundos in range(1, 101):
+        histograma.observar(milisegundos / 1000)
+    assert abs(histograma.percentil(0.5) - 0.050) / 0.050 < 0.19
+    assert abs(histograma.percentil(0.99) - 0.099) / 0.099 < 0.19
+
+    monitor = MonitorRendimiento(tmp_path)
+    monkeypatch.setattr(app, "monitor_rendimiento", monitor)
+    monkeypatch.setattr(app, "cache_compartido", None)
+    monkeypatch.setattr(app, "cache_busqueda", SistemaCache(max_size=10))
+    monkeypatch.setattr(app, "cache_respuestas", SistemaCache(max_size=10))
+    monkeypatch.setattr(app.Config, "METRICAS_TOKEN", "secreto")
+
+    assert client.get("/metrics/prometheus").status_code == 401
+
+    with client.session_transaction() as sess:
+        sess["auth_user"] = "luis"
+        sess["usuario"] = "luis"
+    client.post("/ask", data={"question": "No presentan pólizas", "auditoria": "Financiera", "ente": "No aplica"})
+
+    percentiles = monitor.obtener_metricas()["percentiles"]["/ask"]
+    for etapa in ("normalizar", "vectorizar", "puntuar", "post_filtro", "formatear", "total"):
+        assert percentiles[etapa]["conteo"] >= 1
+    assert percentiles["total"]["p99"] >= percentiles["total"]["p50"] > 0
+
+    # Otro worker vivo (el proceso padre) y uno terminado que no debe sumarse
+    otro = MonitorRendimiento()
+    otro.registrar_solicitud(True, 0.2, "/ask")
+    (tmp_path / f"{os.getppid()}.json").write_text(json.dumps(otro._instantanea()), encoding="utf-8")
+    (tmp_path / "999999999.json").write_text(json.dumps(otro._instantanea()), encoding="utf-8")
+
+    with app.app.test_client() as scraper:
+        r = scraper.get("/metrics/prometheus", headers={"Authorization": "Bearer secreto"})
+    assert r.status_code == 200
+    texto = r.get_data(as_text=True)
+    assert "auditel_workers 2" in texto
+    assert 'auditel_solicitudes_total{resultado="exitosa"} 2' in texto
+    assert 'auditel_duracion_segundos_count{endpoint="/ask",etapa="total"} 2' in texto
+    assert 'auditel_duracion_segundos_bucket{endpoint="/ask",etapa="puntuar",le="+Inf"} ' in texto
+    assert 'auditel_duracion_percentil_segundos{endpoint="/ask",etapa="total",percentil="0.99"}' in texto
+    assert not (tmp_path / "999999999.json").exists()
+
+
+def test_ask_muestreada_devuelve_traza_por_etapa_y_escribe_chrome_trace(client, tmp_path, monkeypatch):
+    """Con muestreo activo, /ask incluye los spans en el JSON y los anexa en formato Chrome Trace."""
+    import json
+    import app
+    from scripts.cache import SistemaCache
+    from scripts.trazas import Trazador
+
+    ruta = tmp_path / "trazas.json"
+    monkeypatch.setattr(app, "trazador", Trazador(muestreo=1.0, ruta=ruta))
+    monkeypatch.setattr(app.Config, "TRAZAS_EN_RESPUESTA", True)
+    monkeypatch.setattr(app, "cache_compartido", None)
+    monkeypatch.setattr(app, "cache_respuestas", SistemaCache(max_size=10))
+    monkeypatch.setattr(app, "cache_busqueda", SistemaCache(max_size=10))
+
+    with client.session_transaction() as sess:
+        sess["auth_user"] = "luis"
+        sess["usuario"] = "luis"
+
+    for _ in range(2):
+        r = client.post("/ask", data={"question": "No presentan pólizas", "auditoria": "Financiera", "ente": "No aplica"})
+    traza = r.get_json()["traza"]
+    nombres = {s["nombre"] for s in traza["spans"]}
+    # La segunda consulta sale de la caché de respuestas: sólo normaliza la clave
+    assert "normalizar" in nombres and "puntuar" not in nombres
+
+    primera = client.post("/ask", data={"question": "conceptos pagados no ejecutados", "auditoria": "Financiera", "ente": "No aplica"})
+    spans = primera.get_json()["traza"]["spans"]
+    nombres = [s["nombre"] for s in spans]
+    for etapa in ("normalizar", "vectorizar", "puntuar", "post_filtro", "deduplicar_normativas_por_texto",
+                  "filtrar_normativas_por_confianza", "formatear"):
+        assert etapa in nombres
+    assert all(s["duracion_ms"] >= 0 for s in spans)
+    assert sum(s["duracion_ms"] for s in spans if s["nivel"] == 0) <= primera.get_json()["traza"]["duracion_ms"]
+
+    contenido = ruta.read_text(encoding="utf-8")
+    assert contenido.startswith("[\n")
+    eventos = json.loads(contenido.rstrip().rstrip(",") + "]")
+    assert [e["name"] for e in eventos if e["cat"] == "solicitud"] == ["/ask"] * 3
+    assert all(e["ph"] == "X" and e["dur"] >= 0 for e in eventos)
+
+    # Sin muestreo no hay traza ni escritura
+    monkeypatch.setattr(app, "trazador", Trazador(muestreo=0.0, ruta=tmp_path / "otra.json"))
+    r = client.post("/ask", data={"question": "No presentan pólizas", "auditoria": "Financiera", "ente": "No aplica"})
+    assert "traza" not in r.get_json()
+    assert not (tmp_path / "otra.json").exists()
+
+
+def test_trazas_rotan_por_tamano_y_conservan_las_copias_recientes(tmp_path):
+    """El archivo de trazas rota al pasar max_bytes; cada rotado es un Chrome Trace válido."""
+    import json
+    from scripts.trazas import Trazador
+
+    ruta = tmp_path / "trazas.json"
+    trazador = Trazador(muestreo=1.0, ruta=ruta, max_bytes=600, copias=2)
+    for _ in range(12):
+        traza, token = trazador.iniciar("/ask")
+        with traza.span("puntuar"):
+            pass
+        trazador.finalizar(traza, token)
+
+    rotados = trazador.rotados()
+    assert len(rotados) == 2
+    for archivo in rotados + ([ruta] if ruta.exists() else []):
+        contenido = archivo.read_text(encoding="utf-8")
+        assert contenido.startswith("[\n")
+        assert json.loads(contenido.rstrip().rstrip(",") + "]")
+    if ruta.exists():
+        assert ruta.stat().st_size < 600
+
+
+def test_benchmark_corpus_sintetico_y_medicion_por_tamano(tmp_path, monkeypatch):
+    """El corpus sintético es reproducible y el benchmark mide el pipeline completo sobre él."""
+    import app
+    from benchmarks.corpus_sintetico import generar_corpus, generar_preguntas
+    from benchmarks.ejecutar import comparar, medir_tamano
+    from scripts.utils import AUDITORIA_DATA
+
+    corpus = generar_corpus(AUDITORIA_DATA, 500)
+    assert sum(len(datos) for datos in corpus.values()) == 500
+    assert set(corpus) == set(AUDITORIA_DATA)
+    assert corpus == generar_corpus(AUDITORIA_DATA, 500)
+    assert generar_preguntas(corpus, 5) == generar_preguntas(corpus, 5)
+
+    monkeypatch.setenv("AUDITEL_INDICE_DIR", str(tmp_path))
+    for atributo in ("motor_busqueda", "cache_busqueda", "cache_respuestas", "cache_compartido"):
+        monkeypatch.setattr(app, atributo, getattr(app, atributo))
+
+    resultado = medir_tamano(app, 500, consultas=10)
+    assert resultado["registros"] == 500
+    assert resultado["con_resultado"] > 0
+    assert resultado["consulta_sin_cache"]["n"] == 10 and resultado["lote"]["preguntas"] == 10
+    assert resultado["consulta_en_cache"]["p50_ms"] < resultado["consulta_sin_cache"]["p50_ms"]
+
+    lineas = comparar({"commit": "a", "resultados": {"t": resultado}}, {"commit": "b", "resultados": {"t": resultado}})
+    assert lineas[0] == "a -> b" and any("construccion_indice_s" in linea and "(x1.00)" in linea for linea in lineas)
+
+
+def test_recarga_en_caliente_publica_motor_nuevo_e_invalida_solo_la_version_anterior(client, tmp_path, monkeypatch):
+    """La recarga construye otro motor, lo publica de golpe y sólo descarta la caché de la versión anterior."""
+    import time
+    import app
+    from scripts.cache import CacheRespuestasGeneradas, SistemaCache
+    from scripts.utils import AUDITORIA_DATA
+
+    monkeypatch.setenv("AUDITEL_INDICE_DIR", str(tmp_path / "indice"))
+    monkeypatch.setattr(app.Config, "PRECALENTAR_TOP", 0)
+    monkeypatch.setattr(app.Config, "RECARGA_MARCA", str(tmp_path / "recarga.marca"))
+    for atributo in ("motor_busqueda", "DB_AUDITORIA", "ESTADISTICAS_DB"):
+        monkeypatch.setattr(app, atributo, getattr(app, atributo))
+    monkeypatch.setattr(app, "cache_compartido", None)
+    monkeypatch.setattr(app, "cache_busqueda", SistemaCache(max_size=50))
+    monkeypatch.setattr(app, "cache_respuestas", SistemaCache(max_size=50))
+    monkeypatch.setattr(app, "cache_llm", CacheRespuestasGeneradas(max_size=10))
+
+    anterior = app.motor_busqueda
+    app.obtener_respuesta_normativa("No presentan pólizas", "Financiera")
+    app.cache_respuestas.guardar_por_clave("de-otra-version", {"analisis": {}}, version="otra")
+    assert len(app.cache_respuestas) == 2 and len(app.cache_busqueda) == 1
+
+    nuevo_registro = {
+        "tipo": "Arrendamiento de maquinaria zafiro sin contrato",
+        "descripcion_irregularidad": "Pagos por arrendamiento de maquinaria zafiro sin contrato firmado",
+        "normatividad_local": "Artículo 99 de la Ley de prueba de recarga",
+    }
+    datos_nuevos = {**{a: list(d) for a, d in AUDITORIA_DATA.items()}}
+    datos_nuevos["Financiera"].append(nuevo_registro)
+    monkeypatch.setattr(app, "calcular_huella_fuentes", lambda: "huella-recargada")
+    monkeypatch.setattr(app, "cargar_auditoria_data", lambda huella: datos_nuevos)
+
+    # Una solicitud en curso conserva el motor con el que empezó
+    with app.app.test_request_context("/ask", method="POST"):
+        app.fijar_motor_de_la_solicitud()
+        resultado = app.recargar_fuentes()
+        assert app.motor_actual() is anterior
+
+    assert resultado["estado"] == "recargado"
+    assert resultado["version_anterior"] == anterior.version_indice != resultado["version"]
+    assert app.motor_busqueda.version_indice == resultado["version"]
+    assert app.motor_busqueda.huella == "huella-recargada"
+    assert resultado["entradas_invalidadas"] == 2
+    assert app.cache_respuestas.obtener_por_clave("de-otra-version") is not None
+    assert len(app.cache_busqueda) == 0
+
+    analisis, _, origen = app.obtener_respuesta_normativa("arrendamiento de maquinaria zafiro", "Financiera")
+    assert origen is None and analisis["encontrado"]
+    assert any("zafiro" in n["tipo_irregularidad"].lower() for n in analisis["normativas"])
+    assert app.recargar_fuentes()["estado"] == "sin_cambios"
+
+    # Disparo manual: marca compartida para los demás workers y recarga de este en segundo plano
+    llamadas = []
+    monkeypatch.setattr(app, "recargar_fuentes", lambda forzar=False: llamadas.append(forzar))
+    monkeypatch.setattr("scripts.auth.ADMIN_USERNAMES", {"luis"})
+    with client.session_transaction() as sess:
+        sess["auth_user"] = "luis"
+        sess["usuario"] = "luis"
+    r = client.post("/api/admin/recargar")
+    assert r.status_code == 202 and r.get_json()["estado"] == "en_curso"
+    for _ in range(50):
+        if llamadas:
+            break
+        time.sleep(0.01)
+    assert llamadas == [False]
+    assert (tmp_path / "recarga.marca").exists()
+
+
+def test_recarga_manual_exige_administrador_agrupa_y_acepta_forzar(client, tmp_path, monkeypatch):
+    """Sólo administradores (o el token); una recarga en curso agrupa las siguientes y ``forzar`` llega a los workers."""
+    import json
+    import threading
+
+    import app
+
+    monkeypatch.setattr(app.Config, "RECARGA_MARCA", str(tmp_path / "recarga.marca"))
+    monkeypatch.setattr(app.Config, "ADMIN_TOKEN", "secreto")
+    monkeypatch.setattr("scripts.auth.ADMIN_USERNAMES", set())
+    llamadas, liberar = [], threading.Event()
+
+    def recargar_lento(forzar=False):
+        llamadas.append(forzar)
+        liberar.wait(5)
+
+    monkeypatch.setattr(app, "recargar_fuentes", recargar_lento)
+
+    assert client.post("/api/admin/recargar").status_code == 401
+    with client.session_transaction() as sess:
+        sess["auth_user"] = "luis"
+        sess["usuario"] = "luis"
+    assert client.post("/api/admin/recargar").status_code == 403
+    assert llamadas == []
+
+    monkeypatch.setattr("scripts.auth.ADMIN_USERNAMES", {"luis"})
+    r = client.post("/api/admin/recargar", json={"forzar": True})
+    assert r.status_code == 202 and r.get_json()["agrupada"] is False
+    assert json.loads((tmp_path / "recarga.marca").read_text(encoding="utf-8"))["forzar"] is True
+    # Mientras la primera sigue en curso, las demás se agrupan sin lanzar otro hilo
+    r = client.post("/api/admin/recargar", headers={"Authorization": "Bearer secreto"})
+    assert r.status_code == 202 and r.get_json()["agrupada"] is True
+    liberar.set()
+    app._recarga_manual["hilo"].join(5)
+    assert llamadas == [True]
+
+    # Otro worker ve la marca cambiada y recarga con el mismo "forzar"
+    firma = app._firma_fuentes()
+    (tmp_path / "recarga.marca").write_text(json.dumps({"forzar": True, "solicitada": "otra"}), encoding="utf-8")
+    monkeypatch.setattr(app.Config, "RECARGA_INTERVALO", 0)
+
+    class Detener(BaseException):
+        pass
+
+    def recargar_y_detener(forzar=False):
+        llamadas.append(forzar)
+        raise Detener
+
+    monkeypatch.setattr(app, "recargar_fuentes", recargar_y_detener)
+    with pytest.raises(Detener):
+        app._vigilar_fuentes(firma)
+    assert llamadas == [True, True]
+
+
+def test_indice_incremental_no_cuenta_terminos_podados_como_nuevos(tmp_path, monkeypatch):
+    """Los términos que el ajuste base podó (max_df) no son vocabulario nuevo, tampoco con el índice cargado de disco."""
+    from app import MotorBusquedaNormativasMejorado
+
+    monkeypatch.setenv("AUDITEL_INDICE_DIR", str(tmp_path))
+    base = {"Financiera": [
+        {"tipo": f"Pagos improcedentes {indice}", "concepto": f"Partida {indice} anexo", "descripcion_irregularidad": "sin comprobante fiscal"}
+        for indice in range(50)
+    ]}
+    agregado = {"tipo": "Pagos improcedentes 12 13 14 15 16 extra", "concepto": "Partida anexo", "descripcion_irregularidad": "sin comprobante fiscal zafiro"}
+    completos = {"Financiera": [*base["Financiera"], agregado]}
+
+    ajustado = MotorBusquedaNormativasMejorado(datos=base, huella="podados")
+    cargado = MotorBusquedaNormativasMejorado(datos=base, huella="podados")
+    assert not ajustado.indice_desde_disco and cargado.indice_desde_disco
+    for motor_base in (ajustado, cargado):
+        assert {"comprobante", "fiscal", "pagos"} <= motor_base.vectorizer.stop_words_
+        # Contando los podados, 9 de 14 tokens serían "nuevos" y se compactaría por vocabulario
+        incremental = motor_base.con_registros_agregados({"Financiera": [agregado]}, datos=completos, huella="mas")
+        assert incremental is not None and incremental.segmentos[-1].tokens_nuevos == 2  # "extra" y "zafiro"
+
+
+def test_indice_incremental_agrega_segmento_delta_dentro_de_la_tolerancia(tmp_path, monkeypatch):
+    """Los registros agregados van a un segmento delta: ranking cercano al reajuste completo y compactación por límites."""
+    import json
+    from app import Config, MotorBusquedaNormativasMejorado
+    from benchmarks.corpus_sintetico import generar_corpus, generar_preguntas
+    from scripts.indice_incremental import registros_agregados
+    from scripts.utils import AUDITORIA_DATA
+
+    monkeypatch.setenv("AUDITEL_INDICE_DIR", str(tmp_path))
+    completos = generar_corpus(AUDITORIA_DATA, 2000)
+    base = {auditoria: registros[:-10] for auditoria, registros in completos.items()}
+    agregados = registros_agregados(base, completos)
+    assert {auditoria: len(registros) for auditoria, registros in agregados.items()} == {a: 10 for a in completos}
+    modificados = {**completos, "Financiera": [{"tipo": "otro"}, *completos["Financiera"][1:]]}
+    assert registros_agregados(base, modificados) is None
+
+    # Con tablas columnares se comparan las huellas por registro, sin decodificar vistas Registro
+    from scripts.indice_persistido import TablaColumnar, registros_columnares
+    base_columnar, completos_columnar, modificados_columnar = (
+        registros_columnares(datos) for datos in (base, completos, modificados)
+    )
+    with monkeypatch.context() as parche:
+        parche.setattr(TablaColumnar, "valor", lambda *args: pytest.fail("decodificó un registro"))
+        assert registros_agregados(base_columnar, modificados_columnar) is None
+        huellas_agregadas = registros_agregados(base_columnar, completos_columnar)
+    assert {auditoria: len(registros) for auditoria, registros in huellas_agregadas.items()} == {a: 10 for a in completos}
+    assert dict(huellas_agregadas["Financiera"][0]) == agregados["Financiera"][0]
+
+    motor_base = MotorBusquedaNormativasMejorado(datos=base, huella="base")
+    incremental = motor_base.con_registros_agregados(agregados, datos=completos, huella="completa")
+    reajustado = MotorBusquedaNormativasMejorado(datos=completos, huella="completa")
+
+    # El motor anterior no cambia (solicitudes en curso) y el nuevo comparte sus arreglos
+    assert motor_base.segmentos == [] and len(motor_base.metadatos_unificados) == 1980
+    assert len(incremental.segmentos) == 1 and len(incremental.metadatos_unificados) == 2000
+    assert incremental.postings_por_termino is motor_base.postings_por_termino
+    assert incremental.version_indice not in (motor_base.version_indice, reajustado.version_indice)
+
+    def por_registro(resultados):
+        return {json.dumps(r["item"], sort_keys=True, ensure_ascii=False): r["similitud"] for r in resultados}
+
+    consultas = [item["tipo"] for registros in agregados.values() for item in registros]
+    consultas += generar_preguntas(completos, 20)
+    coincidencias = []
+    for consulta in consultas:
+        for auditoria in ("auto", "Obra Pública", "Financiera"):
+            obtenidos = incremental.buscar_semanticamente(consulta, auditoria, top_n=5)
+            esperados = por_registro(reajustado.buscar_semanticamente(consulta, auditoria, top_n=5))
+            obtenidos_por_registro = por_registro(obtenidos)
+            assert all(r["indice"] == incremental.metadatos_unificados[r["indice"]]["indice"] for r in obtenidos)
+            assert all(auditoria == "auto" or r["auditoria"] == auditoria for r in obtenidos)
+            for clave in obtenidos_por_registro.keys() & esperados.keys():
+                assert obtenidos_por_registro[clave] == pytest.approx(esperados[clave], rel=0.03)
+            if esperados:
+                coincidencias.append(len(obtenidos_por_registro.keys() & esperados.keys()) / len(esperados))
+    assert min(coincidencias) >= 0.8
+
+    # Cada registro agregado se encuentra por su tipo, también por lote y con el motor invertido
+    tipos = [item["tipo"] for item in agregados["Financiera"]]
+    lote = incremental.buscar_semanticamente_lote(tipos, "Financiera", top_n=5)
+    assert lote == [incremental.buscar_semanticamente(tipo, "Financiera", top_n=5) for tipo in tipos]
+    assert all(any(r["indice"] >= 1980 for r in resultados) for resultados in lote)
+    invertido = MotorBusquedaNormativasMejorado(motor_puntuacion="invertido", datos=base, huella="base")
+    invertido = invertido.con_registros_agregados(agregados, datos=completos, huella="completa")
+    assert [[r["indice"] for r in resultados] for resultados in lote] == [
+        [r["indice"] for r in invertido.buscar_semanticamente(tipo, "Financiera", top_n=5)] for tipo in tipos
+    ]
+
+    # Superado un límite (deriva de IDF, segmentos) hay que compactar: el llamador reconstruye
+    monkeypatch.setattr(Config, "INCREMENTAL_DERIVA_MAX", 0.0)
+    assert motor_base.con_registros_agregados(agregados) is None
+    monkeypatch.setattr(Config, "INCREMENTAL_DERIVA_MAX", 1.0)
+    monkeypatch.setattr(Config, "INCREMENTAL_MAX_SEGMENTOS", 1)
+    assert incremental.con_registros_agregados({"Financiera": [completos["Financiera"][0]]}) is None
+
+
+def test_vectorizador_sin_sklearn_reproduce_tfidf_transform():
+    """El vectorizador de consultas debe dar exactamente la matriz de TfidfVectorizer.transform."""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from app import DB_AUDITORIA, MotorBusquedaNormativasMejorado, motor_busqueda
+    from scripts.vectorizador import VectorizadorConsultas
+
+    parametros = MotorBusquedaNormativasMejorado.PARAMETROS_VECTORIZADOR
+    documentos = [motor_busqueda._crear_documento_texto(item) for datos in DB_AUDITORIA.values() for item in datos]
+    tfidf = TfidfVectorizer(**parametros)
+    tfidf.fit(documentos)
+    vectorizador = VectorizadorConsultas(tfidf.vocabulary_, tfidf.idf_, parametros["stop_words"])
+
+    consultas = documentos + ["¿Qué normativa aplica a PÓLIZAS?", "", "zz xyzzy", "conceptos pagados no ejecutados"]
+    esperada = tfidf.transform(consultas)
+    obtenida = vectorizador.transform(consultas)
+    assert obtenida.shape == esperada.shape
+    assert (obtenida != esperada).nnz == 0
+    assert vectorizador.build_analyzer()("La Obra de 2024") == tfidf.build_analyzer()("La Obra de 2024")
+
+
+PRESUPUESTO_ARRANQUE_S = 3.0
+
+
+def test_arranque_con_indice_persistido_no_importa_sklearn_y_responde_health(tmp_path):
+    """Con el índice en disco, importar app y responder /api/health cabe en el presupuesto y no carga sklearn."""
+    import json
+    import subprocess
+    import sys
+    from pathlib import Path
+
+    entorno = {
+        **os.environ,
+        "AUDITEL_INDICE_DIR": str(tmp_path / "indice"),
+        "AUDITEL_METRICAS_DIR": str(tmp_path / "metricas"),
+        "AUDITEL_REGISTRO_CONSULTAS": str(tmp_path / "consultas.jsonl"),
+        "AUDITEL_HISTORIAL_RUTA": str(tmp_path / "historial.sqlite3"),
+        "AUDITEL_RECARGA_INTERVALO": "0",
+    }
+    codigo = (
+        "import json, sys, time\n"
+        "inicio = time.perf_counter()\n"
+        "import app\n"
+        "respuesta = app.app.test_client().get('/api/health')\n"
+        "print(json.dumps({'segundos': time.perf_counter() - inicio, 'estado': respuesta.status_code,\n"
+        "                  'desde_disco': app.motor_busqueda.indice_desde_disco,\n"
+        "                  'modulos': sorted(m for m in ('sklearn', 'requests') if m in sys.modules)}))\n"
+    )
+    raiz = Path(__file__).resolve().parent.parent
+
+    def arrancar():
+        salida = subprocess.run(
+            [sys.executable, "-c", codigo], cwd=raiz, env=entorno, capture_output=True, text=True, check=True,
+        )
+        return json.loads(salida.stdout.strip().splitlines()[-1])
+
+    # El primer arranque construye y publica el índice (ése sí ajusta con scikit-learn)
+    primero = arrancar()
+    assert primero["desde_disco"] is False and "sklearn" in primero["modulos"]
+
+    segundo = arrancar()
+    assert segundo["estado"] == 200 and segundo["desde_disco"] is True
+    assert segundo["modulos"] == []
+    assert segundo["segundos"] < PRESUPUESTO_ARRANQUE_S
+
+
+def test_precarga_con_gc_freeze_comparte_memoria_entre_workers(tmp_path):
+    """Con preload + gc.freeze cada worker hereda el índice mapeado y su memoria privada es menor que sin congelar."""
+    import json
+    import subprocess
+    import sys
+    from pathlib import Path
+
+    if not Path("/proc/self/smaps_rollup").exists():
+        pytest.skip("Requiere /proc/<pid>/smaps_rollup (Linux)")
+
+    entorno = {
+        **os.environ,
+        "AUDITEL_INDICE_DIR": str(tmp_path / "indice"),
+        "AUDITEL_METRICAS_DIR": str(tmp_path / "metricas"),
+        "AUDITEL_REGISTRO_CONSULTAS": str(tmp_path / "consultas.jsonl"),
+        "AUDITEL_HISTORIAL_RUTA": str(tmp_path / "historial.sqlite3"),
+        "AUDITEL_RECARGA_INTERVALO": "0",
+    }
+    # Reproduce el ciclo de gunicorn con deploy/gunicorn.conf.py: master precargado y dos workers por fork
+    codigo = (
+        "import gc, json, os, sys\n"
+        "precarga = sys.argv[1] == '1'\n"
+        "if precarga:\n"
+        "    gc.disable()\n"
+        "import app\n"
+        "if precarga:\n"
+        "    app.preparar_para_fork()\n"
+        "workers = []\n"
+        "for _ in range(2):\n"
+        "    lectura, escritura = os.pipe()\n"
+        "    pid = os.fork()\n"
+        "    if pid == 0:\n"
+        "        if precarga:\n"
+        "            app.tras_fork()\n"
+        "        for pregunta in ('no presentan polizas', 'conceptos pagados no ejecutados', 'ingresos no registrados'):\n"
+        "            app.obtener_respuesta_normativa(pregunta, 'auto')\n"
+        "        gc.collect()\n"
+        "        cliente = app.app.test_client()\n"
+        "        with cliente.session_transaction() as sesion:\n"
+        "            sesion['auth_user'] = sesion['usuario'] = 'luis'\n"
+        "        salud = cliente.get('/api/health/detalle').get_json()\n"
+        "        salud['memoria_worker']['desde_disco'] = app.motor_busqueda.indice_desde_disco\n"
+        "        os.write(escritura, json.dumps(salud['memoria_worker']).encode())\n"
+        "        os._exit(0)\n"
+        "    os.close(escritura)\n"
+        "    workers.append((pid, lectura))\n"
+        "memorias = []\n"
+        "for pid, lectura in workers:\n"
+        "    memorias.append(json.loads(os.read(lectura, 4096)))\n"
+        "    os.waitpid(pid, 0)\n"
+        "print(json.dumps(memorias))\n"
+    )
+    raiz = Path(__file__).resolve().parent.parent
+
+    def servir(precarga):
+        salida = subprocess.run(
+            [sys.executable, "-c", codigo, "1" if precarga else "0"],
+            cwd=raiz, env=entorno, capture_output=True, text=True, check=True,
+        )
+        return json.loads(salida.stdout.strip().splitlines()[-1])
+
+    # Sin índice en disco el master lo ajusta y, antes del fork, lo relee mapeado
+    assert all(memoria["desde_disco"] for memoria in servir(True))
+
+    sin_congelar = servir(False)
+    precargados = servir(True)
+    for memoria in precargados:
+        assert memoria["compartida_mb"] > memoria["privada_mb"]
+    assert max(m["privada_mb"] for m in precargados) < min(m["privada_mb"] for m in sin_congelar)
+
+
+def test_memoria_privada_de_los_workers_no_crece_con_el_corpus(tmp_path):
+    """Con el índice mapeado, la memoria que escribe cada worker es casi la misma con 2 000 que con 30 000 registros."""
+    import json
+    import subprocess
+    import sys
+    from pathlib import Path
+
+    if not Path("/proc/self/smaps_rollup").exists():
+        pytest.skip("Requiere /proc/<pid>/smaps_rollup (Linux)")
+
+    entorno = {
+        **os.environ,
+        "AUDITEL_INDICE_DIR": str(tmp_path / "indice"),
+        "AUDITEL_METRICAS_DIR": str(tmp_path / "metricas"),
+        "AUDITEL_REGISTRO_CONSULTAS": str(tmp_path / "consultas.jsonl"),
+        "AUDITEL_HISTORIAL_RUTA": str(tmp_path / "historial.sqlite3"),
+        "AUDITEL_RECARGA_INTERVALO": "0",
+    }
+    # "construir" persiste registros e índice sintéticos; "servir" los mapea y mide dos workers
+    # (precargados con gc.freeze, o cargando el índice cada uno como con AUDITEL_PRELOAD=0)
+    codigo = (
+        "import gc, json, os, sys\n"
+        "modo, total, precarga = sys.argv[1], int(sys.argv[2]), sys.argv[3] == '1'\n"
+        "huella = f'sintetico-{total}'\n"
+        "if precarga:\n"
+        "    gc.disable()\n"
+        "import app\n"
+        "from benchmarks.corpus_sintetico import generar_corpus, generar_preguntas\n"
+        "from scripts.indice_persistido import cargar_registros, guardar_registros\n"
+        "from scripts.metricas import memoria_proceso\n"
+        "if modo == 'construir':\n"
+        "    guardar_registros(huella, generar_corpus(app.AUDITORIA_DATA, total))\n"
+        "    app.MotorBusquedaNormativasMejorado(datos=cargar_registros(huella), huella=huella)\n"
+        "    sys.exit(0)\n"
+        "datos = cargar_registros(huella)\n"
+        "preguntas = generar_preguntas(datos, 30)\n"
+        "def cargar():\n"
+        "    app.DB_AUDITORIA = datos\n"
+        "    app.motor_busqueda = app.MotorBusquedaNormativasMejorado(datos=datos, huella=huella)\n"
+        "    assert app.motor_busqueda.indice_desde_disco\n"
+        "if precarga:\n"
+        "    cargar()\n"
+        "    app.preparar_para_fork()\n"
+        "workers = []\n"
+        "for _ in range(2):\n"
+        "    lectura, escritura = os.pipe()\n"
+        "    pid = os.fork()\n"
+        "    if pid == 0:\n"
+        "        if precarga:\n"
+        "            app.tras_fork()\n"
+        "        else:\n"
+        "            cargar()\n"
+        "        for pregunta in preguntas:\n"
+        "            app.obtener_respuesta_normativa(pregunta, 'auto')\n"
+        "        gc.collect()\n"
+        "        os.write(escritura, json.dumps(memoria_proceso()).encode())\n"
+        "        os._exit(0)\n"
+        "    os.close(escritura)\n"
+        "    workers.append((pid, lectura))\n"
+        "memorias = []\n"
+        "for pid, lectura in workers:\n"
+        "    memorias.append(json.loads(os.read(lectura, 4096)))\n"
+        "    os.waitpid(pid, 0)\n"
+        "print(json.dumps(memorias))\n"
+    )
+    raiz = Path(__file__).resolve().parent.parent
+
+    def ejecutar(modo, total, precarga=False):
+        salida = subprocess.run(
+            [sys.executable, "-c", codigo, modo, str(total), "1" if precarga else "0"],
+            cwd=raiz, env=entorno, capture_output=True, text=True, check=True,
+        )
+        return salida.stdout.strip().splitlines()[-1] if modo == "servir" else None
+
+    for total in (2000, 30000):
+        ejecutar("construir", total)
+    # Recién escritas, las páginas del índice en el page cache cuentan como sucias hasta el writeback
+    os.sync()
+    for precarga in (True, False):
+        chico, grande = (
+            max(memoria["privada_sucia_mb"] for memoria in json.loads(ejecutar("servir", total, precarga)))
+            for total in (2000, 30000)
+        )
+        # 15 veces más registros: lo escrito por cada worker sólo crece con el vocabulario y las cachés acotadas
+        assert grande - chico < 8, (precarga, chico, grande)
+
+
+def test_registros_columnares_deduplican_cadenas_y_se_leen_como_dicts(tmp_path, monkeypatch):
+    """La tabla columnar guarda cada campo y valor una vez y sus vistas (__slots__) se comportan como dicts."""
+    from app import AUDITORIA_CONFIG, extraer_normativas_relevantes
+    from scripts.indice_persistido import (
+        Registro, TablaColumnar, TablaMetadatos, cargar_registros, guardar_registros, registros_columnares,
+    )
+
+    monkeypatch.setenv("AUDITEL_INDICE_DIR", str(tmp_path))
+    norma = "Artículo 66 de la Ley de Obras Públicas y Servicios Relacionados con las Mismas"
+    registros = {
+        "Obra Pública": [
+            {"tipo": "Pagos en exceso", "normatividad_local_contrato": norma, "acciones_irregularidad": ["uno", 2]},
+            {"tipo": "Obra no ejecutada", "normatividad_local_contrato": norma},
+        ],
+        "Financiera": [{"concepto": "Ingresos", "tipo": "Ingresos no registrados", "monto": 10.5}],
+    }
+
+    tabla = TablaColumnar.desde_registros([item for datos in registros.values() for item in datos])
+    assert tabla.campos == ["tipo", "normatividad_local_contrato", "acciones_irregularidad", "concepto", "monto"]
+    assert tabla.celdas.shape == (3, 5) and tabla.celdas.dtype.name == "int32"
+    assert tabla.celdas[0, 1] == tabla.celdas[1, 1]  # la normativa repetida se guarda una sola vez
+
+    for cargados in (registros_columnares(registros), guardar_registros("h", registros) and cargar_registros("h")):
+        item = cargados["Obra Pública"][0]
+        assert isinstance(item, Registro) and not hasattr(item, "__dict__")
+        assert item == registros["Obra Pública"][0] and dict(item) == registros["Obra Pública"][0]
+        assert list(cargados["Financiera"][0]) == ["concepto", "tipo", "monto"]  # orden original de cada registro
+        assert cargados["Financiera"][0]["monto"] == 10.5
+        assert "concepto" not in item and item.get("concepto", "") == ""
+        with pytest.raises(KeyError):
+            item["monto"]
+
+    # Los metadatos referencian el registro sin copiar tipo ni descripción
+    metadatos = TablaMetadatos(cargados)
+    assert not hasattr(metadatos[1], "__dict__") and metadatos[1]["item"] == registros["Obra Pública"][1]
+    assert metadatos[2].auditoria == "Financiera" and metadatos[2]["indice"] == 2
+
+    resultados = [{"item": cargados["Obra Pública"][0], "similitud": 0.9, "indice": 0, "auditoria": "Obra Pública"}]
+    normativas = extraer_normativas_relevantes("Obra Pública", "pagos en exceso", resultados)
+    assert normativas and normativas[0]["tipo_irregularidad"] == "Pagos en exceso"
+    campo = AUDITORIA_CONFIG["Obra Pública"]["campos_normativas"][1].replace("_", " ").title()
+    assert normativas[0]["normativas"] == {campo: norma}